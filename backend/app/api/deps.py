@@ -0,0 +1,24 @@
+"""
+エンドポイントの依存関係（lifespan で生成した ServiceContainer から各サービスを渡す）
+"""
+from typing import TYPE_CHECKING
+
+from fastapi import Request
+
+from ..services.idempotency import IdempotencyStore
+
+if TYPE_CHECKING:
+    from ..services.openai_service import OpenAIService
+    from ..services.storage import StorageService
+
+
+def get_openai_service(request: Request) -> "OpenAIService":
+    return request.app.state.services.openai
+
+
+def get_storage_service(request: Request) -> "StorageService":
+    return request.app.state.services.storage
+
+
+def get_idempotency_store(request: Request) -> IdempotencyStore:
+    return request.app.state.services.idempotency
@@ -1,43 +1,233 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Optional
+import asyncio
+import json
+import logging
+import os
 import uuid
 
 from ...models.generation import (
-    SinglePageRequest, NextPageRequest, StoryPage
+    SinglePageRequest, NextPageRequest, StoryPage, ImageJobStatus,
+    StoryGenerationRequest, GeneratedStory
 )
-from ...services.openai_service import OpenAIService
-from ...services.supabase_service import SupabaseService
+from ...services.idempotency import IdempotencyStore, IdempotencyConflictError
+from ...services.deadline import DeadlineExceeded, request_deadline
+from ...services.http_pools import http_pool_stats
+from ...observability.metrics import mark_stream_error, observe_stage
+from ..deps import get_idempotency_store, get_openai_service, get_storage_service
+
+if TYPE_CHECKING:
+    from ...services.openai_service import OpenAIService
+    from ...services.storage import StorageService
 
 router = APIRouter(prefix="/generate", tags=["generation"])
 
-# サービスのインスタンス
-openai_service = OpenAIService()
-supabase_service = SupabaseService()
+# サービスは app の lifespan で1回だけ生成し（app/services/container.py）、Depends で受け取る
+
+logger = logging.getLogger(__name__)
+
+# 1リクエスト全体の締め切り（秒）。各段階のタイムアウト・再試行はこの残り時間の範囲で行う
+PAGE_DEADLINE_SECONDS = float(os.getenv("PAGE_DEADLINE_SECONDS", "180"))
+FULL_STORY_DEADLINE_SECONDS = float(os.getenv("FULL_STORY_DEADLINE_SECONDS", "600"))
+
+
+async def _create_story(request: SinglePageRequest, storage_service: "StorageService") -> str:
+    """最初のページ生成に先立ってストーリーを作成し、story_id を返す"""
+    # UUIDを明示的に生成
+    story_uuid = str(uuid.uuid4())
+    
+    # Supabaseに新しいストーリーを作成
+    story_data = {
+        "id": story_uuid,  # UUIDを明示的に指定
+        "title": request.story_title,
+        "total_pages": request.total_pages,
+        "art_style": request.art_style,
+        "main_character_name": request.main_character_name,
+        "user_id": request.user_id,
+        "current_page": 1,
+        "is_complete": False
+    }
+    
+    story = await storage_service.create_story(story_data)
+    return story["id"]
+
+
+async def _load_next_page_context(request: NextPageRequest, storage_service: "StorageService") -> tuple[dict, List[str], str, bool]:
+    """次ページ生成に必要なストーリー行・文脈・前ページ画像URLと、対象ページが保存済みかを取得"""
+    # ストーリーと既存ページ（プロンプトに必要な列のみ）を1リクエストで取得
+    with observe_stage("context_load"):
+        story = await storage_service.get_story_context(request.story_id, through_page=request.page_number - 1)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    pages = story.pop("pages")
+    
+    # ストーリーの文脈（既存のページ）
+    story_context = [page["text"] for page in pages]
+    
+    # 前ページ画像URLを取得（1ページ目以外）
+    previous_image_url = None
+    if request.page_number > 1:
+        prev_page = next((page for page in pages if page["page_number"] == request.page_number - 1), None)
+        if prev_page:
+            previous_image_url = prev_page.get("image_url")
+    page_exists = any(page["page_number"] == request.page_number for page in pages)
+    return story, story_context, previous_image_url, page_exists
+
+
+async def _get_saved_page(request: NextPageRequest, storage_service: "StorageService") -> Optional[StoryPage]:
+    """保存済みのページを StoryPage として取得（無ければ None）"""
+    row = await storage_service.get_page_by_story_and_number(request.story_id, request.page_number)
+    if not row:
+        return None
+    return StoryPage(
+        page_number=row["page_number"],
+        text=row["text"],
+        image_prompt=row["image_prompt"],
+        image_url=row.get("image_url"),
+        story_id=request.story_id,
+        image_status="ready" if row.get("image_url") else "pending",
+        image_tier=row.get("image_tier"),
+        image_derivatives=row.get("image_derivatives")
+    )
+
+
+async def _run_idempotent(idempotency_store: IdempotencyStore, key: str, func, fingerprint: Optional[str] = None):
+    """同じキーの実行中・完了済みの結果があればそれを返し、無ければ func を実行
+
+    fingerprint（リクエスト本文）はクライアントが Idempotency-Key を送った場合だけ渡し、同じキーで本文が違えば 422 にする。
+    """
+    try:
+        return await idempotency_store.run(key, func, fingerprint=fingerprint)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _next_page_idempotency(request: NextPageRequest, idempotency_key: Optional[str]) -> tuple[str, Optional[str]]:
+    """次ページ生成の冪等キーと fingerprint（ヘッダーのキーが無ければ story_id + page_number をキーにし、本文は確認しない）"""
+    if idempotency_key:
+        return f"next:{request.user_id}:{idempotency_key}", request.model_dump_json()
+    return f"next:{request.story_id}:{request.page_number}", None
+
+
+_PAGE_IMAGE_FIELDS = {"page_number", "image_url", "image_status", "image_tier", "image_job_id", "image_derivatives"}
+
+# 冪等キー付きのストリーミング生成のタスク（クライアントが切断しても生成を続け、再試行が結果を待てるよう参照を保持）
+_stream_tasks = set()
+
+
+def _page_events(page: StoryPage, story_id: str) -> List[tuple[str, dict]]:
+    """保存済み・生成済みのページをストリーミングと同じ text / image イベントにする"""
+    return [
+        ("text", {
+            "page_number": page.page_number,
+            "text": page.text,
+            "image_prompt": page.image_prompt,
+            "story_id": page.story_id or story_id
+        }),
+        ("image", page.model_dump(include=_PAGE_IMAGE_FIELDS)),
+    ]
+
+
+async def _idempotent_stream(
+    idempotency_store: IdempotencyStore, key: str, events: Callable[[], AsyncIterator[tuple[str, dict]]],
+    fingerprint: Optional[str] = None, story_id: Optional[str] = None
+) -> AsyncIterator[tuple[str, dict]]:
+    """ストリーミング生成を冪等キー付きで実行する（キーと結果の StoryPage は非ストリーミングのエンドポイントと共有）
+
+    同じキーの実行中・完了済みの結果があれば、そのページを text / image イベントとして送る。
+    無ければ events() を別タスクで実行してイベントを中継し、最後にイベントをまとめた StoryPage を結果として保存する。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    streamed = False
+
+    async def produce() -> StoryPage:
+        nonlocal streamed
+        streamed = True
+        data = {}
+        async for event, payload in events():
+            data.update(payload)
+            queue.put_nowait((event, payload))
+        return StoryPage(**data)
+
+    # 締め切り（request_deadline）はタスクの作成時のコンテキストから引き継がれる
+    task = asyncio.ensure_future(idempotency_store.run(key, produce, fingerprint=fingerprint))
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+    # 待っているクライアントがいなくなった場合の "never retrieved" 警告を抑制
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    while not task.done() or not queue.empty():
+        if queue.empty():
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                continue
+            yield getter.result()
+        else:
+            yield queue.get_nowait()
+    # 失敗（キーの再利用による IdempotencyConflictError を含む）は _sse_stream で error イベントになる
+    page = task.result()
+    if not streamed:
+        for event in _page_events(page, story_id):
+            yield event
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Server-Sent Events 形式の1イベントを組み立てる"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _sse_stream(events: AsyncIterator[tuple[str, dict]]) -> AsyncIterator[str]:
+    """(イベント名, データ) のストリームをSSEに変換。失敗時は error イベントを送って終了"""
+    try:
+        # ストリームはエンドポイントが返った後に実行されるため、締め切りはここで設定する
+        with request_deadline(PAGE_DEADLINE_SECONDS):
+            async for event, data in events:
+                yield _sse_event(event, data)
+        yield _sse_event("done", {})
+    except DeadlineExceeded as e:
+        logger.error(f"Streaming generation exceeded deadline: {e}")
+        mark_stream_error()
+        yield _sse_event("error", {"detail": f"Generation timed out: {str(e)}"})
+    except Exception as e:
+        logger.error(f"Streaming generation failed: {e}")
+        mark_stream_error()
+        yield _sse_event("error", {"detail": f"Generation failed: {str(e)}"})
+
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # リバースプロキシでのバッファリングを無効化
+}
 
 @router.post("/page/first", response_model=StoryPage)
-async def generate_first_page(request: SinglePageRequest):
-    """最初のページを生成"""
+async def generate_first_page(
+    request: SinglePageRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    openai_service: "OpenAIService" = Depends(get_openai_service),
+    storage_service: "StorageService" = Depends(get_storage_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
+):
+    """最初のページを生成（Idempotency-Key ヘッダーがあれば、再試行には最初の結果を返す）"""
+    if not idempotency_key:
+        return await _generate_first_page(request, openai_service, storage_service)
+    return await _run_idempotent(
+        idempotency_store, f"first:{request.user_id}:{idempotency_key}",
+        lambda: _generate_first_page(request, openai_service, storage_service),
+        fingerprint=request.model_dump_json()
+    )
+
+async def _generate_first_page(
+    request: SinglePageRequest, openai_service: "OpenAIService", storage_service: "StorageService"
+) -> StoryPage:
     try:
-        # UUIDを明示的に生成
-        story_uuid = str(uuid.uuid4())
-        
-        # Supabaseに新しいストーリーを作成
-        story_data = {
-            "id": story_uuid,  # UUIDを明示的に指定
-            "title": request.story_title,
-            "total_pages": request.total_pages,
-            "art_style": request.art_style,
-            "main_character_name": request.main_character_name,
-            "user_id": request.user_id,
-            "current_page": 1,
-            "is_complete": False
-        }
-        
-        story = await supabase_service.create_story(story_data)
-        story_id = story["id"]
+        story_id = await _create_story(request, storage_service)
         
         # user_idとstory_idを渡して最初のページを生成
-        page = await openai_service.generate_single_page(request, request.user_id, story_id)
+        with request_deadline(PAGE_DEADLINE_SECONDS):
+            page = await openai_service.generate_single_page(request, request.user_id, story_id)
         
         # ページ保存はopenai_service.generate_single_page内で実行されるため、ここでは不要
         # 重複を避けるためコメントアウト
@@ -49,36 +239,52 @@ async def generate_first_page(request: SinglePageRequest):
         #     "image_url": page.image_url,
         #     "image_storage_path": f"users/{request.user_id}/{story_id}/page_1.png"
         # }
-        # await supabase_service.create_page(page_data)
+        # await storage_service.create_page(page_data)
         
         # StoryPageモデルにstory_idをセットして返す
         page.story_id = story_id
         return page
         
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"First page generation timed out: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"First page generation failed: {str(e)}")
 
 @router.post("/page/next", response_model=StoryPage)
-async def generate_next_page(request: NextPageRequest):
-    """ユーザーの意図を反映して次のページを生成"""
+async def generate_next_page(
+    request: NextPageRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    openai_service: "OpenAIService" = Depends(get_openai_service),
+    storage_service: "StorageService" = Depends(get_storage_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
+):
+    """ユーザーの意図を反映して次のページを生成
+
+    Idempotency-Key ヘッダー（無ければ story_id + page_number）が同じ再試行は、実行中なら完了を待ち、
+    完了済みなら最初の結果を返す。本文の一致を確認するのはヘッダーのキーの場合だけで、
+    story_id + page_number のキーでは本文（user_direction など）が変わっていても同じページを返す。
+    """
+    key, fingerprint = _next_page_idempotency(request, idempotency_key)
+    return await _run_idempotent(
+        idempotency_store, key, lambda: _generate_next_page(request, openai_service, storage_service),
+        fingerprint=fingerprint
+    )
+
+async def _generate_next_page(
+    request: NextPageRequest, openai_service: "OpenAIService", storage_service: "StorageService"
+) -> StoryPage:
     try:
-        # ストーリーが存在するかチェック
-        story = await supabase_service.get_story(request.story_id)
-        if not story:
-            raise HTTPException(status_code=404, detail="Story not found")
-        
-        # ストーリーの文脈を取得（既存のページ）
-        pages = await supabase_service.get_pages_by_story_id(request.story_id)
-        story_context = [page["text"] for page in pages]
-        
-        # 前ページ画像URLを取得（1ページ目以外）
-        previous_image_url = None
-        if request.page_number > 1:
-            prev_page = await supabase_service.get_page_by_story_and_number(request.story_id, request.page_number - 1)
-            if prev_page:
-                previous_image_url = prev_page.get("image_url")
+        story, story_context, previous_image_url, page_exists = await _load_next_page_context(request, storage_service)
+        if page_exists:
+            # 別ワーカーや再起動前に保存済みのページは再生成せず、保存内容を返す
+            saved_page = await _get_saved_page(request, storage_service)
+            if saved_page:
+                logger.info(f"Page {request.page_number} of story {request.story_id} already saved, replaying")
+                return saved_page
+
         # 次のページを生成（前ページ画像URLとストーリー情報を渡す）
-        page = await openai_service.generate_next_page(request, story_context, previous_image_url, story)
+        with request_deadline(PAGE_DEADLINE_SECONDS):
+            page = await openai_service.generate_next_page(request, story_context, previous_image_url, story)
         
         # ページ保存はopenai_service.generate_next_page内で実行されるため、ここでは不要
         # 重複を避けるためコメントアウト
@@ -90,24 +296,133 @@ async def generate_next_page(request: NextPageRequest):
         #     "image_url": page.image_url,
         #     "image_storage_path": f"users/{request.user_id}/stories/{request.story_id}/pages/page_{request.page_number}.png"
         # }
-        # await supabase_service.create_page(page_data)
+        # await storage_service.create_page(page_data)
         
         # ストーリーの現在ページ数を更新
-        await supabase_service.update_story(request.story_id, {"current_page": request.page_number})
+        await storage_service.update_story(request.story_id, {"current_page": request.page_number})
         
         return page
         
+    except HTTPException:
+        raise
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Next page generation timed out: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Next page generation failed: {str(e)}")
 
+@router.post("/page/first/stream")
+async def stream_first_page(
+    request: SinglePageRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    openai_service: "OpenAIService" = Depends(get_openai_service),
+    storage_service: "StorageService" = Depends(get_storage_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
+):
+    """最初のページをSSEで段階的に返す（text → image → done）
+
+    Idempotency-Key ヘッダーがあれば /page/first と同じキーで冪等に実行し、再試行には最初の結果を送る。
+    """
+    if idempotency_key:
+        async def first_page_events():
+            story_id = await _create_story(request, storage_service)
+            async for event in openai_service.stream_single_page(request, request.user_id, story_id):
+                yield event
+
+        events = _idempotent_stream(
+            idempotency_store, f"first:{request.user_id}:{idempotency_key}", first_page_events,
+            fingerprint=request.model_dump_json()
+        )
+        return StreamingResponse(_sse_stream(events), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    try:
+        story_id = await _create_story(request, storage_service)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"First page generation failed: {str(e)}")
+
+    events = openai_service.stream_single_page(request, request.user_id, story_id)
+    return StreamingResponse(_sse_stream(events), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+@router.post("/page/next/stream")
+async def stream_next_page(
+    request: NextPageRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    openai_service: "OpenAIService" = Depends(get_openai_service),
+    storage_service: "StorageService" = Depends(get_storage_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
+):
+    """次のページをSSEで段階的に返す（text → image → done）
+
+    /page/next と同じ冪等キーで実行し、実行中の再試行は完了を待って、完了済みなら最初の結果を送る。
+    """
+    try:
+        story, story_context, previous_image_url, page_exists = await _load_next_page_context(request, storage_service)
+        saved_page = await _get_saved_page(request, storage_service) if page_exists else None
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Next page generation failed: {str(e)}")
+
+    if saved_page:
+        # 保存済みのページは再生成せず、保存内容をそのまま送る
+        async def saved_page_events():
+            for event in _page_events(saved_page, request.story_id):
+                yield event
+        return StreamingResponse(_sse_stream(saved_page_events()), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+    async def next_page_events():
+        async for event in openai_service.stream_next_page(request, story_context, previous_image_url, story):
+            yield event
+        # ストーリーの現在ページ数を更新（クライアントが切断しても1回だけ実行される）
+        await storage_service.update_story(request.story_id, {"current_page": request.page_number})
+
+    key, fingerprint = _next_page_idempotency(request, idempotency_key)
+    events = _idempotent_stream(idempotency_store, key, next_page_events, fingerprint=fingerprint, story_id=request.story_id)
+    return StreamingResponse(_sse_stream(events), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+@router.post("/story/full", response_model=GeneratedStory)
+async def generate_full_story(
+    request: StoryGenerationRequest,
+    openai_service: "OpenAIService" = Depends(get_openai_service)
+):
+    """絵本全体（全ページのテキストと画像）を一括生成して保存"""
+    try:
+        with request_deadline(FULL_STORY_DEADLINE_SECONDS):
+            return await openai_service.generate_complete_story(request)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=f"Full story generation timed out: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Full story generation failed: {str(e)}")
+
+@router.get("/image/jobs/{job_id}", response_model=ImageJobStatus)
+async def get_image_job_status(job_id: str, openai_service: "OpenAIService" = Depends(get_openai_service)):
+    """画像レンダリングジョブの進捗を取得（IMAGE_RENDER_MODE=queue のとき）"""
+    if openai_service.image_jobs is None:
+        raise HTTPException(status_code=404, detail="Image job queue is not enabled")
+    job = await openai_service.image_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Image job not found")
+
+    payload = job["payload"]
+    result = job["result"] or {}
+    return ImageJobStatus(
+        job_id=job["id"],
+        status=job["status"],
+        attempts=job["attempts"],
+        story_id=payload.get("story_id"),
+        page_number=payload.get("page_number"),
+        image_url=result.get("image_url"),
+        image_derivatives=result.get("image_derivatives"),
+        error=job.get("error") or None
+    )
+
 @router.get("/story/{story_id}")
-async def get_story_progress(story_id: str):
+async def get_story_progress(story_id: str, storage_service: "StorageService" = Depends(get_storage_service)):
     """ストーリーの進行状況を取得"""
-    story = await supabase_service.get_story(story_id)
+    story = await storage_service.get_story(story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
     
-    pages = await supabase_service.get_pages_by_story_id(story_id)
+    pages = await storage_service.get_pages_by_story_id(story_id)
     
     return {
         "story_id": story_id,
@@ -122,7 +437,11 @@ async def get_story_progress(story_id: str):
     }
 
 @router.get("/health")
-async def generation_health():
+async def generation_health(
+    openai_service: "OpenAIService" = Depends(get_openai_service),
+    storage_service: "StorageService" = Depends(get_storage_service),
+    idempotency_store: IdempotencyStore = Depends(get_idempotency_store),
+):
     """生成サービスのヘルスチェック"""
     try:
         # OpenAI APIキーの存在確認
@@ -130,11 +449,22 @@ async def generation_health():
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise HTTPException(status_code=500, detail="OpenAI API key not configured")
+        # 文脈キャッシュを持たない保存先（local）もある
+        context_cache = getattr(storage_service, "context_cache", None)
         
         return {
             "status": "healthy",
             "openai_configured": bool(api_key),
-            "services": ["text_generation", "image_generation"]
+            "services": ["text_generation", "image_generation"],
+            "story_context_cache": context_cache.stats() if context_cache else None,
+            "openai_governor": openai_service.governor.stats(),
+            "idempotency": idempotency_store.stats(),
+            "completion_cache": openai_service.completion_cache.stats() if openai_service.completion_cache else None,
+            "prompt_usage": openai_service.prompt_usage_stats(),
+            "structured_output_failures": openai_service.structured_output_failures,
+            "text_validation": openai_service.text_validation_stats,
+            "openai_resilience": {name: stage.stats() for name, stage in openai_service.stages.items()},
+            "http_pools": http_pool_stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
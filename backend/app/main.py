@@ -1,18 +1,46 @@
 import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 
 # from .api.v1.stories import router as stories_router  # 削除
 from .api.v1.generation import router as generation_router
+from .services.container import ServiceContainer
+from .observability.metrics import MetricsMiddleware, metrics_response
+from .observability.tracing import TracingMiddleware
+from .observability.logging import configure_logging
 
-import logging
+# ログはキュー経由でバックグラウンドスレッドから出力する（LOG_FORMAT / LOG_LEVEL）
+configure_logging()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
-)
 
-app = FastAPI(title="Ehon Backend", version="0.1.0")
+class ImmutableStaticFiles(StaticFiles):
+    """画像は内容のハッシュをパスにしているため、長期キャッシュを許可して配信する"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # サービス（SDK の読み込みとクライアントの生成を含む）はワーカーの起動時に1回だけ作る
+    services = ServiceContainer.create()
+    app.state.services = services
+    # STORAGE_BACKEND=local では画像をローカルディスクから配信する（LOCAL_STORAGE_PUBLIC_URL はここを指す）
+    storage_files_dir = getattr(services.storage, "files_dir", None)
+    if storage_files_dir and not any(getattr(route, "path", None) == "/storage" for route in app.routes):
+        app.mount("/storage", ImmutableStaticFiles(directory=storage_files_dir), name="storage")
+    try:
+        yield
+    finally:
+        await services.aclose()
+
+
+app = FastAPI(title="Ehon Backend", version="0.1.0", lifespan=lifespan)
 
 # CORS
 # When allow_credentials=True, we must not use wildcard origins. Configure via env.
@@ -33,13 +61,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ブラウザのスクリプトから処理時間の内訳とトレースIDを読めるようにする
+    expose_headers=["Server-Timing", "X-Trace-Id"],
 )
 
 
+# エンドポイントごとの所要時間・エラー数（/metrics で公開）
+app.add_middleware(MetricsMiddleware)
+# リクエストのトレース（Server-Timing / X-Trace-Id ヘッダー）
+app.add_middleware(TracingMiddleware)
+
+
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus 形式のメトリクス"""
+    return metrics_response()
+
+
 # app.include_router(stories_router, prefix="/api/v1")  # 削除
 app.include_router(generation_router, prefix="/api/v1")
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, List, Optional
 
 class StoryGenerationRequest(BaseModel):
     theme: str
@@ -8,6 +8,7 @@ class StoryGenerationRequest(BaseModel):
     style: str = "watercolor"  # "watercolor", "cartoon", "realistic" など
     language: str = "japanese"
     user_id: str  # ユーザー識別ID
+    main_character_name: Optional[str] = None  # 主人公の名前（保存用、任意）
 
 class SinglePageRequest(BaseModel):
     """最初のページ生成リクエスト（フロントエンドから渡される基本情報）"""
@@ -31,6 +32,11 @@ class StoryPage(BaseModel):
     image_prompt: str
     image_url: Optional[str] = None
     story_id: Optional[str] = None
+    image_status: Optional[str] = None   # 画像の状態（"ready" / "pending"）
+    image_job_id: Optional[str] = None   # 画像をジョブキューで生成中の場合のジョブID
+    image_tier: Optional[str] = None     # 保存済み画像の品質段階（"preview": 最終画像に差し替え予定 / "final"）
+    # 縮小版・サムネイル: {"webp_320": {"path", "url", "format", "width", "height", "bytes"}, "thumbnail": {...}}
+    image_derivatives: Optional[Dict[str, dict]] = None
 
 class GeneratedStory(BaseModel):
     id: str
@@ -49,3 +55,32 @@ class ImageGenerationRequest(BaseModel):
 class ImageGenerationResponse(BaseModel):
     image_url: str
     revised_prompt: str
+
+class ImageJobStatus(BaseModel):
+    """画像レンダリングジョブの進捗"""
+    job_id: str
+    status: str                  # "pending" / "running" / "succeeded" / "failed"
+    attempts: int = 0
+    story_id: Optional[str] = None
+    page_number: Optional[int] = None
+    image_url: Optional[str] = None
+    image_derivatives: Optional[Dict[str, dict]] = None
+    error: Optional[str] = None
+
+class PageContent(BaseModel):
+    """OpenAI が生成する1ページ分の内容（構造化出力のJSON Schemaとして使用）"""
+    model_config = ConfigDict(extra="forbid")
+    page_number: int
+    text: str                    # ひらがなの本文
+    image_prompt: str            # 英語のイラスト用プロンプト
+
+class PageTextRepair(BaseModel):
+    """ルール違反を直した本文（修正依頼の構造化出力のJSON Schemaとして使用）"""
+    model_config = ConfigDict(extra="forbid")
+    text: str
+
+class StoryContent(BaseModel):
+    """OpenAI が生成する絵本全体の内容（構造化出力のJSON Schemaとして使用）"""
+    model_config = ConfigDict(extra="forbid")
+    title: str
+    pages: List[PageContent]
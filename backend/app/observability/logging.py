@@ -0,0 +1,137 @@
+"""
+ログ設定
+
+アプリのログはキュー（QueueHandler）に積むだけにして、整形と書き出しはバックグラウンドスレッド（QueueListener）で行う。
+生成のたびにイベントループ上で標準エラーへ書き込んだり、大きなプロンプト・応答を文字列化したりしないため。
+
+- LOG_FORMAT=json（デフォルト）では1行1件の JSON（trace_id 付き）、text では従来の形式で出力する
+- メッセージと payload の各フィールドは LOG_MAX_FIELD_CHARS 文字で切り詰める
+- プロンプトや応答の全文などの payload ログ（log_payload）は LOG_PAYLOAD_SAMPLE_RATE の割合だけ記録する
+"""
+import os
+import sys
+import json
+import atexit
+import random
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Optional
+
+from .tracing import current_trace_id
+
+PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "1000"))
+
+_TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def truncate(value: str, limit: int = None) -> str:
+    limit = MAX_FIELD_CHARS if limit is None else limit
+    if limit <= 0 or len(value) <= limit:
+        return value
+    return f"{value[:limit]}…(+{len(value) - limit} chars)"
+
+
+def _json_default(value):
+    # Pydantic モデルなどはそのまま渡せるようにする（文字列化は書き出しスレッドで行う）
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def _serialize_field(value) -> object:
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=_json_default)
+    return truncate(value)
+
+
+def log_payload(target: logging.Logger, message: str, **fields) -> None:
+    """プロンプト・応答の全文などの大きな内容を、LOG_PAYLOAD_SAMPLE_RATE の割合だけ INFO で記録する
+
+    fields はそのまま渡し、文字列化・切り詰めは書き出しスレッドで行う（記録しない場合のコストはほぼ無い）。
+    """
+    if PAYLOAD_SAMPLE_RATE <= 0 or not target.isEnabledFor(logging.INFO):
+        return
+    if PAYLOAD_SAMPLE_RATE < 1 and random.random() >= PAYLOAD_SAMPLE_RATE:
+        return
+    target.info(message, extra={"payload": fields})
+
+
+class JSONFormatter(logging.Formatter):
+    """1行1件の JSON に整形する"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        payload = getattr(record, "payload", None)
+        if payload:
+            entry["payload"] = {key: _serialize_field(value) for key, value in payload.items()}
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """従来の1行形式（payload は key=value で末尾に付ける）"""
+
+    def __init__(self):
+        super().__init__(_TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        payload = getattr(record, "payload", None)
+        if payload:
+            line += " " + " ".join(f"{key}={_serialize_field(value)}" for key, value in payload.items())
+        return line
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """呼び出し元のコンテキストで trace_id だけを付けてキューに積む（整形は書き出しスレッドで行う）"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.trace_id = current_trace_id()
+        # 標準の prepare は呼び出し元のスレッドでメッセージを整形するため、ここでは何もしない
+        return record
+
+
+def configure_logging() -> None:
+    """ルートロガーをキュー経由の非同期出力に設定する（プロセスごとに1回呼ぶ）"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "text" else JSONFormatter())
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_ContextQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
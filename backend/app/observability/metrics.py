@@ -0,0 +1,180 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+from .tracing import route_template, span
+
+# 処理段階の所要時間（テキスト・画像は数十秒かかるため上限を長めに取る）
+_STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "ehon_stage_duration_seconds",
+    "処理段階ごとの所要時間（context_load / text_completion / image_render / b64_decode / storage_upload / image_derivatives / db_insert）",
+    ["stage", "outcome"],
+    buckets=_STAGE_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "ehon_http_request_duration_seconds",
+    "エンドポイントごとのリクエスト所要時間（SSE はストリーム終了まで）",
+    ["method", "endpoint", "status"],
+    buckets=_STAGE_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "ehon_openai_tokens_total",
+    "OpenAI の usage から集計したトークン数（type: prompt / completion / cached）",
+    ["endpoint", "model", "type"],
+)
+FALLBACK_IMAGES = Counter(
+    "ehon_fallback_images_total",
+    "画像生成に失敗してプレースホルダー画像を返した回数",
+    ["source"],
+)
+ENDPOINT_ERRORS = Counter(
+    "ehon_endpoint_errors_total",
+    "エンドポイントごとのエラー数（status: HTTPステータス、または SSE の error イベントなら stream_error）",
+    ["method", "endpoint", "status"],
+)
+
+# 外部 API への HTTP 接続プール（pool: openai / supabase）。ゲージは複数ワーカーでは合計する
+HTTP_POOL_WAIT_SECONDS = Histogram(
+    "ehon_http_pool_wait_seconds",
+    "接続プールから接続を割り当てられるまでの待ち時間（新規接続の確立は含まない）",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_POOL_CONNECTS = Counter(
+    "ehon_http_pool_connects_total",
+    "新しく確立した接続の数（TCP + TLS ハンドシェイク）",
+    ["pool"],
+)
+HTTP_POOL_REQUESTS_IN_FLIGHT = Gauge(
+    "ehon_http_pool_requests_in_flight",
+    "接続プールで処理中のリクエスト数（接続待ちを含む）",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+HTTP_POOL_CONNECTIONS = Gauge(
+    "ehon_http_pool_connections",
+    "開いている接続の数（state: active / idle）",
+    ["pool", "state"],
+    multiprocess_mode="livesum",
+)
+HTTP_POOL_MAX_CONNECTIONS = Gauge(
+    "ehon_http_pool_max_connections",
+    "接続数の上限（利用率は ehon_http_pool_connections{state=\"active\"} / これ）",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+# リクエストごとの状態（SSE の本文はエンドポイントの外で生成されるため、ミドルウェアとはこの dict を共有する）
+_request_state: ContextVar[Optional[dict]] = ContextVar("metrics_request_state", default=None)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """with の中の所要時間を処理段階のヒストグラムに記録する（例外時は outcome="error"）。トレース中ならスパンも記録する"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(stage):
+            yield
+        outcome = "ok"
+    finally:
+        STAGE_SECONDS.labels(stage, outcome).observe(time.perf_counter() - started)
+
+
+def record_token_usage(endpoint: Optional[str], model: Optional[str], usage) -> None:
+    """chat.completions の response.usage をトークン数のカウンタに加算"""
+    if usage is None:
+        return
+    endpoint = endpoint or "other"
+    model = model or "unknown"
+    details = getattr(usage, "prompt_tokens_details", None)
+    OPENAI_TOKENS.labels(endpoint, model, "prompt").inc(usage.prompt_tokens or 0)
+    OPENAI_TOKENS.labels(endpoint, model, "completion").inc(usage.completion_tokens or 0)
+    OPENAI_TOKENS.labels(endpoint, model, "cached").inc(getattr(details, "cached_tokens", None) or 0)
+
+
+def record_fallback_image(source: str) -> None:
+    FALLBACK_IMAGES.labels(source).inc()
+
+
+def record_pool_wait(pool: str, seconds: float) -> None:
+    HTTP_POOL_WAIT_SECONDS.labels(pool).observe(seconds)
+
+
+def record_pool_connect(pool: str) -> None:
+    HTTP_POOL_CONNECTS.labels(pool).inc()
+
+
+def set_pool_state(pool: str, in_flight: int, active: int, idle: int, max_connections: int) -> None:
+    HTTP_POOL_REQUESTS_IN_FLIGHT.labels(pool).set(in_flight)
+    HTTP_POOL_CONNECTIONS.labels(pool, "active").set(active)
+    HTTP_POOL_CONNECTIONS.labels(pool, "idle").set(idle)
+    HTTP_POOL_MAX_CONNECTIONS.labels(pool).set(max_connections)
+
+
+def mark_stream_error() -> None:
+    """SSE で error イベントを送ったことを記録（レスポンスのステータスは 200 のため）"""
+    state = _request_state.get()
+    if state is not None:
+        state["stream_error"] = True
+
+
+class MetricsMiddleware:
+    """エンドポイントごとの所要時間とエラー数を記録する ASGI ミドルウェア
+
+    endpoint ラベルにはマウント先のプレフィックスを含むルートのパステンプレート（/api/v1/generate/image/jobs/{job_id} など）を使い、
+    どのルートにも一致しなかったリクエストは "unmatched" にまとめる。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = {"status": 500, "stream_error": False}
+        token = _request_state.set(state)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_state.reset(token)
+            endpoint = route_template(scope) or "unmatched"
+            method = scope["method"]
+            status = str(state["status"])
+            HTTP_REQUEST_SECONDS.labels(method, endpoint, status).observe(time.perf_counter() - started)
+            if state["status"] >= 400:
+                ENDPOINT_ERRORS.labels(method, endpoint, status).inc()
+            if state["stream_error"]:
+                ENDPOINT_ERRORS.labels(method, endpoint, "stream_error").inc()
+
+
+def metrics_response() -> Response:
+    """Prometheus のテキスト形式でメトリクスを返す
+
+    複数ワーカー（uvicorn --workers）で動かす場合は PROMETHEUS_MULTIPROC_DIR を設定すると、
+    全ワーカーの値を集計して返す。
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,298 @@
+"""
+リクエストのトレース
+
+ミドルウェアがリクエストごとにトレースを開始し、ルーター・OpenAIService・SupabaseService の各メソッドと
+処理段階（observe_stage）をスパンとして記録する。トレースIDは contextvars で引き継ぐため、
+asyncio のタスク（画像の並行生成やバックグラウンド処理）にも伝わる。
+
+- 終了したスパンは TRACE_EXPORTER（console / jsonl）にバックグラウンドスレッドで書き出す（外部のコレクターは不要）
+- レスポンスには Server-Timing ヘッダー（スパン名ごとの合計時間）と X-Trace-Id ヘッダーを付ける
+"""
+import os
+import sys
+import json
+import time
+import queue
+import secrets
+import inspect
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING", "on").lower() not in ("", "off", "0", "false")
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "on").lower() not in ("", "off", "0", "false")
+# Server-Timing に載せるスパン名の上限（ヘッダーが大きくなりすぎないよう所要時間の長い順に切り詰める）
+SERVER_TIMING_MAX_ENTRIES = 20
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float = field(default_factory=time.time)
+    duration_ms: Optional[float] = None
+    status: str = "ok"
+    attributes: dict = field(default_factory=dict)
+    _started: float = field(default_factory=time.perf_counter, repr=False)
+
+    def finish(self, error: BaseException = None) -> None:
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = type(error).__name__
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+@dataclass
+class Trace:
+    """1リクエスト分のスパン（Server-Timing の集計用）"""
+    trace_id: str
+    spans: List[Span] = field(default_factory=list)
+
+    def server_timing(self) -> str:
+        """終了済みのスパンをスパン名ごとに合計し、Server-Timing ヘッダーの値を作る"""
+        totals = {}
+        for span in self.spans:
+            if span.duration_ms is None:
+                continue
+            total, count = totals.get(span.name, (0.0, 0))
+            totals[span.name] = (total + span.duration_ms, count + 1)
+        entries = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:SERVER_TIMING_MAX_ENTRIES]
+        return ", ".join(
+            f"{name};dur={total:.1f}" + (f';desc="{count}x"' if count > 1 else "")
+            for name, (total, count) in entries
+        )
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+class _SpanExporter:
+    """終了したスパンを1行1件のJSONで書き出す（書き込みはバックグラウンドスレッドで行い、イベントループを塞がない）"""
+
+    def __init__(self, kind: str, path: str = None):
+        self.kind = kind
+        self.path = path
+        self._queue: "queue.SimpleQueue[dict]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._worker, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span.to_dict())
+
+    def _worker(self) -> None:
+        stream = sys.stderr
+        if self.kind == "jsonl":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            stream = open(self.path, "a", encoding="utf-8", buffering=1)
+        while True:
+            record = self._queue.get()
+            try:
+                stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except Exception as e:
+                logger.error(f"Failed to export span: {e}")
+
+
+def _create_exporter() -> Optional[_SpanExporter]:
+    kind = os.getenv("TRACE_EXPORTER", "none").lower()
+    if not TRACING_ENABLED or kind in ("", "none", "off"):
+        return None
+    if kind not in ("console", "jsonl"):
+        logger.warning(f"Unknown TRACE_EXPORTER={kind}; spans are not exported")
+        return None
+    return _SpanExporter(kind, os.getenv("TRACE_FILE", "data/traces.jsonl"))
+
+
+_exporter = _create_exporter()
+
+
+def _start_span(name: str, attributes: dict = None) -> Optional[Span]:
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    parent = _current_span.get()
+    span = Span(
+        name=name,
+        trace_id=trace.trace_id,
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent is not None else None,
+        attributes=dict(attributes or {}),
+    )
+    trace.spans.append(span)
+    return span
+
+
+def _end_span(span: Span, error: BaseException = None) -> None:
+    span.finish(error)
+    if _exporter is not None:
+        _exporter.export(span)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """with の中をスパンとして記録する（トレース中でなければ何もしない）"""
+    started = _start_span(name, attributes)
+    if started is None:
+        yield None
+        return
+    token = _current_span.set(started)
+    try:
+        yield started
+    except BaseException as e:
+        _end_span(started, e)
+        raise
+    else:
+        _end_span(started)
+    finally:
+        _current_span.reset(token)
+
+
+def trace_methods(prefix: str, exclude: tuple = ()):
+    """クラスの async メソッド（async ジェネレーターを含む）を {prefix}.{メソッド名} のスパンで囲むクラスデコレーター"""
+
+    def wrap(name: str, method):
+        span_name = f"{prefix}.{name}"
+
+        if inspect.isasyncgenfunction(method):
+            # ジェネレーターは呼び出し元のコンテキストで再開されるため、現在のスパンは切り替えず時間だけ記録する
+            @functools.wraps(method)
+            async def traced_gen(*args, **kwargs):
+                started = _start_span(span_name)
+                error = None
+                try:
+                    async for item in method(*args, **kwargs):
+                        yield item
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    if started is not None:
+                        _end_span(started, error)
+            return traced_gen
+
+        @functools.wraps(method)
+        async def traced(*args, **kwargs):
+            with span(span_name):
+                return await method(*args, **kwargs)
+        return traced
+
+    def decorate(cls):
+        if not TRACING_ENABLED:
+            return cls
+        for name, method in list(vars(cls).items()):
+            if name in exclude or not (inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method)):
+                continue
+            setattr(cls, name, wrap(name, method))
+        return cls
+
+    return decorate
+
+
+def route_template(scope) -> Optional[str]:
+    """一致したルートの、マウント先のプレフィックスを含むパステンプレート（/api/v1/generate/image/jobs/{job_id} など）
+
+    include_router(prefix=...) で登録したルートの path はルーター内のパスのため、リクエストのパスのうち
+    ルートの正規表現に一致する部分より前をプレフィックスとして付け足す。ルートに一致しなかった場合は None。
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if not template:
+        return None
+    path = scope.get("path", "")
+    path_regex = getattr(route, "path_regex", None)
+    if path_regex is not None:
+        # プレフィックスの短い方から試す（ルートが既にプレフィックスを含む場合は空のまま）
+        start = 0
+        while start != -1:
+            if path_regex.match(path[start:]):
+                return path[:start] + template
+            start = path.find("/", start + 1)
+    return scope.get("root_path", "") + template
+
+
+def _parse_traceparent(value: str) -> tuple[Optional[str], Optional[str]]:
+    """W3C traceparent（00-<trace_id>-<parent_id>-<flags>）からトレースIDと親スパンIDを取り出す"""
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None, None
+    return parts[1], parts[2]
+
+
+class TracingMiddleware:
+    """リクエストごとにトレースを開始し、Server-Timing / X-Trace-Id ヘッダーを付ける ASGI ミドルウェア
+
+    受け取った traceparent ヘッダーがあれば、そのトレースIDを引き継ぐ。
+    SSE はヘッダーを本文より先に送るため、Server-Timing にはストリーム開始までのスパンだけが入る。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        trace_id, parent_id = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        trace = Trace(trace_id=trace_id or secrets.token_hex(16))
+        trace_token = _current_trace.set(trace)
+        root = _start_span(f"{scope['method']} {scope['path']}")
+        root.parent_id = parent_id
+        span_token = _current_span.set(root)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                extra = [(b"x-trace-id", trace.trace_id.encode("latin-1"))]
+                if SERVER_TIMING_ENABLED:
+                    elapsed = (time.perf_counter() - root._started) * 1000
+                    timing = trace.server_timing()
+                    value = f"total;dur={elapsed:.1f}" + (f", {timing}" if timing else "")
+                    extra.append((b"server-timing", value.encode("latin-1")))
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # ルートのパステンプレートが分かったらスパン名を揃える（/api/v1/generate/image/jobs/{job_id} など）
+            template = route_template(scope)
+            if template:
+                root.name = f"{scope['method']} {template}"
+            _end_span(root, error)
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import logging
+from collections import OrderedDict
+from contextlib import closing
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_content(content) -> str:
+    """キーの揺れを避けるため、前後の空白と各行末の空白を取り除く"""
+    if not isinstance(content, str):
+        return json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return "\n".join(line.rstrip() for line in content.strip().splitlines())
+
+
+def completion_cache_key(params: dict) -> str:
+    """モデル・正規化したメッセージ・その他のパラメータから SHA-256 のキーを作る"""
+    normalized = {
+        "model": params.get("model"),
+        "messages": [
+            {"role": m.get("role"), "content": _normalize_content(m.get("content"))}
+            for m in params.get("messages", [])
+        ],
+        "params": {k: v for k, v in params.items() if k not in ("model", "messages")},
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCompletionBackend:
+    """プロセス内の LRU + TTL バックエンド"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 86400.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        self._entries[key] = (time.time() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteCompletionBackend:
+    """ディスク上の SQLite バックエンド（プロセス再起動・複数ワーカー間で共有できる）"""
+
+    def __init__(self, db_path: str, max_entries: int = 10000, ttl_seconds: float = 86400.0):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS completions (
+                  key TEXT PRIMARY KEY,
+                  value TEXT NOT NULL,
+                  created_at REAL NOT NULL,
+                  accessed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed_at ON completions(accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM completions WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: dict) -> None:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            # 期限切れと、上限を超えた分（最終アクセスが古い順）を削除
+            conn.execute("DELETE FROM completions WHERE created_at <= ?", (now - self.ttl_seconds,))
+            conn.execute(
+                """
+                DELETE FROM completions WHERE key IN (
+                  SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: dict) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+
+class CompletionCache:
+    """chat.completions の結果を内容アドレス（リクエストのハッシュ）で保存するキャッシュ
+
+    キャッシュを使うかはエンドポイント単位で指定する（創作性が必要な生成はバイパスさせる）。
+    """
+
+    def __init__(self, backend, endpoints: Iterable[str]):
+        self.backend = backend
+        self.endpoints = set(endpoints)
+        self.hits = 0
+        self.misses = 0
+
+    def enabled_for(self, endpoint: Optional[str]) -> bool:
+        return endpoint is not None and endpoint in self.endpoints
+
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            logger.error(f"Completion cache lookup failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        try:
+            await self.backend.set(key, value)
+        except Exception as e:
+            logger.error(f"Completion cache store failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "endpoints": sorted(self.endpoints),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def create_completion_cache() -> Optional[CompletionCache]:
+    """環境変数 COMPLETION_CACHE_BACKEND（off / memory / sqlite）に応じたキャッシュを生成（off なら None）"""
+    backend_name = os.getenv("COMPLETION_CACHE_BACKEND", "off").lower()
+    if backend_name in ("", "off", "none"):
+        return None
+    max_entries = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "512"))
+    ttl_seconds = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", "86400"))
+    if backend_name == "memory":
+        backend = MemoryCompletionBackend(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    elif backend_name == "sqlite":
+        db_path = os.getenv("COMPLETION_CACHE_DB_PATH", "data/completion_cache.sqlite3")
+        backend = SQLiteCompletionBackend(db_path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    else:
+        raise ValueError(f"Unknown COMPLETION_CACHE_BACKEND: {backend_name}")
+    endpoints = [e.strip() for e in os.getenv("COMPLETION_CACHE_ENDPOINTS", "first").split(",") if e.strip()]
+    return CompletionCache(backend, endpoints)
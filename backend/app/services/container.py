@@ -0,0 +1,52 @@
+"""
+プロセス内で共有するサービス
+
+アプリの lifespan（起動時）に1回だけ生成して app.state.services に置き、各エンドポイントには
+app/api/deps.py の依存関係で渡す。openai / supabase SDK の読み込みとクライアントの生成は
+ここまで遅らせるため、app.main の import は軽く、認証情報が無くても失敗しない。
+"""
+import os
+import logging
+from typing import TYPE_CHECKING
+
+from .idempotency import IdempotencyStore
+
+if TYPE_CHECKING:
+    from .openai_service import OpenAIService
+    from .storage import StorageService
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """保存先・OpenAIService・冪等ストアをまとめて保持する"""
+
+    def __init__(self, storage: "StorageService", openai: "OpenAIService", idempotency: IdempotencyStore):
+        self.storage = storage
+        self.openai = openai
+        self.idempotency = idempotency
+
+    @classmethod
+    def create(cls) -> "ServiceContainer":
+        """環境変数に従ってサービスを生成（保存先は OpenAIService と共有する）"""
+        from .storage import create_storage_service
+        from .openai_service import OpenAIService
+
+        storage = create_storage_service()
+        return cls(
+            storage=storage,
+            openai=OpenAIService(storage),
+            # 再試行（Idempotency-Key / story_id+page_number）で同じ生成を二重に実行しないためのストア
+            idempotency=IdempotencyStore(ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))),
+        )
+
+    async def aclose(self) -> None:
+        """終了処理（バックグラウンド処理の完了待ち、HTTP 接続プールと派生画像のプロセスプールの終了）"""
+        try:
+            await self.openai.aclose()
+        except Exception as e:
+            logger.error(f"Error closing OpenAI service: {e}")
+        from .http_pools import close_http_pools
+        await close_http_pools()
+        from .image_derivatives import shutdown_pool
+        shutdown_pool(wait=False)
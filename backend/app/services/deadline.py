@@ -0,0 +1,29 @@
+import time
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# リクエスト全体の締め切り（time.monotonic() の値）。asyncio のタスクには作成時の値が引き継がれる
+# （ルーターは OpenAI SDK を読み込まずに使えるよう、resilience から分けている）
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """リクエスト全体の締め切りを過ぎた（再試行しない）"""
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]):
+    """この中で実行する処理の締め切りを設定する（None で締め切りなし。バックグラウンド処理用）"""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """締め切りまでの残り秒数（締め切りが無ければ None）"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
@@ -0,0 +1,278 @@
+"""
+外部 API への HTTP 接続プール
+
+OpenAI SDK（AsyncOpenAI）には非同期の、Supabase（supabase-py の PostgREST / Storage は同期クライアント）には
+同期の httpx クライアントを1つずつ用意し、プロセス内で共有する。
+
+- HTTP/2（HTTP2=on、h2 が必要）とキープアライブで、ページ送りが続いても TCP / TLS のハンドシェイクを繰り返さない
+- 接続数の上限は同時実行数（OpenAI はガバナーの text + image、Supabase はスレッドプールのワーカー数）に合わせる
+- プールの接続待ち時間・新規接続数・使用中の接続数を /metrics と /health に出す
+"""
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+import httpx
+
+from ..observability.metrics import record_pool_connect, record_pool_wait, set_pool_state
+
+logger = logging.getLogger(__name__)
+
+HTTP2 = os.getenv("HTTP2", "on").lower() not in ("", "off", "none", "0", "false")
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+HTTP_POOL_TIMEOUT_SECONDS = float(os.getenv("HTTP_POOL_TIMEOUT_SECONDS", "30"))
+
+# 新しい接続を確立したときのイベント（続いて TLS ハンドシェイクが行われる）
+_CONNECT_EVENT = "connection.connect_tcp.complete"
+
+
+def _http2_available() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2=on but the h2 package is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+class _PoolMonitor:
+    """1つのプールの使用状況（リクエスト数・接続待ち時間・新規接続数）を集計する"""
+
+    def __init__(self, name: str, max_connections: int):
+        self.name = name
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.requests = 0
+        self.connects = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # 同期クライアントは Supabase のスレッドプールから並行に使われる
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def attach(self, transport) -> None:
+        self._pool = getattr(transport, "_pool", None)
+
+    def start(self) -> float:
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        return time.perf_counter()
+
+    def assigned(self, started: float) -> None:
+        wait = time.perf_counter() - started
+        with self._lock:
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        record_pool_wait(self.name, wait)
+
+    def connected(self) -> None:
+        with self._lock:
+            self.connects += 1
+        record_pool_connect(self.name)
+
+    def finish(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        active, idle = self._connection_counts()
+        set_pool_state(self.name, self.in_flight, active, idle, self.max_connections)
+
+    def _connection_counts(self) -> tuple[int, int]:
+        connections = getattr(self._pool, "connections", None) or []
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return len(connections) - idle, idle
+
+    def stats(self) -> dict:
+        active, idle = self._connection_counts()
+        return {
+            "max_connections": self.max_connections,
+            "connections_active": active,
+            "connections_idle": idle,
+            "requests_in_flight": self.in_flight,
+            "requests": self.requests,
+            "connects": self.connects,
+            "avg_wait_ms": round(self.wait_seconds_total / self.requests * 1000, 2) if self.requests else 0.0,
+            "max_wait_ms": round(self.wait_seconds_max * 1000, 2),
+        }
+
+
+class _MonitoredAsyncStream(httpx.AsyncByteStream):
+    """応答本文を読み終えて閉じたときに、リクエストの終了を記録する"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, monitor: _PoolMonitor):
+        self._stream = stream
+        self._monitor = monitor
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._monitor.finish()
+
+
+class _MonitoredStream(httpx.SyncByteStream):
+    """_MonitoredAsyncStream の同期版"""
+
+    def __init__(self, stream: httpx.SyncByteStream, monitor: _PoolMonitor):
+        self._stream = stream
+        self._monitor = monitor
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._monitor.finish()
+
+
+class _MonitoredAsyncTransport(httpx.AsyncHTTPTransport):
+    """httpcore の trace 拡張で、接続を割り当てられるまでの待ち時間と新規接続を記録する
+
+    プールは接続を割り当てた後に最初の trace イベント（新規接続なら TCP 接続、再利用ならリクエストの送信）を出すため、
+    そこまでを接続待ちとする。
+    """
+
+    def __init__(self, monitor: _PoolMonitor, **kwargs):
+        super().__init__(**kwargs)
+        self.monitor = monitor
+        monitor.attach(self)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        monitor = self.monitor
+        started = monitor.start()
+        waiting = True
+        parent = request.extensions.get("trace")
+
+        async def trace(event: str, info: dict) -> None:
+            nonlocal waiting
+            if waiting:
+                waiting = False
+                monitor.assigned(started)
+            if event == _CONNECT_EVENT:
+                monitor.connected()
+            if parent is not None:
+                await parent(event, info)
+
+        request.extensions["trace"] = trace
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            monitor.finish()
+            raise
+        response.stream = _MonitoredAsyncStream(response.stream, monitor)
+        return response
+
+
+class _MonitoredTransport(httpx.HTTPTransport):
+    """_MonitoredAsyncTransport の同期版（supabase-py 用）"""
+
+    def __init__(self, monitor: _PoolMonitor, **kwargs):
+        super().__init__(**kwargs)
+        self.monitor = monitor
+        monitor.attach(self)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        monitor = self.monitor
+        started = monitor.start()
+        waiting = True
+        parent = request.extensions.get("trace")
+
+        def trace(event: str, info: dict) -> None:
+            nonlocal waiting
+            if waiting:
+                waiting = False
+                monitor.assigned(started)
+            if event == _CONNECT_EVENT:
+                monitor.connected()
+            if parent is not None:
+                parent(event, info)
+
+        request.extensions["trace"] = trace
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            monitor.finish()
+            raise
+        response.stream = _MonitoredStream(response.stream, monitor)
+        return response
+
+
+def _limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def _timeout(read_timeout: float) -> httpx.Timeout:
+    return httpx.Timeout(
+        read_timeout,
+        connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+        pool=HTTP_POOL_TIMEOUT_SECONDS,
+    )
+
+
+_openai_client: Optional[httpx.AsyncClient] = None
+_storage_client: Optional[httpx.Client] = None
+_monitors: dict = {}
+_clients_lock = threading.Lock()
+
+
+def openai_http_client(default_max_connections: int, read_timeout: float) -> httpx.AsyncClient:
+    """AsyncOpenAI に渡す共有クライアント（OPENAI_HTTP_MAX_CONNECTIONS で上限を変更）"""
+    global _openai_client
+    if _openai_client is None or _openai_client.is_closed:
+        max_connections = int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", str(default_max_connections)))
+        monitor = _PoolMonitor("openai", max_connections)
+        _monitors["openai"] = monitor
+        _openai_client = httpx.AsyncClient(
+            transport=_MonitoredAsyncTransport(monitor, http2=_http2_available(), limits=_limits(max_connections)),
+            timeout=_timeout(read_timeout),
+        )
+    return _openai_client
+
+
+def storage_http_client(default_max_connections: int, read_timeout: float) -> httpx.Client:
+    """supabase-py（PostgREST / Storage）に渡す共有クライアント（SUPABASE_HTTP_MAX_CONNECTIONS で上限を変更）"""
+    global _storage_client
+    with _clients_lock:
+        if _storage_client is None or _storage_client.is_closed:
+            max_connections = int(os.getenv("SUPABASE_HTTP_MAX_CONNECTIONS", str(default_max_connections)))
+            monitor = _PoolMonitor("supabase", max_connections)
+            _monitors["supabase"] = monitor
+            _storage_client = httpx.Client(
+                transport=_MonitoredTransport(monitor, http2=_http2_available(), limits=_limits(max_connections)),
+                timeout=_timeout(read_timeout),
+                # PostgREST / Storage クライアントが自前で作る場合と同じ
+                follow_redirects=True,
+            )
+        return _storage_client
+
+
+def http_pool_stats() -> dict:
+    """プールごとの使用状況（/health 用）"""
+    return {name: monitor.stats() for name, monitor in _monitors.items()}
+
+
+async def close_http_pools() -> None:
+    """共有クライアントを閉じる（次に使うときに作り直す）"""
+    global _openai_client, _storage_client
+    if _openai_client is not None:
+        await _openai_client.aclose()
+        _openai_client = None
+    with _clients_lock:
+        if _storage_client is not None:
+            _storage_client.close()
+            _storage_client = None
@@ -0,0 +1,81 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflictError(Exception):
+    """同じ冪等キーが異なるリクエスト内容で再利用された"""
+
+
+class _Entry:
+    __slots__ = ("future", "fingerprint", "expires_at")
+
+    def __init__(self, future: asyncio.Future, fingerprint: Optional[str], expires_at: float):
+        self.future = future
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """冪等キーごとに実行中マーカーと結果を保持するプロセス内ストア（TTL付き）
+
+    同じキーのリクエストが実行中なら完了を待って同じ結果を返し、完了済みなら保存した結果を返す。
+    失敗した実行は保存しない（再試行で改めて実行される）。
+    """
+
+    def __init__(self, ttl_seconds: float = 900.0, max_entries: int = 4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.executed = 0
+        self.replayed = 0
+
+    def _evict(self, now: float) -> None:
+        for key in [k for k, e in self._entries.items() if e.expires_at < now and e.future.done()]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            key, entry = next(iter(self._entries.items()))
+            if not entry.future.done():
+                break  # 実行中のものは削除しない
+            del self._entries[key]
+
+    async def run(self, key: str, func: Callable[[], Awaitable], fingerprint: Optional[str] = None):
+        """key について func を高々1回だけ実行し、その結果を返す"""
+        now = time.monotonic()
+        self._evict(now)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at >= now:
+            if fingerprint is not None and entry.fingerprint is not None and entry.fingerprint != fingerprint:
+                raise IdempotencyConflictError(f"Idempotency key reused with a different request: {key}")
+            self.replayed += 1
+            logger.info(f"Idempotent replay for {key} ({'completed' if entry.future.done() else 'in progress'})")
+            # 待っている側がキャンセルされても元の実行は止めない
+            return await asyncio.shield(entry.future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = _Entry(future, fingerprint, now + self.ttl_seconds)
+        self.executed += 1
+        try:
+            result = await func()
+        except BaseException as e:
+            self._entries.pop(key, None)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # 待機者がいない場合の "never retrieved" 警告を抑制
+            raise
+        future.set_result(result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "in_progress": sum(1 for e in self._entries.values() if not e.future.done()),
+            "executed": self.executed,
+            "replayed": self.replayed,
+        }
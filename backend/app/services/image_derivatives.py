@@ -0,0 +1,177 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from .image_pipeline import DecodedImage
+
+logger = logging.getLogger(__name__)
+
+# Pillow は任意依存（pip install -e .[images]）。無い場合は派生画像を作らない
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def derivatives_available() -> bool:
+    return Image is not None
+
+
+def _encode(image, fmt: str, quality: int, tmp_dir: Optional[str]) -> dict:
+    """画像を指定フォーマットで一時ファイルへ書き出し、パス・サイズ・SHA-256を返す"""
+    fd, path = tempfile.mkstemp(prefix="story-image-derivative-", suffix=f".{fmt}", dir=tmp_dir)
+    try:
+        options = {"quality": quality}
+        if fmt == "webp":
+            options["method"] = 4  # 圧縮率と速度のバランス（0: 速い 〜 6: 小さい）
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, format=fmt.upper(), **options)
+        # 派生画像は小さいため一括で読んでハッシュを取る
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+    except Exception:
+        os.unlink(path)
+        raise
+    return {"path": path, "size": os.path.getsize(path), "sha256": digest, "width": image.width, "height": image.height}
+
+
+def _render_derivatives(src_path: str, formats: list, widths: list, thumbnail_width: int, quality: int, tmp_dir: Optional[str]) -> dict:
+    """元画像からフォーマット・幅ごとの縮小版とサムネイルを作る（プロセスプール内で実行）
+
+    戻り値は {label: {"path", "size", "sha256", "width", "height", "format"}}。
+    元画像より大きい幅は作らない（拡大しても転送量が増えるだけのため）。
+    """
+    results = {}
+    try:
+        with Image.open(src_path) as source:
+            source.load()
+            # WebP / AVIF はパレット画像を扱えない場合があるため RGB(A) に揃える
+            source = source.convert("RGBA" if "A" in source.getbands() else "RGB")
+            for fmt in formats:
+                for width in widths:
+                    if width >= source.width:
+                        continue
+                    height = round(source.height * width / source.width)
+                    resized = source.resize((width, height), Image.Resampling.LANCZOS)
+                    results[f"{fmt}_{width}"] = dict(_encode(resized, fmt, quality, tmp_dir), format=fmt)
+            # 一覧表示用の正方形サムネイル（WebP）
+            size = min(thumbnail_width, source.width, source.height)
+            thumbnail = ImageOps.fit(source, (size, size), Image.Resampling.LANCZOS)
+            results["thumbnail"] = dict(_encode(thumbnail, "webp", quality, tmp_dir), format="webp")
+    except Exception:
+        for result in results.values():
+            os.unlink(result["path"])
+        raise
+    return results
+
+
+def _get_pool(max_workers: int) -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # fork だとイベントループやスレッドの状態を引き継ぐため spawn で起動
+        _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool(wait: bool = True) -> None:
+    """エンコード用のプロセスプールを終了する（次に使うときに作り直す）
+
+    子プロセスのまま終了するプロセス（ベンチマークのワーカーなど）は、終了前に呼ばないと子の終了待ちで止まる。
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+
+class ImageDerivativeRenderer:
+    """生成画像から WebP / AVIF の縮小版とサムネイルを作り、元画像と同じフォルダ構造で保存する
+
+    Pillow によるエンコードは CPU を占有するため、イベントループではなくプロセスプールで実行する。
+    """
+
+    def __init__(self, storage, bucket: str):
+        self.storage = storage
+        self.bucket = bucket
+        self.enabled = os.getenv("IMAGE_DERIVATIVES", "on").lower() not in ("", "off", "none", "0", "false")
+        formats = [f.strip().lower() for f in os.getenv("IMAGE_DERIVATIVE_FORMATS", "webp").split(",") if f.strip()]
+        self.widths = [int(w) for w in os.getenv("IMAGE_DERIVATIVE_WIDTHS", "320,640").split(",") if w.strip()]
+        self.thumbnail_width = int(os.getenv("IMAGE_THUMBNAIL_WIDTH", "160"))
+        self.quality = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "75"))
+        self.max_workers = int(os.getenv("IMAGE_DERIVATIVE_WORKERS", "2"))
+
+        if self.enabled and not derivatives_available():
+            logger.warning("IMAGE_DERIVATIVES is on but Pillow is not installed (pip install -e .[images]); derivatives are disabled")
+            self.enabled = False
+        if self.enabled and "avif" in formats and not features.check("avif"):
+            logger.warning("This Pillow build has no AVIF support; AVIF derivatives are disabled")
+            formats.remove("avif")
+        self.formats = formats
+
+    async def render_and_store(self, image: DecodedImage, user_id: str, story_id: str, page_number: int) -> Optional[dict]:
+        """派生画像を作成・保存し、{label: {path, url, format, width, height, bytes}} を返す
+
+        派生画像は元画像の表示に必須ではないため、失敗してもログを出して None を返す。
+        """
+        if not self.enabled:
+            return None
+        try:
+            loop = asyncio.get_running_loop()
+            rendered = await loop.run_in_executor(
+                _get_pool(self.max_workers),
+                _render_derivatives,
+                image.path,
+                self.formats,
+                self.widths,
+                self.thumbnail_width,
+                self.quality,
+                os.getenv("IMAGE_TMP_DIR") or None,
+            )
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # 子プロセスが異常終了したプールは再利用できないため、次回作り直す
+                shutdown_pool(wait=False)
+            logger.error(f"Error rendering image derivatives for story {story_id} page {page_number}: {e}")
+            return None
+
+        files = {
+            label: DecodedImage(path=info["path"], size=info["size"], sha256=info["sha256"], peak_buffer_bytes=0)
+            for label, info in rendered.items()
+        }
+        derivatives = {}
+
+        async def store(label: str, info: dict) -> None:
+            file_path, public_url = await self.storage.upload_story_image_derivative(
+                self.bucket, user_id, image.sha256, label, files[label], file_extension=info["format"]
+            )
+            derivatives[label] = {
+                "path": file_path,
+                "url": public_url,
+                "format": info["format"],
+                "width": info["width"],
+                "height": info["height"],
+                "bytes": info["size"],
+            }
+
+        try:
+            await asyncio.gather(*(store(label, info) for label, info in rendered.items()))
+        except Exception as e:
+            logger.error(f"Error storing image derivatives for story {story_id} page {page_number}: {e}")
+            return None
+        finally:
+            for file in files.values():
+                file.cleanup()
+
+        logger.info(
+            f"Image derivatives: story={story_id} page={page_number} original={image.size} "
+            + " ".join(f"{label}={d['bytes']}" for label, d in derivatives.items())
+        )
+        return derivatives
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+from contextlib import closing
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状態
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class SQLiteImageJobQueue:
+    """画像レンダリングジョブの永続キュー（SQLite, WALモード）
+
+    APIプロセスが enqueue し、別プロセスのワーカーが claim → complete / fail する。
+    SQLite の呼び出しはイベントループを塞がないようスレッドで実行する。
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float = 300.0, max_attempts: int = 3):
+        self.db_path = db_path
+        # running のまま lease_seconds を過ぎたジョブ（ワーカー異常終了など）は再取得の対象にする
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS image_jobs (
+                  id TEXT PRIMARY KEY,
+                  status TEXT NOT NULL,
+                  payload TEXT NOT NULL,
+                  result TEXT,
+                  error TEXT,
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  worker_id TEXT,
+                  created_at REAL NOT NULL,
+                  updated_at REAL NOT NULL,
+                  started_at REAL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_image_jobs_status_created ON image_jobs(status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _enqueue(self, payload: dict) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO image_jobs (id, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, JOB_PENDING, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+        return job_id
+
+    def _claim(self, worker_id: str) -> Optional[dict]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            # 取得と running への更新を1トランザクションで行い、複数ワーカー間の二重取得を防ぐ
+            conn.execute("BEGIN IMMEDIATE")
+            # 試行回数が上限に達したままリースが切れたジョブ（毎回ワーカーを落とすジョブなど）は再取得せず failed にする
+            expired = conn.execute(
+                """
+                UPDATE image_jobs
+                SET status = ?, error = ?, updated_at = ?
+                WHERE status = ? AND started_at < ? AND attempts >= ?
+                """,
+                (JOB_FAILED, "lease expired after max attempts", now, JOB_RUNNING, now - self.lease_seconds, self.max_attempts),
+            ).rowcount
+            if expired:
+                logger.error(f"Marked {expired} image job(s) failed: lease expired after {self.max_attempts} attempts")
+            row = conn.execute(
+                """
+                SELECT id FROM image_jobs
+                WHERE status = ? OR (status = ? AND started_at < ? AND attempts < ?)
+                ORDER BY created_at
+                LIMIT 1
+                """,
+                (JOB_PENDING, JOB_RUNNING, now - self.lease_seconds, self.max_attempts),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                """
+                UPDATE image_jobs
+                SET status = ?, worker_id = ?, attempts = attempts + 1, started_at = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (JOB_RUNNING, worker_id, now, now, row["id"]),
+            )
+            job = conn.execute("SELECT * FROM image_jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return self._row_to_job(job)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _complete(self, job_id: str, result: dict) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE image_jobs SET status = ?, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (JOB_SUCCEEDED, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+            )
+
+    def _fail(self, job_id: str, error: str) -> str:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT attempts FROM image_jobs WHERE id = ?", (job_id,)).fetchone()
+            # 試行回数が上限に達するまでは pending に戻して再試行させる
+            status = JOB_FAILED if row is None or row["attempts"] >= self.max_attempts else JOB_PENDING
+            conn.execute(
+                "UPDATE image_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+        return status
+
+    def _get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM image_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM image_jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    async def enqueue(self, payload: dict) -> str:
+        """ジョブを登録し、ジョブIDを返す"""
+        return await asyncio.to_thread(self._enqueue, payload)
+
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        """実行待ちのジョブを1件取得して running にする（無ければ None）"""
+        return await asyncio.to_thread(self._claim, worker_id)
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        await asyncio.to_thread(self._complete, job_id, result)
+
+    async def fail(self, job_id: str, error: str) -> str:
+        """ジョブの失敗を記録し、更新後の状態（pending: 再試行 / failed: 打ち切り）を返す"""
+        return await asyncio.to_thread(self._fail, job_id, error)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def stats(self) -> dict:
+        """状態ごとのジョブ件数"""
+        return await asyncio.to_thread(self._stats)
+
+
+class RedisImageJobQueue:
+    """Redis互換サーバーを使うキュー（redis パッケージがインストールされている場合のみ利用可能）
+
+    簡易実装のため、取得後にワーカーが異常終了したジョブの再取得（リース切れ）は行わない。
+    """
+
+    def __init__(self, url: str, max_attempts: int = 3, prefix: str = "image_jobs"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ValueError("IMAGE_JOB_BACKEND=redis requires the 'redis' package (pip install redis)") from e
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    @property
+    def _pending_key(self) -> str:
+        return f"{self.prefix}:pending"
+
+    @staticmethod
+    def _decode(raw: dict) -> Optional[dict]:
+        if not raw:
+            return None
+        job = dict(raw)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job.get("result") else None
+        job["attempts"] = int(job.get("attempts", 0))
+        for field in ("created_at", "updated_at", "started_at"):
+            job[field] = float(job[field]) if job.get(field) else None
+        return job
+
+    async def enqueue(self, payload: dict) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        await self.redis.hset(self._key(job_id), mapping={
+            "id": job_id,
+            "status": JOB_PENDING,
+            "payload": json.dumps(payload, ensure_ascii=False),
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        await self.redis.lpush(self._pending_key, job_id)
+        return job_id
+
+    async def claim(self, worker_id: str) -> Optional[dict]:
+        job_id = await self.redis.rpop(self._pending_key)
+        if job_id is None:
+            return None
+        now = time.time()
+        await self.redis.hset(self._key(job_id), mapping={
+            "status": JOB_RUNNING, "worker_id": worker_id, "started_at": now, "updated_at": now,
+        })
+        await self.redis.hincrby(self._key(job_id), "attempts", 1)
+        return self._decode(await self.redis.hgetall(self._key(job_id)))
+
+    async def complete(self, job_id: str, result: dict) -> None:
+        await self.redis.hset(self._key(job_id), mapping={
+            "status": JOB_SUCCEEDED, "result": json.dumps(result, ensure_ascii=False), "error": "", "updated_at": time.time(),
+        })
+
+    async def fail(self, job_id: str, error: str) -> str:
+        attempts = int(await self.redis.hget(self._key(job_id), "attempts") or 0)
+        status = JOB_FAILED if attempts >= self.max_attempts else JOB_PENDING
+        await self.redis.hset(self._key(job_id), mapping={"status": status, "error": error, "updated_at": time.time()})
+        if status == JOB_PENDING:
+            await self.redis.lpush(self._pending_key, job_id)
+        return status
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return self._decode(await self.redis.hgetall(self._key(job_id)))
+
+    async def stats(self) -> dict:
+        return {JOB_PENDING: await self.redis.llen(self._pending_key)}
+
+
+def create_image_job_queue():
+    """環境変数 IMAGE_JOB_BACKEND（sqlite / redis）に応じたジョブキューを生成"""
+    backend = os.getenv("IMAGE_JOB_BACKEND", "sqlite").lower()
+    max_attempts = int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS", "3"))
+    if backend == "redis":
+        url = os.getenv("IMAGE_JOB_REDIS_URL", "redis://localhost:6379/0")
+        return RedisImageJobQueue(url, max_attempts=max_attempts)
+    if backend == "sqlite":
+        db_path = os.getenv("IMAGE_JOB_DB_PATH", "data/image_jobs.sqlite3")
+        lease_seconds = float(os.getenv("IMAGE_JOB_LEASE_SECONDS", "300"))
+        return SQLiteImageJobQueue(db_path, lease_seconds=lease_seconds, max_attempts=max_attempts)
+    raise ValueError(f"Unknown IMAGE_JOB_BACKEND: {backend}")
@@ -0,0 +1,70 @@
+import os
+import base64
+import asyncio
+import hashlib
+import logging
+import resource
+import tempfile
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# 一度にデコードするbase64文字数（4の倍数。デコード後はおよそ256KiB）
+DECODE_CHUNK_CHARS = 4 * (256 * 1024 // 3)
+
+
+@dataclass
+class DecodedImage:
+    """デコード済み画像（一時ファイルに書き出し、内容のSHA-256とサイズを保持）"""
+    path: str
+    size: int
+    sha256: str
+    peak_buffer_bytes: int  # デコード中にパイプラインが同時に保持した最大バイト数（base64文字列 + 処理中のチャンク）
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def cleanup(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _decode_b64_to_file(b64_json: str, tmp_dir: str = None) -> DecodedImage:
+    """base64文字列をチャンクごとにデコードして一時ファイルへ書き出す（デコード済みの全体をメモリに持たない）"""
+    fd, path = tempfile.mkstemp(prefix="story-image-", suffix=".bin", dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    peak_chunk = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for start in range(0, len(b64_json), DECODE_CHUNK_CHARS):
+                encoded = b64_json[start:start + DECODE_CHUNK_CHARS]
+                chunk = base64.b64decode(encoded, validate=True)
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+                peak_chunk = max(peak_chunk, len(encoded) + len(chunk))
+    except Exception:
+        os.unlink(path)
+        raise
+    return DecodedImage(path=path, size=size, sha256=digest.hexdigest(), peak_buffer_bytes=len(b64_json) + peak_chunk)
+
+
+async def decode_b64_image(b64_json: str) -> DecodedImage:
+    """base64画像をワーカースレッドでデコードする（イベントループを塞がない）。使用後は cleanup() すること"""
+    try:
+        return await asyncio.to_thread(_decode_b64_to_file, b64_json, os.getenv("IMAGE_TMP_DIR") or None)
+    except Exception as e:
+        raise ValueError(f"Failed to decode base64 image: {e}")
+
+
+def log_render_memory(image: DecodedImage, story_id: str, page_number: int) -> None:
+    """レンダリング1回あたりのメモリ使用量をログ出力"""
+    # ru_maxrss は Linux では KiB 単位
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(
+        f"Image pipeline: story={story_id} page={page_number} size={image.size} "
+        f"peak_buffer={image.peak_buffer_bytes} process_max_rss={max_rss_mb:.1f}MiB"
+    )
@@ -0,0 +1,409 @@
+import os
+import json
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import tempfile
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+from .image_pipeline import DecodedImage
+from .storage import safe_path_segment, story_image_derivative_path, story_image_path
+from ..observability.metrics import observe_stage
+from ..observability.tracing import trace_methods
+from ..observability.logging import log_payload
+
+logger = logging.getLogger(__name__)
+
+# 列名（INSERT / UPDATE に渡されたキーはこの中にあるものだけ受け付ける）
+STORY_COLUMNS = (
+    "id", "title", "total_pages", "current_page", "is_complete", "art_style", "main_character_name",
+    "user_id", "context_summary", "context_summary_through", "created_at", "updated_at",
+)
+PAGE_COLUMNS = (
+    "id", "story_id", "page_number", "text", "image_prompt", "image_url", "image_storage_path",
+    "image_derivatives", "image_tier", "user_prompt", "generated_response", "created_at",
+)
+# JSON として保存する列
+_JSON_COLUMNS = {"image_derivatives", "generated_response"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+  id TEXT PRIMARY KEY,
+  title TEXT NOT NULL,
+  total_pages INTEGER NOT NULL DEFAULT 5,
+  current_page INTEGER NOT NULL DEFAULT 1,
+  is_complete INTEGER NOT NULL DEFAULT 0,
+  art_style TEXT NOT NULL DEFAULT 'watercolor',
+  main_character_name TEXT NOT NULL,
+  user_id TEXT NOT NULL,
+  context_summary TEXT,
+  context_summary_through INTEGER NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+  id TEXT PRIMARY KEY,
+  story_id TEXT NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+  page_number INTEGER NOT NULL,
+  text TEXT NOT NULL,
+  image_prompt TEXT NOT NULL,
+  image_url TEXT,
+  image_storage_path TEXT,
+  image_derivatives TEXT,
+  image_tier TEXT,
+  user_prompt TEXT,
+  generated_response TEXT,
+  created_at TEXT NOT NULL
+);
+-- ページはほぼすべて (story_id, page_number) で引くため、一意インデックスで検索と重複防止を兼ねる
+CREATE UNIQUE INDEX IF NOT EXISTS idx_pages_story_page ON pages(story_id, page_number);
+CREATE INDEX IF NOT EXISTS idx_stories_user_created ON stories(user_id, created_at);
+"""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@trace_methods("storage")
+class LocalStorageService:
+    """SQLite（WALモード）とローカルディスクによる保存先（単一ノード・エッジ向け）
+
+    ストーリー・ページは SQLite に、画像は files_dir/{bucket}/{path} に保存し、
+    public_url_base（main.py の /storage 静的ルート）から配信する。
+    SQLite とファイルの操作はイベントループを塞がないようスレッドで実行する。
+    """
+
+    STORY_CONTEXT_PAGE_COLUMNS = "page_number,text,image_url"
+
+    def __init__(self, db_path: str, files_dir: str, public_url_base: str):
+        self.db_path = db_path
+        self.files_dir = files_dir
+        self.public_url_base = public_url_base.rstrip("/")
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(files_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=30000")
+        # WAL では NORMAL でもコミット済みのデータは壊れない（電源断で直前のコミットが失われることはある）
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @staticmethod
+    def _story_row(row: sqlite3.Row) -> dict:
+        story = dict(row)
+        story["is_complete"] = bool(story["is_complete"])
+        return story
+
+    @staticmethod
+    def _page_row(row: sqlite3.Row) -> dict:
+        page = dict(row)
+        for column in _JSON_COLUMNS & page.keys():
+            if page[column] is not None:
+                page[column] = json.loads(page[column])
+        return page
+
+    @staticmethod
+    def _columns(data: dict, allowed: tuple) -> list:
+        unknown = set(data) - set(allowed)
+        if unknown:
+            raise ValueError(f"Unknown columns: {sorted(unknown)}")
+        return list(data)
+
+    @staticmethod
+    def _encode(column: str, value):
+        if column in _JSON_COLUMNS and value is not None:
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    # --- SQLite（スレッドで実行） ---
+
+    def _insert_story(self, story_data: dict) -> dict:
+        now = _now()
+        story = {"id": str(uuid.uuid4()), "created_at": now, "updated_at": now, **story_data}
+        columns = self._columns(story, STORY_COLUMNS)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"INSERT INTO stories ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                [story[c] for c in columns],
+            )
+            row = conn.execute("SELECT * FROM stories WHERE id = ?", (story["id"],)).fetchone()
+        return self._story_row(row)
+
+    def _select_story(self, story_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM stories WHERE id = ?", (story_id,)).fetchone()
+        return self._story_row(row) if row else None
+
+    def _select_story_context(self, story_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            story = conn.execute("SELECT * FROM stories WHERE id = ?", (story_id,)).fetchone()
+            if story is None:
+                return None
+            pages = conn.execute(
+                f"SELECT {self.STORY_CONTEXT_PAGE_COLUMNS} FROM pages WHERE story_id = ? ORDER BY page_number",
+                (story_id,),
+            ).fetchall()
+        return {**self._story_row(story), "pages": [dict(page) for page in pages]}
+
+    def _update_story(self, story_id: str, update_data: dict) -> Optional[dict]:
+        data = {**update_data, "updated_at": _now()}
+        columns = self._columns(data, STORY_COLUMNS)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"UPDATE stories SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                [data[c] for c in columns] + [story_id],
+            )
+            row = conn.execute("SELECT * FROM stories WHERE id = ?", (story_id,)).fetchone()
+        return self._story_row(row) if row else None
+
+    def _select_page(self, story_id: str, page_number: int) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT * FROM pages WHERE story_id = ? AND page_number = ?", (story_id, page_number)
+            ).fetchone()
+        return self._page_row(row) if row else None
+
+    def _select_pages(self, story_id: str) -> list:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM pages WHERE story_id = ? ORDER BY page_number", (story_id,)).fetchall()
+        return [self._page_row(row) for row in rows]
+
+    def _insert_pages(self, pages_data: list) -> list:
+        now = _now()
+        pages = [{"id": str(uuid.uuid4()), "created_at": now, **page} for page in pages_data]
+        conn = self._connect()
+        try:
+            # 複数ページは1トランザクションで追加する（1件でも失敗したら何も追加しない）
+            conn.execute("BEGIN IMMEDIATE")
+            for page in pages:
+                columns = self._columns(page, PAGE_COLUMNS)
+                conn.execute(
+                    f"INSERT INTO pages ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                    [self._encode(c, page[c]) for c in columns],
+                )
+            conn.execute("COMMIT")
+            placeholders = ", ".join("?" for _ in pages)
+            rows = conn.execute(
+                f"SELECT * FROM pages WHERE id IN ({placeholders}) ORDER BY story_id, page_number",
+                [page["id"] for page in pages],
+            ).fetchall()
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return [self._page_row(row) for row in rows]
+
+    def _update_page(self, story_id: str, page_number: int, update_data: dict) -> Optional[dict]:
+        columns = self._columns(update_data, PAGE_COLUMNS)
+        with closing(self._connect()) as conn:
+            if columns:
+                conn.execute(
+                    f"UPDATE pages SET {', '.join(f'{c} = ?' for c in columns)} WHERE story_id = ? AND page_number = ?",
+                    [self._encode(c, update_data[c]) for c in columns] + [story_id, page_number],
+                )
+            row = conn.execute(
+                "SELECT * FROM pages WHERE story_id = ? AND page_number = ?", (story_id, page_number)
+            ).fetchone()
+        return self._page_row(row) if row else None
+
+    def _file_destination(self, bucket: str, file_path: str) -> str:
+        """files_dir 配下の保存先の絶対パス（files_dir の外を指すパスは ValueError）"""
+        root = os.path.realpath(self.files_dir)
+        destination = os.path.realpath(os.path.join(root, safe_path_segment(bucket, "bucket"), file_path))
+        if os.path.commonpath([root, destination]) != root:
+            raise ValueError(f"Storage path escapes files directory: {bucket}/{file_path}")
+        return destination
+
+    def _write_file(self, bucket: str, file_path: str, file_data: Union[bytes, DecodedImage]) -> bool:
+        """ファイルが無ければ書き込む（一時ファイルに書いてから rename するため、途中の状態は見えない）"""
+        destination = self._file_destination(bucket, file_path)
+        if os.path.exists(destination):
+            return False
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=os.path.dirname(destination))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(file_data, DecodedImage):
+                    with file_data.open() as source:
+                        shutil.copyfileobj(source, f)
+                else:
+                    f.write(file_data)
+            os.replace(tmp_path, destination)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    # --- StorageService ---
+
+    async def create_story(self, story_data: dict) -> dict:
+        """新しいストーリーを作成"""
+        try:
+            return await asyncio.to_thread(self._insert_story, story_data)
+        except Exception as e:
+            logger.error(f"Error creating story: {e}")
+            raise
+
+    async def get_story(self, story_id: str) -> Optional[dict]:
+        """ストーリーを取得"""
+        return await asyncio.to_thread(self._select_story, story_id)
+
+    async def get_story_context(self, story_id: str, through_page: Optional[int] = None) -> Optional[dict]:
+        """ストーリー行と、プロンプトに必要なページ列のみを取得（pages は page_number 順）
+
+        ローカルの SQLite は十分速いため、SupabaseService のような文脈キャッシュは持たない。
+        """
+        return await asyncio.to_thread(self._select_story_context, story_id)
+
+    async def update_story(self, story_id: str, update_data: dict) -> dict:
+        """ストーリーを更新"""
+        try:
+            story = await asyncio.to_thread(self._update_story, story_id, update_data)
+            if story is None:
+                raise ValueError(f"Story not found: {story_id}")
+            return story
+        except Exception as e:
+            logger.error(f"Error updating story: {e}")
+            raise
+
+    async def get_page_by_story_and_number(self, story_id: str, page_number: int) -> Optional[dict]:
+        """指定したストーリーIDとページ番号のページ情報を取得"""
+        return await asyncio.to_thread(self._select_page, story_id, page_number)
+
+    async def get_story_pages(self, story_id: str) -> list:
+        """ストーリーのページ一覧を取得"""
+        return await asyncio.to_thread(self._select_pages, story_id)
+
+    async def get_pages_by_story_id(self, story_id: str) -> list:
+        """ストーリーIDでページ一覧を取得（get_story_pagesのエイリアス）"""
+        return await self.get_story_pages(story_id)
+
+    async def add_page(self, page_data: dict) -> dict:
+        """新しいページを追加"""
+        return (await self.add_pages([page_data]))[0]
+
+    async def add_pages(self, pages_data: list) -> list:
+        """複数ページを1トランザクションでまとめて追加"""
+        try:
+            with observe_stage("db_insert"):
+                return await asyncio.to_thread(self._insert_pages, pages_data)
+        except Exception as e:
+            logger.error(f"Error adding pages: {e}")
+            raise
+
+    async def create_page(self, page_data: dict) -> dict:
+        """新しいページを作成（add_pageのエイリアス）"""
+        return await self.add_page(page_data)
+
+    async def save_page_with_prompt(
+        self,
+        story_id: str,
+        page_number: int,
+        text: str,
+        image_prompt: str,
+        image_url: str,
+        user_prompt: str = None,
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
+    ) -> dict:
+        """ページ情報をユーザープロンプトと生成レスポンスと共に保存"""
+        logger.info(f"Saving page {page_number} for story {story_id}")
+        log_payload(logger, f"Page {page_number} prompt data", user_prompt=user_prompt, generated_response=generated_response)
+        return await self.add_page({
+            "story_id": story_id,
+            "page_number": page_number,
+            "text": text,
+            "image_prompt": image_prompt,
+            "image_url": image_url,
+            "image_storage_path": image_storage_path,
+            "image_derivatives": image_derivatives,
+            "image_tier": image_tier,
+            "user_prompt": user_prompt,
+            "generated_response": generated_response
+        })
+
+    async def update_page_with_prompt(
+        self,
+        story_id: str,
+        page_number: int,
+        text: str = None,
+        image_prompt: str = None,
+        image_url: str = None,
+        user_prompt: str = None,
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
+    ) -> dict:
+        """既存ページ情報を更新（None の項目は変更しない）"""
+        updates = {
+            "text": text,
+            "image_prompt": image_prompt,
+            "image_url": image_url,
+            "image_storage_path": image_storage_path,
+            "image_derivatives": image_derivatives,
+            "image_tier": image_tier,
+            "user_prompt": user_prompt,
+            "generated_response": generated_response,
+        }
+        try:
+            page = await asyncio.to_thread(
+                self._update_page, story_id, page_number, {k: v for k, v in updates.items() if v is not None}
+            )
+            if page is None:
+                logger.error(f"Failed to update page {page_number}")
+            return page
+        except Exception as e:
+            logger.error(f"Error updating page with prompt: {e}")
+            raise
+
+    def _public_url(self, bucket: str, file_path: str) -> str:
+        return f"{self.public_url_base}/{bucket}/{file_path}"
+
+    async def upload_image(self, bucket: str, file_path: str, file_data: bytes) -> str:
+        """画像を保存し、公開URLを返す"""
+        await asyncio.to_thread(self._write_file, bucket, file_path, file_data)
+        return self._public_url(bucket, file_path)
+
+    async def upload_story_image(self, bucket: str, user_id: str, story_id: str, page_number: int, file_data: Union[bytes, DecodedImage], file_extension: str = "png") -> tuple[str, str]:
+        """ストーリー用の画像を内容のハッシュ（SHA-256）をファイル名にして保存（SupabaseService と同じパス）"""
+        try:
+            if isinstance(file_data, DecodedImage):
+                digest = file_data.sha256
+            else:
+                digest = await asyncio.to_thread(lambda: hashlib.sha256(file_data).hexdigest())
+            file_path = story_image_path(user_id, digest, file_extension)
+            if not await asyncio.to_thread(self._write_file, bucket, file_path, file_data):
+                logger.info(f"Image already stored: {file_path}")
+            return file_path, self._public_url(bucket, file_path)
+        except Exception as e:
+            logger.error(f"Error uploading story image: {e}")
+            raise
+
+    async def upload_story_image_derivative(self, bucket: str, user_id: str, source_digest: str, label: str, image: DecodedImage, file_extension: str = "webp") -> tuple[str, str]:
+        """派生画像（縮小版・サムネイル）を元画像のハッシュ配下に保存"""
+        try:
+            file_path = story_image_derivative_path(user_id, source_digest, label, file_extension)
+            await asyncio.to_thread(self._write_file, bucket, file_path, image)
+            return file_path, self._public_url(bucket, file_path)
+        except Exception as e:
+            logger.error(f"Error uploading story image derivative: {e}")
+            raise
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+from .story_context_cache import StoryContextCache
+from .image_pipeline import DecodedImage
+from .storage import story_image_derivative_path, story_image_path
+from ..observability.metrics import observe_stage
+from ..observability.tracing import trace_methods
+
+logger = logging.getLogger(__name__)
+
+
+@trace_methods("supabase")
+class MockSupabaseService:
+    """SupabaseService と同じインターフェースを持つインメモリ実装（ベンチマーク・ローカル開発用）
+
+    テーブルと Storage の内容はプロセス内の dict に保持する。latency / upload_latency を指定すると、
+    リモート呼び出し相当の待ち時間を asyncio.sleep で入れる（イベントループは塞がない）。
+    """
+
+    STORY_CONTEXT_PAGE_COLUMNS = "page_number,text,image_url"
+
+    def __init__(self, latency: float = 0.0, upload_latency: float = 0.0, public_url_base: str = "http://mock-storage.local"):
+        self.latency = latency
+        self.upload_latency = upload_latency
+        self.public_url_base = public_url_base.rstrip("/")
+        self.stories: dict = {}
+        self.pages: dict = {}  # (story_id, page_number) -> 行
+        self.objects: dict = {}  # (bucket, path) -> bytes
+        # 内容は常にメモリ上にあるためキャッシュは使わないが、/health の統計用に持つ
+        self.context_cache = StoryContextCache()
+
+    async def _round_trip(self, seconds: float = None) -> None:
+        delay = self.latency if seconds is None else seconds
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def _pages_of(self, story_id: str) -> list:
+        return sorted((row for (sid, _), row in self.pages.items() if sid == story_id), key=lambda row: row["page_number"])
+
+    def _insert_page(self, page_data: dict) -> dict:
+        key = (page_data["story_id"], page_data["page_number"])
+        if page_data["story_id"] not in self.stories:
+            raise ValueError(f"Story not found: {page_data['story_id']}")
+        # pages の UNIQUE(story_id, page_number) 制約と同じ
+        if key in self.pages:
+            raise ValueError(f"duplicate key value violates unique constraint: story_id={key[0]} page_number={key[1]}")
+        row = {"id": str(uuid.uuid4()), "created_at": self._now(), **page_data}
+        self.pages[key] = row
+        return dict(row)
+
+    async def get_page_by_story_and_number(self, story_id: str, page_number: int) -> Optional[dict]:
+        """指定したストーリーIDとページ番号のページ情報を取得"""
+        await self._round_trip()
+        row = self.pages.get((story_id, page_number))
+        return dict(row) if row else None
+
+    async def create_story(self, story_data: dict) -> dict:
+        """新しいストーリーを作成"""
+        await self._round_trip()
+        story = {
+            "id": str(uuid.uuid4()),
+            "current_page": 1,
+            "is_complete": False,
+            "context_summary": None,
+            "context_summary_through": 0,
+            "created_at": self._now(),
+            "updated_at": self._now(),
+            **story_data,
+        }
+        self.stories[story["id"]] = story
+        return dict(story)
+
+    async def get_story(self, story_id: str) -> Optional[dict]:
+        """ストーリーを取得"""
+        await self._round_trip()
+        story = self.stories.get(story_id)
+        return dict(story) if story else None
+
+    async def get_story_context(self, story_id: str, through_page: Optional[int] = None) -> Optional[dict]:
+        """ストーリー行と、プロンプトに必要なページ列のみを取得（pages は page_number 順）"""
+        await self._round_trip()
+        story = self.stories.get(story_id)
+        if story is None:
+            return None
+        columns = self.STORY_CONTEXT_PAGE_COLUMNS.split(",")
+        return {**story, "pages": [{column: row.get(column) for column in columns} for row in self._pages_of(story_id)]}
+
+    async def update_story(self, story_id: str, update_data: dict) -> dict:
+        """ストーリーを更新"""
+        await self._round_trip()
+        story = self.stories.get(story_id)
+        if story is None:
+            raise ValueError(f"Story not found: {story_id}")
+        story.update(update_data, updated_at=self._now())
+        return dict(story)
+
+    async def add_page(self, page_data: dict) -> dict:
+        """新しいページを追加"""
+        with observe_stage("db_insert"):
+            await self._round_trip()
+            return self._insert_page(page_data)
+
+    async def add_pages(self, pages_data: list) -> list:
+        """複数ページをまとめて追加（1件でも失敗したら何も追加しない）"""
+        with observe_stage("db_insert"):
+            await self._round_trip()
+            keys = [(page["story_id"], page["page_number"]) for page in pages_data]
+            if len(set(keys)) != len(keys) or any(key in self.pages for key in keys):
+                raise ValueError("duplicate key value violates unique constraint: pages(story_id, page_number)")
+            return [self._insert_page(page) for page in pages_data]
+
+    async def create_page(self, page_data: dict) -> dict:
+        """新しいページを作成（add_pageのエイリアス）"""
+        return await self.add_page(page_data)
+
+    async def get_story_pages(self, story_id: str) -> list:
+        """ストーリーのページ一覧を取得"""
+        await self._round_trip()
+        return [dict(row) for row in self._pages_of(story_id)]
+
+    async def get_pages_by_story_id(self, story_id: str) -> list:
+        """ストーリーIDでページ一覧を取得（get_story_pagesのエイリアス）"""
+        return await self.get_story_pages(story_id)
+
+    def _public_url(self, bucket: str, file_path: str) -> str:
+        return f"{self.public_url_base}/{bucket}/{file_path}"
+
+    async def upload_image(self, bucket: str, file_path: str, file_data: bytes) -> str:
+        """画像を保存"""
+        await self._round_trip(self.upload_latency)
+        self.objects[(bucket, file_path)] = bytes(file_data)
+        return self._public_url(bucket, file_path)
+
+    async def upload_story_image(self, bucket: str, user_id: str, story_id: str, page_number: int, file_data: Union[bytes, DecodedImage], file_extension: str = "png") -> tuple[str, str]:
+        """ストーリー用の画像を内容のハッシュ（SHA-256）をファイル名にして保存（SupabaseService と同じパス）"""
+        digest = file_data.sha256 if isinstance(file_data, DecodedImage) else hashlib.sha256(file_data).hexdigest()
+        file_path = story_image_path(user_id, digest, file_extension)
+        return file_path, await self._upload_if_missing(bucket, file_path, file_data)
+
+    async def upload_story_image_derivative(self, bucket: str, user_id: str, source_digest: str, label: str, image: DecodedImage, file_extension: str = "webp") -> tuple[str, str]:
+        """派生画像（縮小版・サムネイル）を元画像のハッシュ配下に保存"""
+        file_path = story_image_derivative_path(user_id, source_digest, label, file_extension)
+        return file_path, await self._upload_if_missing(bucket, file_path, image)
+
+    @staticmethod
+    def _read_file(image: DecodedImage) -> bytes:
+        with image.open() as f:
+            return f.read()
+
+    async def _upload_if_missing(self, bucket: str, file_path: str, file_data: Union[bytes, DecodedImage]) -> str:
+        key = (bucket, file_path)
+        if key in self.objects:
+            await self._round_trip()
+            logger.info(f"Image already stored: {file_path}")
+        else:
+            if isinstance(file_data, DecodedImage):
+                file_data = await asyncio.to_thread(self._read_file, file_data)
+            await self._round_trip(self.upload_latency)
+            self.objects[key] = file_data
+        return self._public_url(bucket, file_path)
+
+    async def save_page_with_prompt(
+        self,
+        story_id: str,
+        page_number: int,
+        text: str,
+        image_prompt: str,
+        image_url: str,
+        user_prompt: str = None,
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
+    ) -> dict:
+        """ページ情報をユーザープロンプトと生成レスポンスと共に保存"""
+        return await self.add_page({
+            "story_id": story_id,
+            "page_number": page_number,
+            "text": text,
+            "image_prompt": image_prompt,
+            "image_url": image_url,
+            "image_storage_path": image_storage_path,
+            "image_derivatives": image_derivatives,
+            "image_tier": image_tier,
+            "user_prompt": user_prompt,
+            "generated_response": generated_response
+        })
+
+    async def update_page_with_prompt(
+        self,
+        story_id: str,
+        page_number: int,
+        text: str = None,
+        image_prompt: str = None,
+        image_url: str = None,
+        user_prompt: str = None,
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
+    ) -> dict:
+        """既存ページ情報を更新（None の項目は変更しない）"""
+        await self._round_trip()
+        row = self.pages.get((story_id, page_number))
+        if row is None:
+            logger.error(f"Failed to update page {page_number}")
+            return None
+        updates = {
+            "text": text,
+            "image_prompt": image_prompt,
+            "image_url": image_url,
+            "user_prompt": user_prompt,
+            "generated_response": generated_response,
+            "image_storage_path": image_storage_path,
+            "image_derivatives": image_derivatives,
+            "image_tier": image_tier,
+        }
+        row.update({key: value for key, value in updates.items() if value is not None})
+        return dict(row)
@@ -0,0 +1,315 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
+
+from openai import RateLimitError
+
+from .deadline import DeadlineExceeded, remaining_time
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """レート制限ヘッダーのリセット時間（"1s", "6m0s", "20ms" や秒数）を秒に変換"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+
+
+class ModelBudget:
+    """モデル種別（text / image）ごとの同時実行数・リクエスト数・トークン数の予算
+
+    requests_per_minute / tokens_per_minute はトークンバケットで管理し、0 のときは制限しない。
+    待ちが発生した場合は user_id ごとのキューをラウンドロビンで処理し、特定ユーザーの連打が
+    他のユーザーを待たせ続けないようにする。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_bucket = float(requests_per_minute)
+        self._token_bucket = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._queues: "OrderedDict[str, deque[_Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 統計
+        self.granted = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.rate_limited = 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_minute:
+            self._request_bucket = min(
+                float(self.requests_per_minute), self._request_bucket + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_bucket = min(
+                float(self.tokens_per_minute), self._token_bucket + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def _clamp_tokens(self, tokens: int) -> int:
+        # バケット容量を超える見積もりは永久に待つことになるため容量で頭打ちにする
+        return min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+
+    def _delay_until_available(self, tokens: int, now: float) -> float:
+        """今すぐ実行できる場合は 0、時間経過で実行可能になる場合はその秒数、同時実行数待ちは -1"""
+        if self._in_flight >= self.max_concurrency:
+            return -1.0
+        delay = max(0.0, self._paused_until - now)
+        if self.requests_per_minute and self._request_bucket < 1.0:
+            delay = max(delay, (1.0 - self._request_bucket) * 60.0 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_bucket < tokens:
+            delay = max(delay, (tokens - self._token_bucket) * 60.0 / self.tokens_per_minute)
+        return delay
+
+    def _consume(self, tokens: int) -> None:
+        self._in_flight += 1
+        if self.requests_per_minute:
+            self._request_bucket -= 1.0
+        if self.tokens_per_minute:
+            self._token_bucket -= tokens
+        self.granted += 1
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def fire():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = loop.call_later(delay, fire)
+
+    def _dispatch(self) -> None:
+        """待ち行列の先頭ユーザーから順に、実行可能な分だけ許可を出す"""
+        while self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            while queue and queue[0].future.done():
+                queue.popleft()  # キャンセル済み
+            if not queue:
+                del self._queues[user_id]
+                continue
+
+            waiter = queue[0]
+            now = time.monotonic()
+            self._refill(now)
+            delay = self._delay_until_available(waiter.tokens, now)
+            if delay < 0:
+                return  # 実行中のリクエストの完了（release）を待つ
+            if delay > 0:
+                self._schedule(delay)
+                return
+
+            queue.popleft()
+            # 許可を出したユーザーは末尾に回す（ラウンドロビン）
+            self._queues.move_to_end(user_id)
+            if not queue:
+                del self._queues[user_id]
+            self._consume(waiter.tokens)
+            wait = now - waiter.enqueued_at
+            self.waited += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            waiter.future.set_result(None)
+
+    async def acquire(self, user_id: str, tokens: int = 0) -> None:
+        tokens = self._clamp_tokens(tokens)
+        now = time.monotonic()
+        self._refill(now)
+        if not self._queues and self._delay_until_available(tokens, now) == 0:
+            self._consume(tokens)
+            return
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tokens)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 許可が出た直後にキャンセルされた場合は枠を返す
+                self.release()
+            raise
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """待ち行列が無く、同時実行数・リクエスト数・トークン数に空きがあれば待たずに確保する（確保したら release すること）"""
+        tokens = self._clamp_tokens(tokens)
+        now = time.monotonic()
+        self._refill(now)
+        if self._queues or self._delay_until_available(tokens, now) != 0:
+            return False
+        self._consume(tokens)
+        return True
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    def pause(self, seconds: float) -> None:
+        """レート制限に達したため、指定秒数は新しいリクエストを出さない"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            logger.warning(f"OpenAI {self.name} budget paused for {seconds:.2f}s")
+
+    def observe_headers(self, headers) -> None:
+        """レスポンスの x-ratelimit-* ヘッダーからバケットの残量と待ち時間を同期"""
+        if headers is None:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if kind == "requests" and self.requests_per_minute:
+                self._request_bucket = min(self._request_bucket, remaining)
+            if kind == "tokens" and self.tokens_per_minute:
+                self._token_bucket = min(self._token_bucket, remaining)
+            if remaining <= 0:
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": sum(len(q) for q in self._queues.values()),
+            "queued_users": len(self._queues),
+            "granted": self.granted,
+            "waited": self.waited,
+            "avg_wait_ms": round(self.total_wait / self.waited * 1000, 1) if self.waited else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "rate_limited": self.rate_limited,
+            "paused_for_s": round(max(0.0, self._paused_until - now), 2),
+        }
+
+
+class OpenAIGovernor:
+    """OpenAI API 呼び出しの同時実行数・レートをプロセス全体で制御する"""
+
+    def __init__(self, budgets: dict, max_rate_limit_retries: int = 3):
+        self.budgets = budgets
+        self.max_rate_limit_retries = max_rate_limit_retries
+
+    @asynccontextmanager
+    async def slot(self, kind: str, user_id: Optional[str], tokens: int = 0):
+        budget = self.budgets[kind]
+        remaining = remaining_time()
+        if remaining is None:
+            await budget.acquire(user_id or "anonymous", tokens)
+        else:
+            # 待ち行列での待ちは段階のタイムアウトには含めず、リクエストの締め切りだけで打ち切る
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Request deadline exceeded before OpenAI {kind} slot")
+            try:
+                await asyncio.wait_for(budget.acquire(user_id or "anonymous", tokens), remaining)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"Request deadline exceeded waiting for OpenAI {kind} slot") from None
+        try:
+            yield budget
+        finally:
+            budget.release()
+
+    @staticmethod
+    def _hedge_request(budget: ModelBudget, tokens: int, request: Callable[[], Awaitable]) -> Optional[asyncio.Future]:
+        """ヘッジの2回目を専用の枠・リクエスト数・トークン数を確保して送る
+
+        待ち行列ができているときや予算に空きが無いときにヘッジすると負荷を増やすだけなので送らない（None）。
+        """
+        if not budget.try_acquire(tokens):
+            return None
+        task = asyncio.ensure_future(request())
+        # 負けてキャンセルされた場合も含め、終わったら枠を返す
+        task.add_done_callback(lambda _: budget.release())
+        return task
+
+    async def call(self, kind: str, user_id: Optional[str], tokens: int, request: Callable[[], Awaitable], stage=None):
+        """with_raw_response の呼び出しを予算内で実行し、パース済みのレスポンスを返す
+
+        429 の場合は retry-after / x-ratelimit-reset-* に従って予算全体を一時停止し、キューに並び直して再試行する。
+        stage（StagePolicy）を渡すと、枠を確保した後の HTTP 呼び出しだけをその段階のタイムアウト・再試行・ヘッジで実行する
+        （待ち行列での待ち時間をタイムアウトやヘッジの基準の所要時間に含めず、再試行で並び直さない）。
+        ヘッジの2回目は別の枠とリクエスト数・トークン数を確保して送り、確保できなければ送らない。
+        """
+        budget = self.budgets[kind]
+        for attempt in range(self.max_rate_limit_retries + 1):
+            async with self.slot(kind, user_id, tokens):
+                try:
+                    if stage is None:
+                        raw = await request()
+                    else:
+                        raw = await stage.run(request, hedge_call=lambda: self._hedge_request(budget, tokens, request))
+                except RateLimitError as e:
+                    budget.rate_limited += 1
+                    headers = getattr(e.response, "headers", None)
+                    budget.observe_headers(headers)
+                    retry_after = parse_reset_duration(headers.get("retry-after") if headers else None)
+                    budget.pause(retry_after or min(2.0 ** attempt, 30.0))
+                    if attempt >= self.max_rate_limit_retries:
+                        raise
+                    logger.warning(f"OpenAI {kind} rate limited (user={user_id}), retrying ({attempt + 1}/{self.max_rate_limit_retries})")
+                    continue
+                budget.observe_headers(getattr(raw, "headers", None))
+                return raw.parse()
+
+    def stats(self) -> dict:
+        return {kind: budget.stats() for kind, budget in self.budgets.items()}
+
+
+# OpenAIService の全インスタンスで共有するガバナー
+openai_governor = OpenAIGovernor(
+    {
+        "text": ModelBudget(
+            "text",
+            max_concurrency=int(os.getenv("OPENAI_TEXT_MAX_CONCURRENCY", "32")),
+            requests_per_minute=int(os.getenv("OPENAI_TEXT_RPM", "500")),
+            tokens_per_minute=int(os.getenv("OPENAI_TEXT_TPM", "500000")),
+        ),
+        "image": ModelBudget(
+            "image",
+            max_concurrency=int(os.getenv("OPENAI_IMAGE_MAX_CONCURRENCY", "8")),
+            requests_per_minute=int(os.getenv("OPENAI_IMAGE_RPM", "50")),
+        ),
+    },
+    max_rate_limit_retries=int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", "3")),
+)
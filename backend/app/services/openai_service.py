@@ -1,13 +1,13 @@
 import os
+import asyncio
 from openai import AsyncOpenAI
-from typing import List
-import json
+from openai.types.chat import ChatCompletion
+from pydantic import ValidationError
+from typing import AsyncIterator, List, Optional
 import logging
 from dotenv import load_dotenv
 import uuid
-import httpx
 import tempfile
-import base64
 
 # .envファイルを読み込み（開発環境用）
 load_dotenv()
@@ -15,108 +15,242 @@ load_dotenv()
 from ..models.generation import (
     StoryGenerationRequest, GeneratedStory, StoryPage, 
     ImageGenerationRequest, ImageGenerationResponse,
-    SinglePageRequest, NextPageRequest
+    SinglePageRequest, NextPageRequest,
+    PageContent, PageTextRepair, StoryContent
 )
-from .supabase_service import SupabaseService
+from .storage import StorageService, create_storage_service
+from .image_job_queue import create_image_job_queue
+from .openai_governor import openai_governor
+from .completion_cache import create_completion_cache, completion_cache_key
+from .image_pipeline import decode_b64_image, log_render_memory
+from .image_derivatives import ImageDerivativeRenderer
+from .prompt_templates import PromptTemplate, STORY_PROMPT, FIRST_PAGE_PROMPT, NEXT_PAGE_PROMPT, REPAIR_PROMPT
+from .text_validator import validate_page_text
+from .resilience import create_stage_policies
+from .deadline import request_deadline
+from .http_pools import openai_http_client
+from ..observability.metrics import observe_stage, record_fallback_image, record_token_usage
+from ..observability.tracing import trace_methods
+from ..observability.logging import log_payload
 
 logger = logging.getLogger(__name__)
 
+@trace_methods("openai")
 class OpenAIService:
-    def __init__(self):
+    # 画像生成に失敗した場合のフォールバック画像
+    FALLBACK_IMAGE_URL = "https://via.placeholder.com/512x512.png?text=Image+Error"
+
+    def __init__(self, storage: Optional[StorageService] = None):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required")
-        self.client = AsyncOpenAI(api_key=api_key)
-        self.supabase = SupabaseService()
-        # Supabase Storage bucket name (override via env if needed)
+        # 段階（text / image / upload）ごとのタイムアウト・再試行・ヘッジ
+        self.stages = create_stage_policies()
+        # 同時実行数・レート・ユーザー間の公平性を制御するガバナー（プロセス内で共有）
+        self.governor = openai_governor
+        # 再試行とタイムアウトは self.stages で行うため、SDK の自動再試行は無効にし、タイムアウトは上限としてのみ使う。
+        # 接続はプロセス内で共有する HTTP/2 プール（上限はガバナーの同時実行数の合計。ヘッジの2回目もガバナーの枠を1つ確保して送る）
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=openai_http_client(
+                default_max_connections=sum(budget.max_concurrency for budget in self.governor.budgets.values()),
+                read_timeout=max(self.stages["text"].timeout, self.stages["image"].timeout)
+            )
+        )
+        # ストーリー・ページ・画像の保存先（STORAGE_BACKEND で選択。ルーターと同じインスタンスを共有する）
+        self.storage = storage or create_storage_service()
+        # 決定的なプロンプトの生成結果を再利用するキャッシュ（COMPLETION_CACHE_BACKEND=off なら None）
+        self.completion_cache = create_completion_cache()
+        # エンドポイントごとのプロンプトトークン数とキャッシュされたトークン数（プロンプトキャッシュの効果測定用）
+        self.prompt_usage = {}
+        # 構造化出力がスキーマに合わなかった回数（エンドポイントごと）
+        self.structured_output_failures = {}
+        # スキーマ違反時の再試行で使う推論の深さ（1回目より安く速く済ませる）
+        self.structured_output_retry_effort = os.getenv("STRUCTURED_OUTPUT_RETRY_REASONING_EFFORT", "minimal")
+        # 本文のルール違反（ひらがな・行数・1行の文字数・文節スペース）を画像生成前に直す修正依頼
+        self.text_repair_enabled = os.getenv("TEXT_REPAIR", "on").lower() not in ("", "off", "none", "0", "false")
+        self.text_repair_model = os.getenv("TEXT_REPAIR_MODEL", "gpt-5-mini")
+        self.text_validation_stats = {"checked": 0, "invalid": 0, "repaired": 0, "unrepaired": 0}
+        # Storage bucket name (override via env if needed)
         self.images_bucket = os.getenv("SUPABASE_IMAGES_BUCKET", "images")
+        # 一覧表示・モバイル向けの縮小版（WebP / AVIF）とサムネイルの生成（Pillow が必要）
+        self.derivatives = ImageDerivativeRenderer(self.storage, self.images_bucket)
+        # 画像生成の実行方式: inline（リクエスト内で生成）/ queue（ジョブキュー経由で別プロセスのワーカーが生成）
+        self.image_render_mode = os.getenv("IMAGE_RENDER_MODE", "inline").lower()
+        self.image_jobs = create_image_job_queue() if self.image_render_mode == "queue" else None
+        # プログレッシブ表示: 低品質のプレビューを先に返し、最終品質の画像はバックグラウンドで生成して差し替える
+        self.image_progressive = os.getenv("IMAGE_PROGRESSIVE", "off").lower() in ("on", "1", "true")
+        self.image_preview_quality = os.getenv("IMAGE_PREVIEW_QUALITY", "low")
+        self.image_final_quality = os.getenv("IMAGE_FINAL_QUALITY", "medium")
+        # 実行中のバックグラウンドタスク（完了前にGCされないよう参照を保持）
+        self._background_tasks = set()
+        # 次ページのプロンプトに本文をそのまま含める直近のページ数（それより前はストーリー行のあらすじに要約する）
+        self.story_context_recent_pages = int(os.getenv("STORY_CONTEXT_RECENT_PAGES", "4"))
+        self.story_summary_model = os.getenv("STORY_SUMMARY_MODEL", "gpt-5-mini")
+        # ストーリーごとの実行中のあらすじ更新タスク（同じストーリーで重複して実行しない）
+        self._summary_tasks = {}
+        # 絵本一括生成で同時に生成する画像の上限
+        self.full_story_image_concurrency = int(os.getenv("FULL_STORY_IMAGE_CONCURRENCY", "4"))
 
     @staticmethod
-    def _extract_json_object(raw: str):
-        """文字列中から最初のJSONオブジェクトを抽出してdictにして返す（失敗時None）。"""
-        if not raw:
-            return None
-        try:
-            # まずはそのまま
-            return json.loads(raw)
-        except Exception:
-            pass
+    def _estimate_tokens(messages: list, max_completion_tokens: int = 0) -> int:
+        """トークン数の概算（日本語はおおむね1文字1トークンとして文字数で見積もる）"""
+        return sum(len(m.get("content") or "") for m in messages) + max_completion_tokens
+
+    async def _create_chat_completion(self, user_id: str = None, cache_endpoint: str = None, response_model=None, **params):
+        """chat.completions.create をガバナー経由で実行（レート制限ヘッダーに合わせて待機・再試行）
+
+        cache_endpoint がキャッシュ対象のエンドポイント（COMPLETION_CACHE_ENDPOINTS）なら、
+        同一リクエストの結果をキャッシュから返す。response_model を指定した場合、
+        そのモデルとして検証できる応答だけをキャッシュに保存・利用する。
+        """
+        cache_key = None
+        if self.completion_cache is not None and self.completion_cache.enabled_for(cache_endpoint):
+            cache_key = completion_cache_key(params)
+            cached = await self.completion_cache.get(cache_key)
+            if cached is not None:
+                response = ChatCompletion.model_validate(cached)
+                if self._matches_response_model(response, response_model):
+                    logger.info(f"Completion cache hit ({cache_endpoint}): {cache_key[:12]}")
+                    return response
+
+        tokens = self._estimate_tokens(params["messages"], params.get("max_completion_tokens", 0))
+        with observe_stage("text_completion"):
+            # タイムアウト・再試行・ヘッジはガバナーの枠を確保した後の HTTP 呼び出しだけに適用する
+            response = await self.governor.call(
+                "text", user_id, tokens,
+                lambda: self.client.chat.completions.with_raw_response.create(**params),
+                stage=self.stages["text"]
+            )
+        self._record_prompt_usage(cache_endpoint, response)
+
+        # 途中で打ち切られた応答や空の応答はキャッシュしない
+        if cache_key is not None and response.choices:
+            choice = response.choices[0]
+            if choice.finish_reason == "stop" and choice.message.content and self._matches_response_model(response, response_model):
+                await self.completion_cache.set(cache_key, response.model_dump(mode="json"))
+        return response
+
+    @staticmethod
+    def _matches_response_model(response: ChatCompletion, response_model) -> bool:
+        if response_model is None:
+            return True
         try:
-            start = raw.find("{")
-            end = raw.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                return json.loads(raw[start:end+1])
-        except Exception as e:
-            logger.error(f"Fallback JSON extraction failed: {e}")
-        return None
+            response_model.model_validate_json(response.choices[0].message.content or "")
+            return True
+        except ValidationError:
+            return False
+
+    @staticmethod
+    def _json_schema_format(response_model) -> dict:
+        """Pydantic モデルから strict な構造化出力の response_format を作る"""
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": response_model.__name__,
+                "strict": True,
+                "schema": response_model.model_json_schema(),
+            },
+        }
+
+    async def _request_structured(self, label: str, response_model, user_id: str = None, **params):
+        """構造化出力（JSON Schema, strict）で生成し、response_model のインスタンスを返す
+
+        スキーマに合わない応答（拒否・途中で打ち切られた応答など）は失敗回数に数え、
+        推論を浅くして1回だけ再試行する。それでも合わなければ ValueError を送出する。
+        """
+        params["response_format"] = self._json_schema_format(response_model)
+        for attempt in range(2):
+            response = await self._create_chat_completion(
+                user_id=user_id, cache_endpoint=label, response_model=response_model, **params
+            )
+            choice = response.choices[0]
+            content = choice.message.content
+            logger.info(f"OpenAI meta({label}): id={response.id}, model={response.model}, finish_reason={choice.finish_reason}, usage={response.usage}")
+            try:
+                return response_model.model_validate_json(content or "")
+            except ValidationError as e:
+                self.structured_output_failures[label] = self.structured_output_failures.get(label, 0) + 1
+                refusal = getattr(choice.message, "refusal", None)
+                logger.warning(
+                    f"OpenAI structured output did not match {response_model.__name__} ({label}, attempt {attempt + 1}): "
+                    f"finish_reason={choice.finish_reason}, refusal={refusal}, errors={e.errors()[:3]}, content={content}"
+                )
+                if attempt > 0:
+                    raise ValueError(f"OpenAI returned invalid JSON: {content}") from e
+            # 再試行は推論を浅くして安く速く済ませる
+            params["extra_body"] = {**params.get("extra_body", {}), "reasoning_effort": self.structured_output_retry_effort}
+
+    def _record_prompt_usage(self, endpoint: str, response) -> None:
+        """プロンプトのトークン数と、そのうちプロバイダ側でキャッシュされたトークン数を記録"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        record_token_usage(endpoint, getattr(response, "model", None), usage)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        stats = self.prompt_usage.setdefault(endpoint or "other", {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        stats["requests"] += 1
+        stats["prompt_tokens"] += usage.prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        logger.info(f"OpenAI prompt usage({endpoint}): prompt_tokens={usage.prompt_tokens}, cached_tokens={cached_tokens}")
+
+    def prompt_usage_stats(self) -> dict:
+        return {
+            endpoint: dict(stats, cached_rate=round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0)
+            for endpoint, stats in self.prompt_usage.items()
+        }
+
+    async def _generate_image(self, user_id: str = None, **params):
+        """images.generate をガバナー経由で実行"""
+        with observe_stage("image_render"):
+            return await self.governor.call(
+                "image", user_id, 0,
+                lambda: self.client.images.with_raw_response.generate(**params),
+                stage=self.stages["image"]
+            )
 
-    async def generate_story_text(self, request: StoryGenerationRequest) -> List[StoryPage]:
-        """テーマに基づいて絵本のテキストとイメージプロンプトを生成"""
+    async def generate_story_text(self, request: StoryGenerationRequest) -> tuple[str, List[StoryPage]]:
+        """テーマに基づいて絵本のテキストとイメージプロンプトを生成（タイトルとページのリストを返す）"""
         
-        prompt = f"""
-あなたは子供向け絵本作家です。以下の条件で絵本を作成してください：
-
-テーマ: {request.theme}
-対象年齢: {request.target_age}歳
-ページ数: {request.pages_count}ページ
-イラストスタイル: {request.style}
-
-各ページについて以下を生成してください：
-1. 子供に分かりやすいテキスト（{request.language}）
-2. そのページのイラスト用英語プロンプト
-
-出力は以下のJSON形式で：
-{{
-  "title": "絵本のタイトル",
-  "pages": [
-    {{
-      "page_number": 1,
-      "text": "ページのテキスト",
-      "image_prompt": "Illustration prompt in English for {request.style} style"
-    }}
-  ]
-}}
-
-注意：
-- テキストは4~5歳の子供に適した内容で
-- テキストは必ずすべてひらがなで書いてください
-- 1行は20文字程度にしてください
-- 全部で4行までにしてください
-- 文節ごとに半角スペースを入れてください
-- イメージプロンプトは詳細で、{request.style}スタイルを含める
-- 各ページは物語として繋がるように
-"""
+        messages = STORY_PROMPT.messages(
+            theme=request.theme,
+            target_age=request.target_age,
+            pages_count=request.pages_count,
+            style=request.style,
+            language=request.language
+        )
 
         try:
             logger.info(f"Sending request to OpenAI - Theme: {request.theme}, Pages: {request.pages_count}, Style: {request.style}")
-            logger.info(f"Prompt length: {len(prompt)} characters")
+            logger.info(f"Prompt length: {len(messages[-1]['content'])} characters")
             
-            response = await self.client.chat.completions.create(
+            story_data = await self._request_structured(
+                "story",
+                StoryContent,
+                user_id=request.user_id,
                 model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "あなたは経験豊富な子供向け絵本作家です。必ず有効なJSONフォーマットで回答してください。"},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=messages,
                 # temperature=0.8,
                 max_completion_tokens=4000,
-                response_format={"type": "json_object"}
+                extra_body={"prompt_cache_key": STORY_PROMPT.cache_key}
             )
-
-            logger.info(f"Received response from OpenAI - Status: {response}")
-            content = response.choices[0].message.content
-            logger.info(f"OpenAI response: {content}")
-            logger.info(f"Response content length: {len(content) if content else 0}")
-            story_data = json.loads(content)
+            logger.info(f"OpenAI story response: title={story_data.title}, pages={len(story_data.pages)}")
             
+            # 本文のルール違反は全ページ並行で修正してから画像生成に進む
+            texts = await asyncio.gather(*(
+                self._ensure_valid_page_text(page_data.text, user_id=request.user_id) for page_data in story_data.pages
+            ))
             pages = []
-            for page_data in story_data["pages"]:
+            for page_data, text in zip(story_data.pages, texts):
                 pages.append(StoryPage(
-                    page_number=page_data["page_number"],
-                    text=page_data["text"],
-                    image_prompt=page_data["image_prompt"]
+                    page_number=page_data.page_number,
+                    text=text,
+                    image_prompt=page_data.image_prompt
                 ))
 
-            return story_data["title"], pages
+            return story_data.title, pages
 
         except Exception as e:
             logger.error(f"Error generating story text: {e}")
@@ -132,77 +266,138 @@ class OpenAIService:
             return image_response.image_url
         except Exception as e:
             logger.error(f"Error generating and storing image: {e}")
+            record_fallback_image("image")
             # 最低限のフォールバック画像
-            return "https://via.placeholder.com/512x512.png?text=Image+Error"
+            return self.FALLBACK_IMAGE_URL
             
-    async def generate_and_store_story_image(self, prompt: str, style: str, user_id: str, story_id: str, page_number: int, previous_image_url: str = None) -> tuple[str, str]:
-        """ストーリー用の画像を生成し、フォルダ構造で保存。前ページ画像があればプロンプトに含める"""
+    async def render_story_image(
+        self,
+        prompt: str,
+        style: str,
+        user_id: str,
+        story_id: str,
+        page_number: int,
+        previous_image_url: str = None,
+        quality: str = None,
+        with_derivatives: bool = True
+    ) -> tuple[str, str, Optional[dict]]:
+        """ストーリー用の画像を生成し、フォルダ構造で保存（失敗時は例外を送出）。前ページ画像があればプロンプトに含める
+
+        (保存パス, 公開URL, 派生画像) を返す。派生画像は作成しなかった場合 None。
+        quality を省略すると最終品質（IMAGE_FINAL_QUALITY）で生成する。
+        """
+        # プロンプト強化
+        enhanced_prompt = f"{prompt}, {style} style, children's book illustration, warm and friendly, high quality"
+        if previous_image_url:
+            enhanced_prompt += f"\nこの画像({previous_image_url})に登場する全てのキャラクターを必ず同じ姿・服装・色・雰囲気で描写してください。脇役や動物なども含め、できるだけ一貫性を保ってください。"
+        response = await self._generate_image(
+            user_id=user_id,
+            model="gpt-image-1",
+            prompt=enhanced_prompt,
+            size="1024x1024",
+            quality=quality or self.image_final_quality,
+            n=1
+        )
+
+        # レスポンス検証
+        if not getattr(response, "data", None) or len(response.data) == 0:
+            raise ValueError("OpenAI did not return image data")
+
+        first = response.data[0]
+        
+        # 1) URL があればそのまま返す（ファイルパスは空文字）
+        image_url = getattr(first, "url", None)
+        if image_url:
+            return "", image_url, None
+
+        # 2) URLが無ければ b64_json を確認してSupabaseへフォルダ構造で保存
+        b64_json = getattr(first, "b64_json", None)
+        if b64_json:
+            # ワーカースレッドで一時ファイルへデコードし、base64文字列は早めに手放す
+            with observe_stage("b64_decode"):
+                image = await decode_b64_image(b64_json)
+            first.b64_json = None
+            del b64_json
+            try:
+                log_render_memory(image, story_id, page_number)
+                # フォルダ構造でアップロード（一時ファイルからストリーミング）
+                with observe_stage("storage_upload"):
+                    file_path, public_url = await self.stages["upload"].run(
+                        lambda: self.storage.upload_story_image(self.images_bucket, user_id, story_id, page_number, image)
+                    )
+                # 元画像の一時ファイルが残っているうちに縮小版・サムネイルを作成
+                derivatives = None
+                if with_derivatives:
+                    with observe_stage("image_derivatives"):
+                        derivatives = await self.derivatives.render_and_store(image, user_id, story_id, page_number)
+            finally:
+                image.cleanup()
+            return file_path, public_url, derivatives
+
+        # 3) どちらも無い場合はエラー
+        raise ValueError("OpenAI image response has neither url nor b64_json")
+
+    async def generate_and_store_story_image(self, prompt: str, style: str, user_id: str, story_id: str, page_number: int, previous_image_url: str = None) -> tuple[str, str, Optional[dict]]:
+        """ストーリー用の画像を生成し、フォルダ構造で保存。失敗時はフォールバック画像のURLを返す"""
         try:
-            # 画像生成リクエストを作成
-            image_request = ImageGenerationRequest(prompt=prompt, style=style)
-            # プロンプト強化
-            enhanced_prompt = f"{prompt}, {style} style, children's book illustration, warm and friendly, high quality"
-            if previous_image_url:
-                enhanced_prompt += f"\nこの画像({previous_image_url})に登場する全てのキャラクターを必ず同じ姿・服装・色・雰囲気で描写してください。脇役や動物なども含め、できるだけ一貫性を保ってください。"
-            response = await self.client.images.generate(
-                model="gpt-image-1",
-                prompt=enhanced_prompt,
-                size="1024x1024",
-                quality="medium",
-                n=1
+            return await self.render_story_image(
+                prompt, style, user_id, story_id, page_number, previous_image_url=previous_image_url
             )
-
-            # レスポンス検証
-            if not getattr(response, "data", None) or len(response.data) == 0:
-                raise ValueError("OpenAI did not return image data")
-
-            first = response.data[0]
-            
-            # 1) URL があればそのまま返す（ファイルパスは空文字）
-            image_url = getattr(first, "url", None)
-            if image_url:
-                return "", image_url
-
-            # 2) URLが無ければ b64_json を確認してSupabaseへフォルダ構造で保存
-            b64_json = getattr(first, "b64_json", None)
-            if b64_json:
-                try:
-                    image_bytes = base64.b64decode(b64_json)
-                except Exception as be:
-                    raise ValueError(f"Failed to decode base64 image: {be}")
-
-                # フォルダ構造でアップロード
-                file_path, public_url = await self.supabase.upload_story_image(
-                    self.images_bucket, user_id, story_id, page_number, image_bytes
-                )
-                return file_path, public_url
-
-            # 3) どちらも無い場合はエラー
-            raise ValueError("OpenAI image response has neither url nor b64_json")
-            
         except Exception as e:
             logger.error(f"Error generating and storing story image: {e}")
+            record_fallback_image("story_image")
             # 最低限のフォールバック画像
-            return "", "https://via.placeholder.com/512x512.png?text=Image+Error"
+            return "", self.FALLBACK_IMAGE_URL, None
 
     async def generate_complete_story(self, request: StoryGenerationRequest) -> GeneratedStory:
-        """テキストと画像の両方を生成して完全な絵本を作成"""
+        """テキストと画像の両方を生成して完全な絵本を作成し、ストーリーと全ページを保存"""
         
         try:
-            # 1. ストーリーテキストを生成
+            # 1. ストーリーテキストを1回の呼び出しで全ページ分生成
             title, pages = await self.generate_story_text(request)
             
-            # 2. 各ページの画像を生成
-            for page in pages:
-                image_request = ImageGenerationRequest(
-                    prompt=page.image_prompt,
-                    style=request.style
-                )
-                image_response = await self.generate_image(image_request)
-                page.image_url = image_response.image_url
-
-            # 3. ストーリーオブジェクトを作成
-            story_id = f"story_{hash(title)}_{len(pages)}"
+            # 2. ストーリーを作成（ページの外部キーと画像の保存先に story_id が必要）
+            story = await self.storage.create_story({
+                "id": str(uuid.uuid4()),
+                "title": title,
+                "total_pages": len(pages),
+                "art_style": request.style,
+                "main_character_name": request.main_character_name or "",
+                "user_id": request.user_id,
+                "current_page": len(pages),
+                "is_complete": True
+            })
+            story_id = story["id"]
+
+            # 3. 各ページの画像を並行して生成・アップロード（同時実行数はセマフォで制限）
+            semaphore = asyncio.Semaphore(self.full_story_image_concurrency)
+
+            storage_paths = {}
+
+            async def render(page: StoryPage) -> None:
+                async with semaphore:
+                    storage_paths[page.page_number], page.image_url, page.image_derivatives = await self.generate_and_store_story_image(
+                        page.image_prompt, request.style, request.user_id, story_id, page.page_number
+                    )
+                page.image_tier = self._image_tier(page.image_url)
+                page.story_id = story_id
+
+            await asyncio.gather(*(render(page) for page in pages))
+
+            # 4. 全ページを1回のINSERTで保存
+            await self.storage.add_pages([
+                {
+                    "story_id": story_id,
+                    "page_number": page.page_number,
+                    "text": page.text,
+                    "image_prompt": page.image_prompt,
+                    "image_url": page.image_url,
+                    "image_storage_path": storage_paths.get(page.page_number) or None,
+                    "image_derivatives": page.image_derivatives,
+                    "image_tier": page.image_tier
+                }
+                for page in pages
+            ])
             
             return GeneratedStory(
                 id=story_id,
@@ -210,268 +405,494 @@ class OpenAIService:
                 pages=pages,
                 theme=request.theme,
                 target_age=request.target_age,
-                style=request.style
+                style=request.style,
+                user_id=request.user_id
             )
 
         except Exception as e:
             logger.error(f"Error generating complete story: {e}")
             raise
 
-    async def generate_single_page(self, request: SinglePageRequest, user_id: str = None, story_id: str = None) -> StoryPage:
-        """最初のページを生成（絵本の基本情報から開始）"""
-        
-        prompt = f"""
-あなたは子供向け絵本作家です。以下の情報で絵本の最初のページを作成してください：
-
-絵本タイトル: {request.story_title}
-総ページ数: {request.total_pages}ページ
-画風: {request.art_style}
-主人公の名前: {request.main_character_name}
-
-このタイトルと主人公を使って、物語の導入となる最初のページを作成してください。
-
-重要: 必ず以下の正確なJSON形式でのみ回答してください。マークダウンのコードブロック（```）は使用せず、説明文も一切含めないでください。純粋なJSONオブジェクトのみを返してください：
-
-{{
-  "page_number": 1,
-  "text": "このページのテキスト（主人公の名前を使用）",
-  "image_prompt": "Illustration prompt in English for {request.art_style} style"
-}}
-
-注意：
-- 主人公の名前「{request.main_character_name}」を必ず使用
-- 子供に適した内容で
-- テキストは必ずすべてひらがなで書いてください
-- 1行は20文字程度にしてください
-- 全部で4行までにしてください
-- 文節ごとに半角スペースを入れてください
-- 残り{request.total_pages - 1}ページで展開できるような導入に
-- イメージプロンプトは{request.art_style}スタイルを含める
-- 回答は上記のJSONフォーマットのみ。一切の追加テキスト、説明、コードブロックは不要
-"""
+    async def _ensure_valid_page_text(self, text: str, user_id: str = None) -> str:
+        """本文をローカルで検証し、違反があれば本文だけの修正依頼を1回送って修正後の本文を返す
+
+        修正に失敗した場合や修正後も違反が残る場合は、ログを出してそのまま（修正できた分は反映して）返す。
+        """
+        self.text_validation_stats["checked"] += 1
+        violations = validate_page_text(text)
+        if not violations:
+            return text
+        self.text_validation_stats["invalid"] += 1
+        logger.warning(f"Page text violates the rules: {violations} text={text!r}")
+        if not self.text_repair_enabled:
+            return text
 
         try:
-            # ユーザー入力情報をログ出力
-            user_input = f"タイトル: {request.story_title}, 主人公: {request.main_character_name}, スタイル: {request.art_style}"
-            logger.info(f"User input for first page: {user_input}")
-            logger.info(f"Generated prompt: {prompt}")
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {"role": "system", "content": "あなたは経験豊富な子供向け絵本作家です。必ず有効なJSONフォーマットで回答してください。マークダウンのコードブロック（```json や ``` など）は一切使用せず、純粋なJSONオブジェクトのみを出力してください。"},
-                    {"role": "user", "content": prompt}
-                ],
-                # temperature=0.8,
-                max_completion_tokens=4000,
-                response_format={"type": "json_object"}
+            repaired = await self._request_structured(
+                REPAIR_PROMPT.name,
+                PageTextRepair,
+                user_id=user_id,
+                model=self.text_repair_model,
+                messages=REPAIR_PROMPT.messages(violations="\n".join(f"- {v}" for v in violations), text=text),
+                max_completion_tokens=2000,
+                extra_body={"prompt_cache_key": REPAIR_PROMPT.cache_key}
+            )
+        except Exception as e:
+            self.text_validation_stats["unrepaired"] += 1
+            logger.error(f"Error repairing page text: {e}")
+            return text
+
+        remaining = validate_page_text(repaired.text)
+        if remaining:
+            self.text_validation_stats["unrepaired"] += 1
+            logger.warning(f"Page text still violates the rules after repair: {remaining} text={repaired.text!r}")
+        else:
+            self.text_validation_stats["repaired"] += 1
+            logger.info(f"Page text repaired: {repaired.text!r}")
+        return repaired.text
+
+    async def _request_page_json(self, template: PromptTemplate, messages: List[dict], user_id: str = None) -> dict:
+        """ページ生成のプロンプトを送信し、スキーマ検証済みのページ内容をdictで返す（template.name はログ用: first / next）"""
+        page = await self._request_structured(
+            template.name,
+            PageContent,
+            user_id=user_id,
+            model="gpt-5",
+            messages=messages,
+            # temperature=0.8,
+            max_completion_tokens=4000,
+            extra_body={"prompt_cache_key": template.cache_key}
+        )
+        log_payload(logger, f"OpenAI response ({template.name})", response=page)
+        return page.model_dump()
+
+    async def _store_page(
+        self,
+        page_data: dict,
+        page_number: int,
+        style: str,
+        user_prompt: str,
+        user_id: str = None,
+        story_id: str = None,
+        previous_image_url: str = None
+    ) -> StoryPage:
+        """生成済みのページテキストに対して画像を生成し、プロンプトとレスポンスをDBに保存"""
+        if self.image_progressive and user_id and story_id:
+            return await self._store_page_with_preview_image(
+                page_data, page_number, style, user_prompt, user_id, story_id, previous_image_url
+            )
+        if self.image_jobs is not None and user_id and story_id:
+            return await self._store_page_with_pending_image(
+                page_data, page_number, style, user_prompt, user_id, story_id, previous_image_url
             )
 
-            # メタ情報ログ
-            try:
-                choice0 = response.choices[0]
-                finish_reason = getattr(choice0, "finish_reason", None)
-                model_used = getattr(response, "model", None)
-                resp_id = getattr(response, "id", None)
-                usage = getattr(response, "usage", None)
-                logger.info(f"OpenAI meta(first): id={resp_id}, model={model_used}, finish_reason={finish_reason}, usage={usage}")
-            except Exception:
-                pass
+        # 画像生成：story_idとuser_idがある場合はフォルダ構造で保存
+        if user_id and story_id:
+            image_storage_path, image_url, image_derivatives = await self.generate_and_store_story_image(
+                page_data["image_prompt"],
+                style,
+                user_id,
+                story_id,
+                page_number,
+                previous_image_url=previous_image_url
+            )
+        else:
+            # 従来の方法で画像生成
+            image_request = ImageGenerationRequest(
+                prompt=page_data["image_prompt"],
+                style=style
+            )
+            image_url = await self.generate_and_store_image(image_request)
+            image_storage_path = ""
+            image_derivatives = None
 
-            choice = response.choices[0]
-            parsed = getattr(getattr(choice, "message", object()), "parsed", None)
-            content = choice.message.content
-            if parsed is not None:
-                logger.info("OpenAI provided parsed JSON (first).")
-                page_data = parsed
-            else:
-                logger.info(f"OpenAI response: {content}")
-                if not content:
-                    raise ValueError("OpenAI returned invalid JSON: ")
-                # JSONパース or フォールバック
-                page_data = self._extract_json_object(content)
-                if page_data is None:
-                    raise ValueError(f"OpenAI returned invalid JSON: {content}")
-            
-            # 画像生成：story_idとuser_idがある場合はフォルダ構造で保存
-            if user_id and story_id:
-                image_storage_path, image_url = await self.generate_and_store_story_image(
-                    page_data["image_prompt"], 
-                    request.art_style, 
-                    user_id, 
-                    story_id, 
-                    1  # 最初のページ
-                )
-            else:
-                # 従来の方法で画像生成
-                image_request = ImageGenerationRequest(
-                    prompt=page_data["image_prompt"],
-                    style=request.art_style
+        # プロンプトとレスポンスをDBに保存
+        if user_id and story_id:
+            try:
+                await self.storage.save_page_with_prompt(
+                    story_id=story_id,
+                    page_number=page_number,
+                    text=page_data["text"],
+                    image_prompt=page_data["image_prompt"],
+                    image_url=image_url,
+                    user_prompt=user_prompt,
+                    generated_response=page_data,
+                    image_storage_path=image_storage_path or None,
+                    image_derivatives=image_derivatives,
+                    image_tier=self._image_tier(image_url)
                 )
-                image_url = await self.generate_and_store_image(image_request)
-                image_storage_path = ""
-            
-            # プロンプトとレスポンスをDBに保存
-            if user_id and story_id:
-                try:
-                    await self.supabase.save_page_with_prompt(
-                        story_id=story_id,
-                        page_number=1,
-                        text=page_data["text"],
-                        image_prompt=page_data["image_prompt"],
-                        image_url=image_url,
-                        user_prompt=user_input,
-                        generated_response=page_data
-                    )
-                except Exception as db_error:
-                    logger.error(f"Failed to save prompt data to DB: {db_error}")
-            
-            result_page = StoryPage(
-                page_number=page_data["page_number"],
-                text=page_data["text"],
-                image_prompt=page_data["image_prompt"],
-                image_url=image_url
+            except Exception as db_error:
+                logger.error(f"Failed to save prompt data to DB: {db_error}")
+
+        result_page = StoryPage(
+            page_number=page_data["page_number"],
+            text=page_data["text"],
+            image_prompt=page_data["image_prompt"],
+            image_url=image_url,
+            image_status="ready",
+            image_tier=self._image_tier(image_url),
+            image_derivatives=image_derivatives
+        )
+
+        # 返却するJSONをログ出力
+        result_json = {
+            "page_number": result_page.page_number,
+            "text": result_page.text,
+            "image_prompt": result_page.image_prompt,
+            "image_url": result_page.image_url
+        }
+        log_payload(logger, "Returning JSON response", response=result_json)
+
+        return result_page
+
+    async def _store_page_with_pending_image(
+        self,
+        page_data: dict,
+        page_number: int,
+        style: str,
+        user_prompt: str,
+        user_id: str,
+        story_id: str,
+        previous_image_url: str = None
+    ) -> StoryPage:
+        """ページを画像なしで保存し、画像生成をジョブキューへ登録（image_url はワーカーが後から設定）"""
+        # ワーカーが update_page_with_prompt で更新できるよう、先にページ行を作成する
+        await self.storage.save_page_with_prompt(
+            story_id=story_id,
+            page_number=page_number,
+            text=page_data["text"],
+            image_prompt=page_data["image_prompt"],
+            image_url=None,
+            user_prompt=user_prompt,
+            generated_response=page_data
+        )
+        job_id = await self._enqueue_image_job(page_data, page_number, style, user_id, story_id, previous_image_url)
+
+        return StoryPage(
+            page_number=page_data["page_number"],
+            text=page_data["text"],
+            image_prompt=page_data["image_prompt"],
+            image_url=None,
+            image_status="pending",
+            image_job_id=job_id
+        )
+
+    async def _enqueue_image_job(
+        self,
+        page_data: dict,
+        page_number: int,
+        style: str,
+        user_id: str,
+        story_id: str,
+        previous_image_url: str = None
+    ) -> str:
+        """最終品質の画像生成をジョブキューへ登録し、ジョブIDを返す"""
+        job_id = await self.image_jobs.enqueue({
+            "prompt": page_data["image_prompt"],
+            "style": style,
+            "user_id": user_id,
+            "story_id": story_id,
+            "page_number": page_number,
+            "previous_image_url": previous_image_url
+        })
+        logger.info(f"Enqueued image job {job_id} for story {story_id} page {page_number}")
+        return job_id
+
+    async def _store_page_with_preview_image(
+        self,
+        page_data: dict,
+        page_number: int,
+        style: str,
+        user_prompt: str,
+        user_id: str,
+        story_id: str,
+        previous_image_url: str = None
+    ) -> StoryPage:
+        """低品質のプレビュー画像でページを保存して返し、最終品質の画像は後から差し替える
+
+        差し替えは IMAGE_RENDER_MODE=queue ならワーカー、それ以外はこのプロセスのバックグラウンドタスクで行う。
+        """
+        try:
+            image_storage_path, image_url, _ = await self.render_story_image(
+                page_data["image_prompt"],
+                style,
+                user_id,
+                story_id,
+                page_number,
+                previous_image_url=previous_image_url,
+                quality=self.image_preview_quality,
+                with_derivatives=False
             )
-            
-            # 返却するJSONをログ出力
-            result_json = {
-                "page_number": result_page.page_number,
-                "text": result_page.text,
-                "image_prompt": result_page.image_prompt,
-                "image_url": result_page.image_url
-            }
-            logger.info(f"Returning JSON response: {json.dumps(result_json, ensure_ascii=False)}")
-            
-            return result_page
+            image_tier = "preview"
+        except Exception as e:
+            # プレビューが無くても最終画像の生成は続ける
+            logger.error(f"Error rendering preview image for story {story_id} page {page_number}: {e}")
+            image_storage_path, image_url, image_tier = "", None, None
+
+        await self.storage.save_page_with_prompt(
+            story_id=story_id,
+            page_number=page_number,
+            text=page_data["text"],
+            image_prompt=page_data["image_prompt"],
+            image_url=image_url,
+            user_prompt=user_prompt,
+            generated_response=page_data,
+            image_storage_path=image_storage_path or None,
+            image_tier=image_tier
+        )
+
+        job_id = None
+        if self.image_jobs is not None:
+            job_id = await self._enqueue_image_job(page_data, page_number, style, user_id, story_id, previous_image_url)
+        else:
+            self._spawn_background(self._render_final_image(
+                page_data["image_prompt"], style, user_id, story_id, page_number, previous_image_url
+            ))
+
+        return StoryPage(
+            page_number=page_data["page_number"],
+            text=page_data["text"],
+            image_prompt=page_data["image_prompt"],
+            image_url=image_url,
+            image_status="ready" if image_url else "pending",
+            image_tier=image_tier,
+            image_job_id=job_id
+        )
+
+    async def _render_final_image(
+        self,
+        prompt: str,
+        style: str,
+        user_id: str,
+        story_id: str,
+        page_number: int,
+        previous_image_url: str = None
+    ) -> None:
+        """最終品質の画像を生成し、保存済みページのプレビュー画像を差し替える（失敗時はプレビューのまま）"""
+        try:
+            image_storage_path, image_url, image_derivatives = await self.render_story_image(
+                prompt, style, user_id, story_id, page_number, previous_image_url=previous_image_url
+            )
+            await self.storage.update_page_with_prompt(
+                story_id, page_number,
+                image_url=image_url,
+                image_storage_path=image_storage_path or None,
+                image_derivatives=image_derivatives,
+                image_tier="final"
+            )
+            logger.info(f"Final image stored for story {story_id} page {page_number}")
+        except Exception as e:
+            logger.error(f"Error rendering final image for story {story_id} page {page_number}: {e}")
+
+    def _spawn_background(self, coro) -> asyncio.Task:
+        """レスポンス後も続く処理をタスクとして開始（リクエストの締め切りは引き継がない）"""
+        with request_deadline(None):
+            task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def aclose(self, timeout: float = 30.0) -> None:
+        """終了処理: 実行中のバックグラウンド処理（最終画像の生成など）を timeout 秒まで待ってから接続を閉じる"""
+        if self._background_tasks:
+            logger.info(f"Waiting for {len(self._background_tasks)} background tasks before shutdown")
+            _, pending = await asyncio.wait(set(self._background_tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Cancelled {len(pending)} background tasks at shutdown")
+        await self.client.close()
+
+    def _image_tier(self, image_url: Optional[str]) -> Optional[str]:
+        """保存した画像の品質段階（フォールバック画像や画像なしは None）"""
+        if not image_url or image_url == self.FALLBACK_IMAGE_URL:
+            return None
+        return "final"
+
+    async def generate_first_page_text(self, request: SinglePageRequest) -> tuple[dict, str]:
+        """最初のページのテキストとイメージプロンプトを生成（page_data とユーザー入力の要約を返す）"""
+        
+        messages = FIRST_PAGE_PROMPT.messages(
+            story_title=request.story_title,
+            total_pages=request.total_pages,
+            remaining_pages=request.total_pages - 1,
+            art_style=request.art_style,
+            main_character_name=request.main_character_name
+        )
+
+        # ユーザー入力情報をログ出力
+        user_input = f"タイトル: {request.story_title}, 主人公: {request.main_character_name}, スタイル: {request.art_style}"
+        log_payload(logger, "First page prompt", user_input=user_input, prompt=messages[-1]["content"])
+
+        page_data = await self._request_page_json(FIRST_PAGE_PROMPT, messages, user_id=request.user_id)
+        page_data["text"] = await self._ensure_valid_page_text(page_data["text"], user_id=request.user_id)
+        return page_data, user_input
 
+    async def generate_single_page(self, request: SinglePageRequest, user_id: str = None, story_id: str = None) -> StoryPage:
+        """最初のページを生成（絵本の基本情報から開始）"""
+        try:
+            page_data, user_input = await self.generate_first_page_text(request)
+            return await self._store_page(
+                page_data, 1, request.art_style, user_input, user_id=user_id, story_id=story_id
+            )
         except Exception as e:
             logger.error(f"Error generating single page: {e}")
             raise
 
-    async def generate_next_page(self, request: NextPageRequest, story_context: List[str], previous_image_url: str = None, story: dict = None) -> StoryPage:
-        """ユーザーの意図を反映して次のページを生成。前ページ画像URLがあればプロンプトに含める"""
+    async def stream_single_page(self, request: SinglePageRequest, user_id: str, story_id: str) -> AsyncIterator[tuple[str, dict]]:
+        """最初のページを段階的に生成し、(イベント名, データ) を準備でき次第 yield する"""
+        try:
+            page_data, user_input = await self.generate_first_page_text(request)
+            yield "text", {
+                "page_number": page_data["page_number"],
+                "text": page_data["text"],
+                "image_prompt": page_data["image_prompt"],
+                "story_id": story_id
+            }
+            page = await self._store_page(
+                page_data, 1, request.art_style, user_input, user_id=user_id, story_id=story_id
+            )
+            yield "image", page.model_dump(include={
+                "page_number", "image_url", "image_status", "image_tier", "image_job_id", "image_derivatives"
+            })
+        except Exception as e:
+            logger.error(f"Error streaming single page: {e}")
+            raise
+
+    async def generate_next_page_text(self, request: NextPageRequest, story_context: List[str], story: dict = None) -> tuple[dict, str]:
+        """ユーザーの意図を反映した次ページのテキストとイメージプロンプトを生成（page_data とユーザー入力を返す）"""
         
-        context = "これまでのストーリー:\n" + "\n".join([f"ページ{i+1}: {page}" for i, page in enumerate(story_context)])
+        context = self._build_story_context(story_context, story)
+        # 次のページ以降で必要になるあらすじの更新を、ページ生成と並行して進める
+        self._schedule_summary_update(request, story_context, story)
         
         # ストーリーから画風を取得
         art_style = story.get("art_style", "watercolor") if story else "watercolor"
         
-        prompt = f"""
-絵本の続きを作成してください：
-
-{context}
-
-ページ番号: {request.page_number}
-画風: {art_style}
-ユーザーが考えた展開: {request.user_direction}
-
-この展開を受けて、自然に続くページを作成してください。
-
-重要: 必ず以下の正確なJSON形式でのみ回答してください。マークダウンのコードブロック（```）は使用せず、説明文も一切含めないでください。純粋なJSONオブジェクトのみを返してください：
-
-{{
-  "page_number": {request.page_number},
-  "text": "このページのテキスト",
-  "image_prompt": "Illustration prompt in English for {art_style} style"
-}}
-
-注意：
-- ユーザーの意図を反映しつつ、子供に適した内容に
-- テキストは必ずすべてひらがなで書いてください
-- 1行は20文字程度にしてください
-- 全部で4行までにしてください
-- 文節ごとに半角スペースを入れてください
-- イメージプロンプトは{art_style}スタイルを含める
-- 前のページからの自然な流れを保つ
-- 回答は上記のJSONフォーマットのみ。一切の追加テキスト、説明、コードブロックは不要
-"""
-
+        messages = NEXT_PAGE_PROMPT.messages(
+            context=context,
+            page_number=request.page_number,
+            art_style=art_style,
+            user_direction=request.user_direction
+        )
+
+        # ユーザー入力をログ出力
+        user_input = f"ページ{request.page_number}: {request.user_direction}"
+        log_payload(logger, "Next page prompt", user_input=user_input, prompt=messages[-1]["content"])
+
+        page_data = await self._request_page_json(NEXT_PAGE_PROMPT, messages, user_id=request.user_id)
+        page_data["text"] = await self._ensure_valid_page_text(page_data["text"], user_id=request.user_id)
+        return page_data, user_input
+
+    def _build_story_context(self, story_context: List[str], story: dict = None) -> str:
+        """プロンプト用の文脈（あらすじがあれば、あらすじ + 要約されていないページの本文）を作成"""
+        summary = (story or {}).get("context_summary")
+        summarized_through = min((story or {}).get("context_summary_through") or 0, len(story_context))
+        if not summary or summarized_through <= 0:
+            return "これまでのストーリー:\n" + "\n".join([f"ページ{i+1}: {page}" for i, page in enumerate(story_context)])
+        # あらすじの更新が遅れている場合も、要約されていないページは本文のまま含める
+        recent = "\n".join([f"ページ{i+1}: {page}" for i, page in enumerate(story_context) if i >= summarized_through])
+        return f"これまでのあらすじ（ページ1〜{summarized_through}）:\n{summary}\n\n直近のページ:\n{recent}"
+
+    def _schedule_summary_update(self, request: NextPageRequest, story_context: List[str], story: dict = None) -> None:
+        """直近 STORY_CONTEXT_RECENT_PAGES ページより前のページがあらすじに含まれていなければ、バックグラウンドで更新"""
+        if story is None:
+            return
+        # 次のページ（page_number + 1）の生成時に本文で渡さないページまでをあらすじに含める
+        target = len(story_context) + 1 - self.story_context_recent_pages
+        summarized_through = story.get("context_summary_through") or 0
+        if target <= summarized_through or request.story_id in self._summary_tasks:
+            return
+        task = self._spawn_background(self._update_story_summary(
+            request.story_id,
+            request.user_id,
+            story.get("context_summary"),
+            summarized_through,
+            story_context[summarized_through:target]
+        ))
+        self._summary_tasks[request.story_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(request.story_id, None))
+
+    async def _update_story_summary(self, story_id: str, user_id: str, summary: str, summarized_through: int, new_pages: List[str]) -> None:
+        """既存のあらすじに新しく要約対象になったページを加えて要約し直し、ストーリー行に保存"""
+        pages_text = "\n".join([f"ページ{summarized_through + i + 1}: {page}" for i, page in enumerate(new_pages)])
+        prompt = f"""絵本のあらすじを更新してください。
+
+これまでのあらすじ:
+{summary or "（なし）"}
+
+追加するページ:
+{pages_text}
+
+登場人物の名前・特徴、場所、これまでの出来事、まだ回収されていない伏線を残し、300文字以内の日本語のあらすじにまとめてください。
+あらすじの本文のみを出力してください。"""
         try:
-            # ユーザー入力をログ出力
-            user_input = f"ページ{request.page_number}: {request.user_direction}"
-            logger.info(f"User input for next page: {user_input}")
-            logger.info(f"Generated prompt: {prompt}")
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-5",
+            response = await self._create_chat_completion(
+                user_id=user_id,
+                cache_endpoint="summary",
+                model=self.story_summary_model,
                 messages=[
-                    {"role": "system", "content": "あなたは経験豊富な子供向け絵本作家です。必ず有効なJSONフォーマットで回答してください。マークダウンのコードブロック（```json や ``` など）は一切使用せず、純粋なJSONオブジェクトのみを出力してください。"},
+                    {"role": "system", "content": "あなたは子供向け絵本の編集者です。"},
                     {"role": "user", "content": prompt}
                 ],
-                # temperature=0.8,
-                max_completion_tokens=4000,
-                response_format={"type": "json_object"}
+                max_completion_tokens=2000
             )
+            new_summary = (response.choices[0].message.content or "").strip()
+            if not new_summary:
+                raise ValueError("OpenAI returned an empty summary")
+            through = summarized_through + len(new_pages)
+            await self.storage.update_story(story_id, {
+                "context_summary": new_summary,
+                "context_summary_through": through
+            })
+            logger.info(f"Story summary updated for story {story_id} through page {through} ({len(new_summary)} chars)")
+        except Exception as e:
+            # あらすじが古いままでも、要約されていないページは本文で渡すため生成は続けられる
+            logger.error(f"Error updating story summary for story {story_id}: {e}")
 
-            # メタ情報ログ
-            try:
-                choice0 = response.choices[0]
-                finish_reason = getattr(choice0, "finish_reason", None)
-                model_used = getattr(response, "model", None)
-                resp_id = getattr(response, "id", None)
-                usage = getattr(response, "usage", None)
-                logger.info(f"OpenAI meta(next): id={resp_id}, model={model_used}, finish_reason={finish_reason}, usage={usage}")
-            except Exception:
-                pass
-
-            choice = response.choices[0]
-            parsed = getattr(getattr(choice, "message", object()), "parsed", None)
-            content = choice.message.content
-            if parsed is not None:
-                logger.info("OpenAI provided parsed JSON (next).")
-                page_data = parsed
-            else:
-                logger.info(f"OpenAI response: {content}")
-                if not content:
-                    raise ValueError("OpenAI returned invalid JSON: ")
-                page_data = self._extract_json_object(content)
-                if page_data is None:
-                    raise ValueError(f"OpenAI returned invalid JSON: {content}")
-            
+    async def generate_next_page(self, request: NextPageRequest, story_context: List[str], previous_image_url: str = None, story: dict = None) -> StoryPage:
+        """ユーザーの意図を反映して次のページを生成。前ページ画像URLがあればプロンプトに含める"""
+        try:
+            page_data, user_input = await self.generate_next_page_text(request, story_context, story)
             # フォルダ構造で画像を生成・保存（前ページ画像URLを渡す）
             # ストーリーから画風を取得（デフォルトは水彩）
             style = story.get("art_style", "watercolor") if story else "watercolor"
-            image_storage_path, image_url = await self.generate_and_store_story_image(
-                page_data["image_prompt"],
-                style,
-                request.user_id,
-                request.story_id,
+            return await self._store_page(
+                page_data,
                 request.page_number,
+                style,
+                user_input,
+                user_id=request.user_id,
+                story_id=request.story_id,
                 previous_image_url=previous_image_url
             )
-            
-            # プロンプトとレスポンスをDBに保存
-            try:
-                await self.supabase.save_page_with_prompt(
-                    story_id=request.story_id,
-                    page_number=request.page_number,
-                    text=page_data["text"],
-                    image_prompt=page_data["image_prompt"],
-                    image_url=image_url,
-                    user_prompt=user_input,
-                    generated_response=page_data
-                )
-            except Exception as db_error:
-                logger.error(f"Failed to save prompt data to DB: {db_error}")
-            
-            result_page = StoryPage(
-                page_number=page_data["page_number"],
-                text=page_data["text"],
-                image_prompt=page_data["image_prompt"],
-                image_url=image_url
-            )
-            
-            # 返却するJSONをログ出力
-            result_json = {
-                "page_number": result_page.page_number,
-                "text": result_page.text,
-                "image_prompt": result_page.image_prompt,
-                "image_url": result_page.image_url
-            }
-            logger.info(f"Returning JSON response: {json.dumps(result_json, ensure_ascii=False)}")
-            
-            return result_page
-
         except Exception as e:
             logger.error(f"Error generating next page: {e}")
             raise
+
+    async def stream_next_page(self, request: NextPageRequest, story_context: List[str], previous_image_url: str = None, story: dict = None) -> AsyncIterator[tuple[str, dict]]:
+        """次のページを段階的に生成し、(イベント名, データ) を準備でき次第 yield する"""
+        try:
+            page_data, user_input = await self.generate_next_page_text(request, story_context, story)
+            yield "text", {
+                "page_number": page_data["page_number"],
+                "text": page_data["text"],
+                "image_prompt": page_data["image_prompt"],
+                "story_id": request.story_id
+            }
+            style = story.get("art_style", "watercolor") if story else "watercolor"
+            page = await self._store_page(
+                page_data,
+                request.page_number,
+                style,
+                user_input,
+                user_id=request.user_id,
+                story_id=request.story_id,
+                previous_image_url=previous_image_url
+            )
+            yield "image", page.model_dump(include={
+                "page_number", "image_url", "image_status", "image_tier", "image_job_id", "image_derivatives"
+            })
+        except Exception as e:
+            logger.error(f"Error streaming next page: {e}")
+            raise
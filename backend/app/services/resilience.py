@@ -0,0 +1,224 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from openai import APIConnectionError, APITimeoutError, InternalServerError
+
+from .deadline import DeadlineExceeded, remaining_time
+
+logger = logging.getLogger(__name__)
+
+# 再試行する一時的なエラー（429 は OpenAIGovernor が処理する）
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    APITimeoutError,
+    APIConnectionError,
+    InternalServerError,
+    httpx.TransportError,
+)
+
+
+class LatencyTracker:
+    """直近の所要時間からパーセンタイルを求める"""
+
+    def __init__(self, window: int = 200):
+        self._samples: "deque[float]" = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class StagePolicy:
+    """処理段階（text / image / upload）ごとのタイムアウト・再試行・ヘッジの方針
+
+    1回の試行のタイムアウトは段階のタイムアウトとリクエストの締め切りまでの残り時間の短い方。
+    一時的なエラーはジッター付きの指数バックオフで再試行する。
+    hedge が有効なら、1回目が直近の p{hedge_percentile} を超えても終わらない場合に2回目を並行して送り、
+    先に成功した方を使う。
+    retry_on_timeout=False の段階は、タイムアウトした試行が止まらずに続く（スレッドで実行する同期呼び出しなど）ため、
+    タイムアウト後は再試行しない（接続エラーなど、試行が終わったことが分かるエラーは再試行する）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        retry_on_timeout: bool = True,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.retry_on_timeout = retry_on_timeout
+        self.latency = LatencyTracker()
+        # 統計
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _attempt_timeout(self) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return self.timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline exceeded before {self.name} stage")
+        return min(self.timeout, remaining)
+
+    def _hedge_after(self) -> Optional[float]:
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    async def run(self, call: Callable[[], Awaitable], hedge_call: Callable[[], Optional[Awaitable]] = None):
+        """call() を方針に従って実行し、結果を返す（call は試行ごとに新しい awaitable を返すこと）
+
+        hedge_call を渡すと、ヘッジの2回目はそれで送る（今は送れない場合は None を返す。省略時は call）。
+        """
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            timeout = self._attempt_timeout()
+            started = time.monotonic()
+            try:
+                hedge_after = self._hedge_after()
+                if hedge_after is not None and hedge_after < timeout:
+                    result = await self._hedged(call, timeout, hedge_after, hedge_call or call)
+                else:
+                    result = await asyncio.wait_for(call(), timeout)
+            except DeadlineExceeded:
+                raise
+            except TRANSIENT_ERRORS as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    # 締め切りまでに再試行できない（締め切りで打ち切られた場合も含む）
+                    logger.error(f"{self.name} stage stopped by request deadline after {attempt + 1} attempt(s): {type(e).__name__}: {e}")
+                    raise DeadlineExceeded(f"Request deadline exceeded in {self.name} stage") from e
+                if attempt >= self.retries:
+                    logger.error(f"{self.name} stage failed after {attempt + 1} attempt(s): {type(e).__name__}: {e}")
+                    raise
+                if isinstance(e, asyncio.TimeoutError) and not self.retry_on_timeout:
+                    logger.error(f"{self.name} stage timed out after {timeout:.2f}s, not retrying while the attempt may still be running")
+                    raise
+                self.retried += 1
+                logger.warning(
+                    f"{self.name} stage transient error ({type(e).__name__}: {e}), "
+                    f"retrying in {delay:.2f}s ({attempt + 1}/{self.retries})"
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.latency.record(time.monotonic() - started)
+            return result
+
+    async def _hedged(self, call: Callable[[], Awaitable], timeout: float, hedge_after: float, hedge_call: Callable[[], Optional[Awaitable]]):
+        deadline = time.monotonic() + timeout
+        first = asyncio.ensure_future(call())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                second = hedge_call()
+                if second is None:
+                    logger.info(f"{self.name} stage slower than p{self.hedge_percentile:g} ({hedge_after:.2f}s), no capacity for a hedged request")
+                else:
+                    self.hedged += 1
+                    logger.info(f"{self.name} stage slower than p{self.hedge_percentile:g} ({hedge_after:.2f}s), sending hedged request")
+                    tasks.add(asyncio.ensure_future(second))
+            error = None
+            while tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, tasks = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                winner = None
+                for task in done:
+                    if task.exception() is None:
+                        winner = winner or task
+                    else:
+                        error = task.exception()
+                if winner is not None:
+                    if winner is not first:
+                        self.hedge_wins += 1
+                    return winner.result()
+            raise error
+        finally:
+            for task in (first, *tasks):
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "timeout_s": self.timeout,
+            "calls": self.calls,
+            "retried": self.retried,
+            "timeouts": self.timeouts,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+def create_stage_policies() -> dict:
+    """環境変数から段階ごとの方針を作る"""
+    backoff_base = float(os.getenv("RETRY_BACKOFF_BASE_SECONDS", "0.5"))
+    backoff_max = float(os.getenv("RETRY_BACKOFF_MAX_SECONDS", "8"))
+    return {
+        "text": StagePolicy(
+            "text",
+            timeout=float(os.getenv("OPENAI_TEXT_TIMEOUT_SECONDS", "90")),
+            retries=int(os.getenv("OPENAI_TEXT_RETRIES", "2")),
+            backoff_base=backoff_base,
+            backoff_max=backoff_max,
+            hedge=os.getenv("OPENAI_TEXT_HEDGE", "off").lower() in ("on", "1", "true"),
+            hedge_percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95")),
+            hedge_min_samples=int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20")),
+        ),
+        "image": StagePolicy(
+            "image",
+            timeout=float(os.getenv("OPENAI_IMAGE_TIMEOUT_SECONDS", "120")),
+            retries=int(os.getenv("OPENAI_IMAGE_RETRIES", "1")),
+            backoff_base=backoff_base,
+            backoff_max=backoff_max,
+        ),
+        "upload": StagePolicy(
+            "upload",
+            timeout=float(os.getenv("STORAGE_UPLOAD_TIMEOUT_SECONDS", "30")),
+            retries=int(os.getenv("STORAGE_UPLOAD_RETRIES", "2")),
+            backoff_base=backoff_base,
+            backoff_max=backoff_max,
+            # Supabase のアップロードはスレッドで実行され、タイムアウトしても止まらないため重ねて送らない
+            retry_on_timeout=False,
+        ),
+    }
@@ -0,0 +1,135 @@
+"""
+ストーリー・ページ・画像の保存先
+
+OpenAIService とルーターは StorageService のメソッドだけを使い、実装は STORAGE_BACKEND で選ぶ。
+
+- supabase（デフォルト）: Supabase（PostgREST + Storage）。SupabaseService
+- local: SQLite（WALモード）+ ローカルディスクの画像ファイル（/storage で配信）。LocalStorageService
+- memory: プロセス内の dict（再起動で消える。開発・ベンチマーク用）。MockSupabaseService
+"""
+import os
+import re
+from typing import Optional, Protocol, Union
+
+from .image_pipeline import DecodedImage
+
+# 画像の保存パスに埋め込む値（user_id はリクエストの本文から来る）に使える文字。".." や "/" で保存先の外に出さない
+_SAFE_PATH_SEGMENT = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def safe_path_segment(value, name: str) -> str:
+    """保存パスの1階層分として使える値か検証して返す（使えない場合は ValueError）"""
+    value = str(value)
+    if not _SAFE_PATH_SEGMENT.fullmatch(value):
+        raise ValueError(f"Invalid {name} for storage path: {value!r}")
+    return value
+
+
+def story_image_path(user_id: str, digest: str, file_extension: str) -> str:
+    """ストーリー用の画像の保存パス（users/{user_id}/sha256/{digest}.{extension}。全実装で共通）"""
+    return (
+        f"users/{safe_path_segment(user_id, 'user_id')}/sha256/"
+        f"{safe_path_segment(digest, 'digest')}.{safe_path_segment(file_extension, 'file_extension')}"
+    )
+
+
+def story_image_derivative_path(user_id: str, source_digest: str, label: str, file_extension: str) -> str:
+    """派生画像の保存パス（users/{user_id}/sha256/{元画像のdigest}/{label}.{extension}）"""
+    return (
+        f"users/{safe_path_segment(user_id, 'user_id')}/sha256/{safe_path_segment(source_digest, 'digest')}/"
+        f"{safe_path_segment(label, 'label')}.{safe_path_segment(file_extension, 'file_extension')}"
+    )
+
+
+class StorageService(Protocol):
+    """ストーリー・ページの CRUD と画像の保存（ルーター・OpenAIService・ワーカーが呼ぶメソッドはすべてここに並べる）"""
+
+    async def create_story(self, story_data: dict) -> dict: ...
+
+    async def get_story(self, story_id: str) -> Optional[dict]: ...
+
+    async def get_story_context(self, story_id: str, through_page: Optional[int] = None) -> Optional[dict]:
+        """ストーリー行 + pages（page_number, text, image_url を page_number 順）"""
+        ...
+
+    async def update_story(self, story_id: str, update_data: dict) -> dict: ...
+
+    async def get_page_by_story_and_number(self, story_id: str, page_number: int) -> Optional[dict]: ...
+
+    async def get_story_pages(self, story_id: str) -> list: ...
+
+    async def get_pages_by_story_id(self, story_id: str) -> list:
+        """get_story_pages のエイリアス（GET /generate/story/{story_id}）"""
+        ...
+
+    async def add_page(self, page_data: dict) -> dict: ...
+
+    async def add_pages(self, pages_data: list) -> list: ...
+
+    async def create_page(self, page_data: dict) -> dict:
+        """add_page のエイリアス"""
+        ...
+
+    async def save_page_with_prompt(
+        self,
+        story_id: str,
+        page_number: int,
+        text: str,
+        image_prompt: str,
+        image_url: str,
+        user_prompt: str = None,
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
+    ) -> dict: ...
+
+    async def update_page_with_prompt(
+        self,
+        story_id: str,
+        page_number: int,
+        text: str = None,
+        image_prompt: str = None,
+        image_url: str = None,
+        user_prompt: str = None,
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
+    ) -> dict: ...
+
+    async def upload_image(self, bucket: str, file_path: str, file_data: bytes) -> str:
+        """画像を file_path に保存し、公開URLを返す"""
+        ...
+
+    async def upload_story_image(
+        self, bucket: str, user_id: str, story_id: str, page_number: int,
+        file_data: Union[bytes, DecodedImage], file_extension: str = "png"
+    ) -> tuple[str, str]:
+        """内容のハッシュをファイル名にして保存し、(保存パス, 公開URL) を返す"""
+        ...
+
+    async def upload_story_image_derivative(
+        self, bucket: str, user_id: str, source_digest: str, label: str,
+        image: DecodedImage, file_extension: str = "webp"
+    ) -> tuple[str, str]: ...
+
+
+def create_storage_service() -> StorageService:
+    """環境変数 STORAGE_BACKEND（supabase / local / memory）に応じた保存先を生成"""
+    backend = os.getenv("STORAGE_BACKEND", "supabase").lower()
+    # 使わない実装の依存（supabase パッケージなど）は読み込まない
+    if backend == "supabase":
+        from .supabase_service import SupabaseService
+        return SupabaseService()
+    if backend == "local":
+        from .local_storage_service import LocalStorageService
+        return LocalStorageService(
+            db_path=os.getenv("LOCAL_STORAGE_DB_PATH", "data/ehon.sqlite3"),
+            files_dir=os.getenv("LOCAL_STORAGE_DIR", "data/storage"),
+            public_url_base=os.getenv("LOCAL_STORAGE_PUBLIC_URL", "http://localhost:8000/storage"),
+        )
+    if backend == "memory":
+        from .mock_supabase_service import MockSupabaseService
+        return MockSupabaseService()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,88 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class StoryContextCache:
+    """story_id ごとのストーリー文脈（ストーリー行 + page_number 順のページ一覧）を保持する LRU + TTL キャッシュ
+
+    同じワーカーで書き込んだ内容をそのまま次のページ生成に使うためのプロセス内キャッシュ。
+    イベントループ上からのみ操作する前提のため、ロックは持たない。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _copy(context: dict) -> dict:
+        """呼び出し側での変更がキャッシュに波及しないようにコピーを返す"""
+        copied = dict(context)
+        copied["pages"] = [dict(page) for page in context.get("pages", [])]
+        return copied
+
+    def get(self, story_id: str) -> Optional[dict]:
+        """キャッシュ済みの文脈を返す（期限切れ・未登録なら None）"""
+        entry = self._entries.get(story_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, context = entry
+        if expires_at < time.monotonic():
+            del self._entries[story_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(story_id)
+        self.hits += 1
+        return self._copy(context)
+
+    def put(self, story_id: str, context: dict) -> None:
+        """文脈を登録（上限を超えたら最も古く使われたものから削除）"""
+        self._entries[story_id] = (time.monotonic() + self.ttl_seconds, self._copy(context))
+        self._entries.move_to_end(story_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set_page(self, story_id: str, page: dict) -> None:
+        """キャッシュ済みの文脈にページを追加・更新（未登録のストーリーは何もしない）"""
+        entry = self._entries.get(story_id)
+        if entry is None:
+            return
+        _, context = entry
+        pages = [p for p in context["pages"] if p.get("page_number") != page.get("page_number")]
+        pages.append(dict(page))
+        pages.sort(key=lambda p: p.get("page_number", 0))
+        context["pages"] = pages
+
+    def set_story(self, story_id: str, story: dict) -> None:
+        """キャッシュ済みのストーリー行を置き換える（ページ一覧は保持）"""
+        entry = self._entries.get(story_id)
+        if entry is None:
+            return
+        expires_at, context = entry
+        self._entries[story_id] = (expires_at, {**story, "pages": context["pages"]})
+
+    def invalidate(self, story_id: str) -> None:
+        self._entries.pop(story_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+# SupabaseService の全インスタンスで共有するキャッシュ
+story_context_cache = StoryContextCache(
+    max_entries=int(os.getenv("STORY_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("STORY_CACHE_TTL_SECONDS", "600")),
+)
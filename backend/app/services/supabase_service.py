@@ -1,15 +1,39 @@
 import os
-from supabase import create_client, Client
-from typing import Optional
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from supabase import create_client, Client, ClientOptions
+from typing import Optional, Union
 import logging
 
+from .story_context_cache import story_context_cache
+from .image_pipeline import DecodedImage
+from .storage import story_image_derivative_path, story_image_path
+from .http_pools import storage_http_client
+from ..observability.metrics import observe_stage
+from ..observability.tracing import trace_methods
+from ..observability.logging import log_payload
+
 logger = logging.getLogger(__name__)
 
+# supabase-py の Client は同期APIのため、イベントループを塞がないよう
+# 専用のスレッドプールで実行する（全インスタンスで共有し、同時実行数を制限）
+SUPABASE_MAX_WORKERS = int(os.getenv("SUPABASE_MAX_WORKERS", "16"))
+_executor = ThreadPoolExecutor(max_workers=SUPABASE_MAX_WORKERS, thread_name_prefix="supabase")
+# PostgREST / Storage 呼び出し1回あたりの読み取りタイムアウト（接続・プール待ちは http_pools の設定）
+SUPABASE_HTTP_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_HTTP_TIMEOUT_SECONDS", "30"))
+
+# _run はスレッドプールへの委譲だけなので、呼び出し元（_execute など）のスパンで足りる
+@trace_methods("supabase", exclude=("_run",))
 class SupabaseService:
+    # ページ生成のプロンプトに必要なページ列（generated_response などの大きな列は取得しない）
+    STORY_CONTEXT_PAGE_COLUMNS = "page_number,text,image_url"
+
     async def get_page_by_story_and_number(self, story_id: str, page_number: int) -> Optional[dict]:
         """指定したストーリーIDとページ番号のページ情報を取得"""
         try:
-            result = self.client.table("pages").select("*").eq("story_id", story_id).eq("page_number", page_number).execute()
+            result = await self._execute(self.client.table("pages").select("*").eq("story_id", story_id).eq("page_number", page_number))
             return result.data[0] if result.data else None
         except Exception as e:
             logger.error(f"Error getting page by story and number: {e}")
@@ -21,13 +45,34 @@ class SupabaseService:
         if not url or not key:
             raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
         
-        self.client: Client = create_client(url, key)
-        
+        # PostgREST と Storage は共有の HTTP/2 プールを使う（スレッドごとに同時に1接続なので上限はワーカー数）
+        http_client = storage_http_client(
+            default_max_connections=SUPABASE_MAX_WORKERS, read_timeout=SUPABASE_HTTP_TIMEOUT_SECONDS
+        )
+        self.client: Client = create_client(url, key, options=ClientOptions(httpx_client=http_client))
+        self.context_cache = story_context_cache
+
+    async def _run(self, func, *args, **kwargs):
+        """同期関数をSupabase用スレッドプールで実行し、結果を待つ"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+    async def _execute(self, query):
+        """PostgRESTクエリの execute() をイベントループ外で実行"""
+        return await self._run(query.execute)
+
+    def _cache_page(self, story_id: str, row: dict) -> None:
+        """保存・更新したページ行を文脈キャッシュへ反映（プロンプトに必要な列のみ）"""
+        columns = self.STORY_CONTEXT_PAGE_COLUMNS.split(",")
+        self.context_cache.set_page(story_id, {column: row.get(column) for column in columns})
+
     async def create_story(self, story_data: dict) -> dict:
         """新しいストーリーをデータベースに作成"""
         try:
-            result = self.client.table("stories").insert(story_data).execute()
-            return result.data[0]
+            result = await self._execute(self.client.table("stories").insert(story_data))
+            story = result.data[0]
+            self.context_cache.put(story["id"], {**story, "pages": []})
+            return story
         except Exception as e:
             logger.error(f"Error creating story: {e}")
             raise
@@ -35,16 +80,53 @@ class SupabaseService:
     async def get_story(self, story_id: str) -> Optional[dict]:
         """ストーリーを取得"""
         try:
-            result = self.client.table("stories").select("*").eq("id", story_id).execute()
+            result = await self._execute(self.client.table("stories").select("*").eq("id", story_id))
             return result.data[0] if result.data else None
         except Exception as e:
             logger.error(f"Error getting story: {e}")
             raise
             
+    async def get_story_context(self, story_id: str, through_page: Optional[int] = None) -> Optional[dict]:
+        """ストーリー行と、プロンプトに必要なページ列のみを1リクエストで取得（pages は page_number 順）
+
+        through_page を指定すると、キャッシュにそのページまで揃っていない場合（他ワーカーで書き込まれた等）や
+        そのページの画像が未確定（画像ワーカーで生成中）の場合はDBから取り直す。
+        """
+        cached = self.context_cache.get(story_id)
+        if cached is not None:
+            cached_pages = {page["page_number"]: page for page in cached["pages"]}
+            if through_page is None or through_page < 1:
+                return cached
+            if all(n in cached_pages for n in range(1, through_page + 1)) and cached_pages[through_page].get("image_url"):
+                return cached
+            self.context_cache.invalidate(story_id)
+        try:
+            # 外部キー pages.story_id を使った埋め込みselectで stories と pages を一度に取得
+            result = await self._execute(
+                self.client.table("stories")
+                .select(f"*, pages({self.STORY_CONTEXT_PAGE_COLUMNS})")
+                .eq("id", story_id)
+                .order("page_number", foreign_table="pages")
+            )
+            if not result.data:
+                return None
+            story = result.data[0]
+            story["pages"] = story.get("pages") or []
+            self.context_cache.put(story_id, story)
+            return story
+        except Exception as e:
+            logger.error(f"Error getting story context: {e}")
+            raise
+            
     async def update_story(self, story_id: str, update_data: dict) -> dict:
         """ストーリーを更新"""
         try:
-            result = self.client.table("stories").update(update_data).eq("id", story_id).execute()
+            # キャッシュ済みのストーリー行は無効化し、更新後の行で置き換える
+            result = await self._execute(self.client.table("stories").update(update_data).eq("id", story_id))
+            if result.data:
+                self.context_cache.set_story(story_id, result.data[0])
+            else:
+                self.context_cache.invalidate(story_id)
             return result.data[0]
         except Exception as e:
             logger.error(f"Error updating story: {e}")
@@ -53,12 +135,26 @@ class SupabaseService:
     async def add_page(self, page_data: dict) -> dict:
         """新しいページをデータベースに追加"""
         try:
-            result = self.client.table("pages").insert(page_data).execute()
+            with observe_stage("db_insert"):
+                result = await self._execute(self.client.table("pages").insert(page_data))
+            self._cache_page(page_data["story_id"], result.data[0])
             return result.data[0]
         except Exception as e:
             logger.error(f"Error adding page: {e}")
             raise
             
+    async def add_pages(self, pages_data: list) -> list:
+        """複数ページを1回のINSERTでまとめて追加"""
+        try:
+            with observe_stage("db_insert"):
+                result = await self._execute(self.client.table("pages").insert(pages_data))
+            for row in result.data:
+                self._cache_page(row["story_id"], row)
+            return result.data
+        except Exception as e:
+            logger.error(f"Error adding pages: {e}")
+            raise
+            
     async def create_page(self, page_data: dict) -> dict:
         """新しいページを作成（add_pageのエイリアス）"""
         return await self.add_page(page_data)
@@ -66,7 +162,7 @@ class SupabaseService:
     async def get_story_pages(self, story_id: str) -> list:
         """ストーリーのページ一覧を取得"""
         try:
-            result = self.client.table("pages").select("*").eq("story_id", story_id).order("page_number").execute()
+            result = await self._execute(self.client.table("pages").select("*").eq("story_id", story_id).order("page_number"))
             return result.data
         except Exception as e:
             logger.error(f"Error getting story pages: {e}")
@@ -79,7 +175,7 @@ class SupabaseService:
     async def upload_image(self, bucket: str, file_path: str, file_data: bytes) -> str:
         """Supabase Storageに画像をアップロード"""
         try:
-            result = self.client.storage.from_(bucket).upload(file_path, file_data)
+            result = await self._run(self.client.storage.from_(bucket).upload, file_path, file_data)
             # パブリックURLを生成
             public_url = self.client.storage.from_(bucket).get_public_url(file_path)
             return public_url
@@ -87,22 +183,58 @@ class SupabaseService:
             logger.error(f"Error uploading image: {e}")
             raise
             
-    async def upload_story_image(self, bucket: str, user_id: str, story_id: str, page_number: int, file_data: bytes, file_extension: str = "png") -> tuple[str, str]:
-        """ストーリー用の画像をユーザーID配下に保存"""
+    async def upload_story_image(self, bucket: str, user_id: str, story_id: str, page_number: int, file_data: Union[bytes, DecodedImage], file_extension: str = "png") -> tuple[str, str]:
+        """ストーリー用の画像をユーザーID配下に、内容のハッシュ（SHA-256）をファイル名にして保存
+
+        file_data に DecodedImage を渡すと、一時ファイルからチャンク単位でストリーミングアップロードする。
+        """
         try:
-            # フォルダ構造: users/{user_id}/{story_id}/page_{page_number}.{extension}
-            file_path = f"users/{user_id}/{story_id}/page_{page_number}.{file_extension}"
-            
-            result = self.client.storage.from_(bucket).upload(file_path, file_data)
-            
-            # パブリックURLを生成
-            public_url = self.client.storage.from_(bucket).get_public_url(file_path)
+            # フォルダ構造: users/{user_id}/sha256/{digest}.{extension}
+            # 同じ内容なら同じパスになるため、再試行や重複レンダリングは存在確認（HEAD）だけで済む
+            if isinstance(file_data, DecodedImage):
+                digest = file_data.sha256
+            else:
+                digest = await self._run(lambda: hashlib.sha256(file_data).hexdigest())
+            file_path = story_image_path(user_id, digest, file_extension)
+            public_url = await self._upload_if_missing(bucket, file_path, file_data, f"image/{file_extension}")
             
             # ファイルパスとURLの両方を返す
             return file_path, public_url
         except Exception as e:
             logger.error(f"Error uploading story image: {e}")
             raise
+
+    async def upload_story_image_derivative(self, bucket: str, user_id: str, source_digest: str, label: str, image: DecodedImage, file_extension: str = "webp") -> tuple[str, str]:
+        """派生画像（縮小版・サムネイル）を元画像のハッシュ配下に保存"""
+        try:
+            # フォルダ構造: users/{user_id}/sha256/{元画像のdigest}/{label}.{extension}
+            file_path = story_image_derivative_path(user_id, source_digest, label, file_extension)
+            public_url = await self._upload_if_missing(bucket, file_path, image, f"image/{file_extension}")
+            return file_path, public_url
+        except Exception as e:
+            logger.error(f"Error uploading story image derivative: {e}")
+            raise
+
+    async def _upload_if_missing(self, bucket: str, file_path: str, file_data: Union[bytes, DecodedImage], content_type: str) -> str:
+        """パスに対象が無ければアップロードし、パブリックURLを返す（パスは内容から決まる前提）"""
+        storage = self.client.storage.from_(bucket)
+        # 存在確認とアップロードの間に同じ画像が保存されても失敗しないよう upsert で保存
+        file_options = {"content-type": content_type, "upsert": "true"}
+        
+        def upload():
+            if isinstance(file_data, DecodedImage):
+                # ファイルオブジェクトを渡すと multipart の本文はチャンク単位で送信される
+                with file_data.open() as f:
+                    return storage.upload(file_path, f, file_options)
+            return storage.upload(file_path, file_data, file_options)
+        
+        if await self._run(storage.exists, file_path):
+            logger.info(f"Image already stored: {file_path}")
+        else:
+            await self._run(upload)
+        
+        # パブリックURLを生成
+        return storage.get_public_url(file_path)
             
     async def save_page_with_prompt(
         self,
@@ -112,7 +244,10 @@ class SupabaseService:
         image_prompt: str,
         image_url: str,
         user_prompt: str = None,
-        generated_response: dict = None
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
     ) -> dict:
         """ページ情報をユーザープロンプトと生成レスポンスと共に保存"""
         try:
@@ -122,19 +257,23 @@ class SupabaseService:
                 "text": text,
                 "image_prompt": image_prompt,
                 "image_url": image_url,
+                "image_storage_path": image_storage_path,
+                "image_derivatives": image_derivatives,
+                "image_tier": image_tier,
                 "user_prompt": user_prompt,
                 "generated_response": generated_response
             }
             
             # ログ出力
             logger.info(f"Saving page {page_number} for story {story_id}")
-            logger.info(f"User prompt: {user_prompt}")
-            logger.info(f"Generated response: {generated_response}")
+            log_payload(logger, f"Page {page_number} prompt data", user_prompt=user_prompt, generated_response=generated_response)
             
-            result = self.client.table("pages").insert(page_data).execute()
+            with observe_stage("db_insert"):
+                result = await self._execute(self.client.table("pages").insert(page_data))
             
             if result.data:
                 logger.info(f"Successfully saved page {page_number} with prompt data")
+                self._cache_page(story_id, result.data[0])
                 return result.data[0]
             else:
                 logger.error(f"Failed to save page {page_number}")
@@ -152,7 +291,10 @@ class SupabaseService:
         image_prompt: str = None,
         image_url: str = None,
         user_prompt: str = None,
-        generated_response: dict = None
+        generated_response: dict = None,
+        image_storage_path: str = None,
+        image_derivatives: dict = None,
+        image_tier: str = None
     ) -> dict:
         """既存ページ情報をユーザープロンプトと生成レスポンスと共に更新"""
         try:
@@ -163,6 +305,12 @@ class SupabaseService:
                 update_data["image_prompt"] = image_prompt
             if image_url is not None:
                 update_data["image_url"] = image_url
+            if image_storage_path is not None:
+                update_data["image_storage_path"] = image_storage_path
+            if image_derivatives is not None:
+                update_data["image_derivatives"] = image_derivatives
+            if image_tier is not None:
+                update_data["image_tier"] = image_tier
             if user_prompt is not None:
                 update_data["user_prompt"] = user_prompt
             if generated_response is not None:
@@ -170,13 +318,13 @@ class SupabaseService:
             
             # ログ出力
             logger.info(f"Updating page {page_number} for story {story_id}")
-            logger.info(f"User prompt: {user_prompt}")
-            logger.info(f"Generated response: {generated_response}")
+            log_payload(logger, f"Page {page_number} prompt data", user_prompt=user_prompt, generated_response=generated_response)
             
-            result = self.client.table("pages").update(update_data).eq("story_id", story_id).eq("page_number", page_number).execute()
+            result = await self._execute(self.client.table("pages").update(update_data).eq("story_id", story_id).eq("page_number", page_number))
             
             if result.data:
                 logger.info(f"Successfully updated page {page_number} with prompt data")
+                self._cache_page(story_id, result.data[0])
                 return result.data[0]
             else:
                 logger.error(f"Failed to update page {page_number}")
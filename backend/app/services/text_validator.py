@@ -0,0 +1,63 @@
+import os
+import re
+from typing import List
+
+# ひらがな（ぁ〜ゖ、゛゜ゝゞ）と長音記号
+_HIRAGANA = re.compile(r"[ぁ-ゖ゙-ゟー]")
+# 本文に使ってよい記号
+_ALLOWED_SYMBOLS = set("、。！？!?「」『』・…〜ー ")
+_KATAKANA = re.compile(r"[ァ-ヺヽ-ヿｦ-ﾟ]")
+_KANJI = re.compile(r"[㐀-䶿一-鿿豈-﫿]")
+_LATIN_OR_DIGIT = re.compile(r"[A-Za-z0-9０-９Ａ-Ｚａ-ｚ]")
+
+# 文節スペースが無いとみなす、スペースを含まない行の長さ
+_UNSPACED_LINE_CHARS = 10
+
+
+def _unique_chars(pattern: re.Pattern, text: str) -> str:
+    return "".join(dict.fromkeys(pattern.findall(text)))
+
+
+def validate_page_text(text: str, max_lines: int = None, max_line_chars: int = None) -> List[str]:
+    """絵本の本文がプロンプトのルールを守っているかを確認し、違反内容のリストを返す（問題なければ空）
+
+    ルール: すべてひらがな / 1行20文字程度 / 4行まで / 文節ごとに半角スペース
+    """
+    if max_lines is None:
+        max_lines = int(os.getenv("PAGE_TEXT_MAX_LINES", "4"))
+    if max_line_chars is None:
+        max_line_chars = int(os.getenv("PAGE_TEXT_MAX_LINE_CHARS", "24"))
+
+    if not text or not text.strip():
+        return ["本文が空です"]
+
+    violations = []
+    katakana = _unique_chars(_KATAKANA, text)
+    if katakana:
+        violations.append(f"カタカナが含まれています: {katakana}")
+    kanji = _unique_chars(_KANJI, text)
+    if kanji:
+        violations.append(f"漢字が含まれています: {kanji}")
+    latin = _unique_chars(_LATIN_OR_DIGIT, text)
+    if latin:
+        violations.append(f"英字・数字が含まれています: {latin}")
+    if "　" in text:
+        violations.append("全角スペースが含まれています（半角スペースを使ってください）")
+    others = "".join(dict.fromkeys(
+        c for c in text
+        if c != "\n" and c != "　" and c not in _ALLOWED_SYMBOLS and not _HIRAGANA.match(c)
+        and not _KATAKANA.match(c) and not _KANJI.match(c) and not _LATIN_OR_DIGIT.match(c)
+    ))
+    if others:
+        violations.append(f"使えない文字が含まれています: {others}")
+
+    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
+    if len(lines) > max_lines:
+        violations.append(f"{len(lines)}行あります（{max_lines}行まで）")
+    for number, line in enumerate(lines, start=1):
+        length = len(line.replace(" ", ""))
+        if length > max_line_chars:
+            violations.append(f"{number}行目が{length}文字あります（1行20文字程度、最大{max_line_chars}文字）")
+        if " " not in line and length > _UNSPACED_LINE_CHARS:
+            violations.append(f"{number}行目に文節ごとの半角スペースがありません")
+    return violations
@@ -0,0 +1,157 @@
+"""
+画像レンダリングワーカー
+
+APIプロセス（IMAGE_RENDER_MODE=queue）が登録した画像ジョブを取得し、
+画像の生成・アップロード・ページの image_url 更新を行う。
+
+    cd backend
+    python -m app.workers.image_worker --processes 2 --concurrency 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+
+from ..services.openai_service import OpenAIService
+from ..services.image_job_queue import create_image_job_queue, JOB_FAILED
+from ..services.image_derivatives import shutdown_pool
+from ..services.http_pools import close_http_pools
+from ..observability.logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+async def process_job(service: OpenAIService, queue, job: dict) -> None:
+    """1件のジョブを処理し、結果をページとジョブに反映"""
+    payload = job["payload"]
+    story_id = payload["story_id"]
+    page_number = payload["page_number"]
+    try:
+        image_storage_path, image_url, image_derivatives = await service.render_story_image(
+            payload["prompt"],
+            payload["style"],
+            payload["user_id"],
+            story_id,
+            page_number,
+            previous_image_url=payload.get("previous_image_url")
+        )
+        await service.storage.update_page_with_prompt(
+            story_id, page_number,
+            image_url=image_url,
+            image_storage_path=image_storage_path or None,
+            image_derivatives=image_derivatives,
+            image_tier="final"
+        )
+    except Exception as e:
+        try:
+            status = await queue.fail(job["id"], str(e))
+        except Exception as queue_error:
+            # 記録できなくても、SQLite のキューならリースが切れた後に再取得される
+            logger.error(f"Failed to record failure of image job {job['id']}: {queue_error}")
+            return
+        logger.error(f"Image job {job['id']} failed (attempt {job['attempts']}, now {status}): {e}")
+        if status == JOB_FAILED:
+            # 再試行を打ち切ったページにはフォールバック画像を設定
+            try:
+                await service.storage.update_page_with_prompt(story_id, page_number, image_url=service.FALLBACK_IMAGE_URL)
+            except Exception as db_error:
+                logger.error(f"Failed to set fallback image for job {job['id']}: {db_error}")
+        return
+
+    try:
+        await queue.complete(job["id"], {
+            "image_url": image_url,
+            "image_storage_path": image_storage_path,
+            "image_derivatives": image_derivatives
+        })
+    except Exception as e:
+        # ページは更新済み。SQLite のキューならリースが切れた後に再取得され、同じ内容の画像はアップロードを省いて完了する
+        logger.error(f"Failed to mark image job {job['id']} complete: {e}")
+        return
+    logger.info(f"Image job {job['id']} succeeded: story {story_id} page {page_number}")
+
+
+async def run_worker(worker_id: str, concurrency: int, poll_interval: float) -> None:
+    """ジョブを取得して処理し続ける（1プロセスあたり concurrency 件を並行処理）"""
+    service = OpenAIService()
+    queue = create_image_job_queue()
+
+    async def slot(index: int) -> None:
+        slot_id = f"{worker_id}-{index}"
+        while True:
+            try:
+                job = await queue.claim(slot_id)
+            except Exception as e:
+                logger.error(f"Failed to claim image job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            try:
+                await process_job(service, queue, job)
+            except Exception as e:
+                # 1件の予期しない失敗で他のスロットやワーカープロセスを止めない
+                logger.error(f"Unexpected error processing image job {job.get('id')}: {e}")
+
+    # 親プロセスの terminate()（SIGTERM）でもループを止めて終了処理を行う
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    logger.info(f"Image worker {worker_id} started (concurrency={concurrency})")
+    try:
+        await asyncio.gather(*(slot(i) for i in range(concurrency)))
+    except asyncio.CancelledError:
+        logger.info(f"Image worker {worker_id} stopping")
+    finally:
+        # 実行中の背景処理の完了待ち、HTTP 接続プールと派生画像のプロセスプールの終了
+        try:
+            await service.aclose()
+        except Exception as e:
+            logger.error(f"Error closing OpenAI service: {e}")
+        await close_http_pools()
+        shutdown_pool(wait=False)
+        logger.info(f"Image worker {worker_id} stopped")
+
+
+def _worker_main(worker_id: str, concurrency: int, poll_interval: float) -> None:
+    configure_logging()
+    try:
+        asyncio.run(run_worker(worker_id, concurrency, poll_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="画像レンダリングワーカー")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("IMAGE_WORKER_PROCESSES", "2")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("IMAGE_WORKER_CONCURRENCY", "4")),
+                        help="1プロセスあたりの同時処理ジョブ数")
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("IMAGE_WORKER_POLL_INTERVAL", "0.5")))
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    host = socket.gethostname()
+    processes = [
+        ctx.Process(
+            target=_worker_main,
+            args=(f"{host}-{os.getpid()}-{i}", args.concurrency, args.poll_interval),
+            daemon=True,
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+/api/v1/generate/page/next の並行スループット測定
+
+OpenAI と supabase-py Client をローカルのフェイクに差し替え、同時セッション数ごとの
+スループットを計測する。Supabase 呼び出しがイベントループを塞いでいなければ、
+スループットはセッション数に比例して伸びる。
+
+    cd backend
+    python -m benchmarks.bench_concurrency
+    python -m benchmarks.bench_concurrency --blocking   # 旧実装（ループ上で同期実行）との比較
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+# サービス初期化に必要な環境変数（実際の接続は行わない）
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark-service-key")
+# SupabaseService の supabase-py Client をフェイクに差し替えて計測する
+os.environ["STORAGE_BACKEND"] = "supabase"
+
+import httpx
+
+from app.main import app
+from app.services.supabase_service import SupabaseService
+from .fakes import FakeAsyncOpenAI, FakeSupabaseClient
+
+
+def install_fakes(args, services) -> None:
+    """lifespan で生成したサービスのクライアントをフェイクに差し替える"""
+    db = FakeSupabaseClient(latency=args.db_latency, upload_latency=args.upload_latency)
+    services.openai.client = FakeAsyncOpenAI(
+        text_latency=args.text_latency, image_latency=args.image_latency
+    )
+    # ルーターと OpenAIService は同じ保存先インスタンスを共有している
+    services.storage.client = db
+
+    if args.blocking:
+        async def _inline_run(self, func, *a, **kw):
+            return func(*a, **kw)
+        SupabaseService._run = _inline_run
+
+
+async def run_session(client: httpx.AsyncClient, pages: int) -> int:
+    """1セッション: /page/first の後に /page/next を pages 回呼ぶ（next の成功数を返す）"""
+    first = await client.post("/api/v1/generate/page/first", json={
+        "story_title": "くまさんの大冒険",
+        "total_pages": pages + 1,
+        "art_style": "watercolor",
+        "main_character_name": "くまのポン太",
+        "user_id": "bench-user",
+    })
+    first.raise_for_status()
+    story_id = first.json()["story_id"]
+
+    ok = 0
+    for page_number in range(2, pages + 2):
+        response = await client.post("/api/v1/generate/page/next", json={
+            "story_id": story_id,
+            "page_number": page_number,
+            "user_direction": "もりで ともだちに あう",
+            "user_id": "bench-user",
+        })
+        if response.status_code == 200:
+            ok += 1
+    return ok
+
+
+async def measure(sessions: int, pages: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_session(client, pages) for _ in range(sessions)))
+        elapsed = time.perf_counter() - started
+    return sum(results) / elapsed
+
+
+async def main(args) -> None:
+    # プロンプト全文などのINFOログは計測のノイズになるため抑制
+    logging.getLogger().setLevel(logging.WARNING)
+    # ASGITransport は lifespan を実行しないため、サービスの生成・終了はここで行う
+    async with app.router.lifespan_context(app):
+        install_fakes(args, app.state.services)
+        await _measure_all(args)
+
+
+async def _measure_all(args) -> None:
+    mode = "blocking (旧実装)" if args.blocking else "threadpool offload"
+    print(f"🚀 /page/next 並行スループット測定 - {mode}")
+    print(f"   db={args.db_latency}s upload={args.upload_latency}s text={args.text_latency}s image={args.image_latency}s")
+    print(f"{'sessions':>8} {'req/s':>8}")
+    for sessions in args.sessions:
+        throughput = await measure(sessions, args.pages)
+        print(f"{sessions:>8} {throughput:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--pages", type=int, default=3, help="セッションあたりの /page/next 回数")
+    parser.add_argument("--db-latency", type=float, default=0.05)
+    parser.add_argument("--upload-latency", type=float, default=0.2)
+    parser.add_argument("--text-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=0.5)
+    parser.add_argument("--blocking", action="store_true", help="Supabase呼び出しをイベントループ上で同期実行する")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+ワーカーの起動時間の測定（オートスケールのコールドスタート相当）
+
+新しいインタープリターで app.main を import し、lifespan（サービスの生成）を実行して最初のリクエストに
+応答するまでを runs 回計測する。各段階の所要時間と、import 時点で openai / supabase SDK が
+読み込まれていたかを表示する。
+
+    cd backend
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 10 --storage local --json startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# サービス初期化に必要な環境変数（実際の接続は行わない）
+_ENV = {
+    "OPENAI_API_KEY": "sk-benchmark",
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_SERVICE_KEY": "benchmark-service-key",
+    "LOG_LEVEL": "WARNING",
+}
+
+_HEAVY_MODULES = ("openai", "supabase", "PIL")
+
+
+async def _first_request(app) -> tuple[float, float]:
+    """(lifespan の開始にかかった秒数, lifespan の開始から /api/health に応答するまでの秒数)"""
+    import httpx
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        lifespan = time.perf_counter() - started
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            response = await client.get("/api/health")
+            response.raise_for_status()
+        first_response = time.perf_counter() - started
+    return lifespan, first_response
+
+
+def child() -> None:
+    """計測される側（新しいプロセスで1回だけ実行し、結果を JSON で標準出力へ）"""
+    started = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter() - started
+    loaded_at_import = [name for name in _HEAVY_MODULES if name in sys.modules]
+    lifespan, first_response = asyncio.run(_first_request(app))
+    print(json.dumps({
+        "import_seconds": imported,
+        "lifespan_seconds": lifespan,
+        "first_response_seconds": first_response,
+        "loaded_at_import": loaded_at_import,
+    }))
+
+
+def run_once(env: dict) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+        env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    wall = time.perf_counter() - started
+    return {**json.loads(result.stdout.strip().splitlines()[-1]), "process_seconds": wall}
+
+
+def main(args) -> None:
+    env = {**os.environ, **_ENV, "STORAGE_BACKEND": args.storage}
+    if args.storage == "local":
+        directory = tempfile.mkdtemp(prefix="ehon-bench-startup-")
+        env["LOCAL_STORAGE_DB_PATH"] = os.path.join(directory, "ehon.sqlite3")
+        env["LOCAL_STORAGE_DIR"] = os.path.join(directory, "storage")
+
+    results = [run_once(env) for _ in range(args.runs)]
+
+    print(f"🚀 起動時間 - storage={args.storage} runs={args.runs}")
+    print(f"   import 時点で読み込み済みの SDK: {', '.join(results[0]['loaded_at_import']) or 'なし'}")
+    print(f"{'stage':<26} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    summary = {}
+    for key, label in (
+        ("import_seconds", "import app.main"),
+        ("lifespan_seconds", "lifespan (services)"),
+        ("first_response_seconds", "lifespan + 1st response"),
+        ("process_seconds", "process total"),
+    ):
+        values = [r[key] for r in results]
+        summary[key] = {
+            "median_ms": round(statistics.median(values) * 1000, 1),
+            "min_ms": round(min(values) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1),
+        }
+        stats = summary[key]
+        print(f"{label:<26} {stats['median_ms']:>10} {stats['min_ms']:>10} {stats['max_ms']:>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "loaded_at_import": results[0]["loaded_at_import"], **summary}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="計測回数（毎回新しいプロセス）")
+    parser.add_argument("--storage", choices=["supabase", "local", "memory"], default="supabase", help="STORAGE_BACKEND")
+    parser.add_argument("--json", help="結果を JSON で保存するパス（変更前後の比較用）")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parsed = parser.parse_args()
+    if parsed.child:
+        child()
+    else:
+        main(parsed)
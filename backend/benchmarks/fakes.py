@@ -0,0 +1,300 @@
+"""
+ベンチマーク用のローカル代替実装（OpenAI / supabase-py Client）
+
+外部APIに接続せずにバックエンドの並行性能を測定するための最小限のフェイク。
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from openai.types import ImagesResponse
+from openai.types.chat import ChatCompletion
+
+# 1x1 の透明PNG（b64_json の代わりに返す）
+TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+# 画像プロンプトを指定の長さまで伸ばすための文
+_PROMPT_FILLER = "soft pastel colors, gentle morning light, friendly forest animals, detailed background"
+
+
+def random_png(approx_bytes: int) -> bytes:
+    """ランダムな画素の RGB PNG を作る（圧縮がほぼ効かないため、ファイルサイズは approx_bytes 前後になる）"""
+    side = max(1, int((approx_bytes / 3) ** 0.5))
+    raw = b"".join(b"\x00" + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+class _FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakeQuery:
+    """supabase-py の PostgREST クエリビルダを模倣（execute() は同期でブロックする）"""
+
+    def __init__(self, client: "FakeSupabaseClient", table: str):
+        self._client = client
+        self._table = table
+        self._op = "select"
+        self._payload = None
+        self._filters = []
+        self._order = None
+        self._embeds = {}
+
+    def select(self, *columns):
+        self._op = "select"
+        # "*, pages(page_number,text)" のような埋め込みselectを解釈
+        for name, cols in re.findall(r"(\w+)\(([^)]*)\)", ",".join(columns)):
+            self._embeds[name] = [c.strip() for c in cols.split(",") if c.strip()]
+        return self
+
+    def insert(self, payload):
+        self._op = "insert"
+        self._payload = payload
+        return self
+
+    def update(self, payload):
+        self._op = "update"
+        self._payload = payload
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, value))
+        return self
+
+    def order(self, column, **kwargs):
+        self._order = column
+        return self
+
+    def execute(self):
+        # 実際のHTTPラウンドトリップ相当の待ち時間（スレッドをブロックする）
+        time.sleep(self._client.latency)
+        with self._client.lock:
+            rows = self._client.tables.setdefault(self._table, [])
+            if self._op == "insert":
+                items = self._payload if isinstance(self._payload, list) else [self._payload]
+                inserted = []
+                for item in items:
+                    row = {"id": str(uuid.uuid4()), **item}
+                    rows.append(row)
+                    inserted.append(dict(row))
+                return _FakeResult(inserted)
+
+            matched = [r for r in rows if all(r.get(c) == v for c, v in self._filters)]
+            if self._op == "update":
+                for r in matched:
+                    r.update(self._payload)
+            if self._order:
+                matched = sorted(matched, key=lambda r: r.get(self._order))
+            results = [dict(r) for r in matched]
+            for name, cols in self._embeds.items():
+                # 外部キーは "<単数形>_id"（pages.story_id -> stories.id）とみなす
+                fk = f"{self._table.rstrip('s')}_id"
+                related = self._client.tables.get(name, [])
+                for row in results:
+                    children = sorted(
+                        (c for c in related if c.get(fk) == row["id"]),
+                        key=lambda c: c.get("page_number", 0),
+                    )
+                    row[name] = [{k: c.get(k) for k in cols} for c in children]
+            return _FakeResult(results)
+
+
+class _FakeBucket:
+    def __init__(self, client: "FakeSupabaseClient", bucket: str):
+        self._client = client
+        self._bucket = bucket
+
+    def exists(self, path):
+        time.sleep(self._client.latency)
+        with self._client.lock:
+            return (self._bucket, path) in self._client.objects
+
+    def upload(self, path, file, file_options=None):
+        if hasattr(file, "read"):
+            file = file.read()
+        time.sleep(self._client.upload_latency)
+        with self._client.lock:
+            key = (self._bucket, path)
+            if key in self._client.objects and (file_options or {}).get("upsert") != "true":
+                raise RuntimeError(f"The resource already exists: {path}")
+            self._client.objects[key] = file
+        return {"path": path}
+
+    def get_public_url(self, path, options=None):
+        return f"http://fake-storage.local/{self._bucket}/{path}"
+
+
+class _FakeStorage:
+    def __init__(self, client: "FakeSupabaseClient"):
+        self._client = client
+
+    def from_(self, bucket):
+        return _FakeBucket(self._client, bucket)
+
+
+class FakeSupabaseClient:
+    """supabase-py の同期 Client の代替（インメモリ、固定レイテンシ）"""
+
+    def __init__(self, latency: float = 0.05, upload_latency: float = 0.2):
+        self.latency = latency
+        self.upload_latency = upload_latency
+        self.tables = {}
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.storage = _FakeStorage(self)
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+
+class _FakeRawResponse:
+    """with_raw_response が返す LegacyAPIResponse の代替"""
+
+    def __init__(self, parsed, headers: dict = None):
+        self.headers = headers or {}
+        self._parsed = parsed
+
+    def parse(self):
+        return self._parsed
+
+
+class _WithRawResponse:
+    """client.xxx.with_raw_response の代替（各メソッドの結果を _FakeRawResponse で包む）"""
+
+    def __init__(self, **methods):
+        for name, method in methods.items():
+            setattr(self, name, self._wrap(method))
+
+    @staticmethod
+    def _wrap(method):
+        async def call(*args, **kwargs):
+            return _FakeRawResponse(await method(*args, **kwargs))
+        return call
+
+
+class _FakeCompletions:
+    def __init__(self, owner: "FakeAsyncOpenAI"):
+        self._owner = owner
+        self.with_raw_response = _WithRawResponse(create=self.create)
+
+    async def create(self, model, messages, **kwargs):
+        await asyncio.sleep(self._owner.latency(self._owner.text_latency))
+        prompt = messages[-1]["content"]
+        prompt_tokens = sum(len(m["content"]) for m in messages)
+        image_prompt = "A bear living in a forest, watercolor style"
+        while len(image_prompt) < self._owner.completion_chars:
+            image_prompt += ", " + _PROMPT_FILLER
+        page = {
+            "page_number": 1,
+            "text": "むかし むかし あるところに\nくまさんが すんでいました",
+            "image_prompt": image_prompt,
+        }
+        pages_count = re.search(r"^ページ数: (\d+)ページ", prompt, re.M)
+        schema_name = kwargs.get("response_format", {}).get("json_schema", {}).get("name")
+        if schema_name == "PageTextRepair":
+            # 本文の修正依頼（_ensure_valid_page_text）
+            content = json.dumps({"text": page["text"]}, ensure_ascii=False)
+        elif prompt.startswith("絵本のあらすじを更新"):
+            # あらすじ更新（_update_story_summary）のプロンプト
+            content = "くまさんが もりで ともだちと であい いっしょに あそんだ"
+        elif pages_count:
+            # 絵本一括生成（generate_story_text）のプロンプト
+            pages = [{**page, "page_number": n} for n in range(1, int(pages_count.group(1)) + 1)]
+            content = json.dumps({"title": "くまさんの だいぼうけん", "pages": pages}, ensure_ascii=False)
+        else:
+            page_number = re.search(r"ページ番号: (\d+)", prompt)
+            if page_number:
+                page["page_number"] = int(page_number.group(1))
+            content = json.dumps(page, ensure_ascii=False)
+        return ChatCompletion.model_validate({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            # 日本語はおおむね1文字1トークンとして見積もる
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 120, "total_tokens": prompt_tokens + 120},
+        })
+
+
+class _FakeChat:
+    def __init__(self, owner: "FakeAsyncOpenAI"):
+        self.completions = _FakeCompletions(owner)
+
+
+class _FakeImages:
+    def __init__(self, owner: "FakeAsyncOpenAI"):
+        self._owner = owner
+        self.with_raw_response = _WithRawResponse(generate=self.generate)
+
+    async def generate(self, model, prompt, **kwargs):
+        # quality="low"（プログレッシブ表示のプレビュー）は短時間で返す
+        scale = 0.3 if kwargs.get("quality") == "low" else 1.0
+        await asyncio.sleep(self._owner.latency(self._owner.image_latency * scale))
+        owner = self._owner
+        if owner.image_bytes > 0 or owner.unique_images:
+            # 毎回異なる画像にする（内容アドレスの保存で重複とみなされず、毎回アップロードされる）
+            size = max(owner.image_bytes, 192)
+            b64_json = await asyncio.to_thread(lambda: base64.b64encode(random_png(size)).decode("ascii"))
+        else:
+            b64_json = base64.b64encode(TINY_PNG).decode("ascii")
+        return ImagesResponse.model_validate({
+            "created": int(time.time()),
+            "data": [{"b64_json": b64_json}],
+        })
+
+
+class FakeAsyncOpenAI:
+    """AsyncOpenAI の代替（chat.completions.create / images.generate / close のみ）
+
+    jitter: レイテンシのばらつき（0.2 なら ±20% の一様分布）
+    completion_chars: ページ応答の image_prompt をこの文字数まで伸ばす（応答サイズの調整）
+    image_bytes: 0 より大きければ、このサイズ前後のランダムな PNG を b64_json で返す（0 なら 1x1 PNG）
+    unique_images: 1x1 の代わりに毎回異なる小さな PNG を返す
+    """
+
+    def __init__(
+        self,
+        text_latency: float = 0.3,
+        image_latency: float = 0.5,
+        jitter: float = 0.0,
+        completion_chars: int = 0,
+        image_bytes: int = 0,
+        unique_images: bool = False,
+    ):
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.jitter = jitter
+        self.completion_chars = completion_chars
+        self.image_bytes = image_bytes
+        self.unique_images = unique_images
+        self.chat = _FakeChat(self)
+        self.images = _FakeImages(self)
+
+    def latency(self, base: float) -> float:
+        if self.jitter <= 0:
+            return base
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def close(self) -> None:
+        """AsyncOpenAI.close と同じ（閉じる接続は無い）"""
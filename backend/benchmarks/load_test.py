@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+ストーリーセッションの負荷試験（/page/first → /page/next × pages）
+
+OpenAI をプロセス内のフェイク（レイテンシ・応答サイズ・画像サイズを指定可能）に、Supabase を
+フェイクの supabase-py Client（--storage client、実装の SupabaseService をそのまま通す）、
+インメモリの MockSupabaseService（--storage mock）、または一時ディレクトリの SQLite + ファイル
+（--storage local、LocalStorageService）に差し替え、同時セッションを再生する。
+スループット、エンドポイントごとの p50 / p95 / p99、ワーカープロセスごとのメモリを表示する。
+
+    cd backend
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --sessions 64 --concurrency 16 --image-bytes 1500000
+    python -m benchmarks.load_test --workers 4 --storage mock --json results.json
+    python -m benchmarks.load_test --storage local
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# サービス初期化に必要な環境変数（実際の接続は行わない）
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark-service-key")
+# 保存先は --storage で選ぶ（client では SupabaseService の supabase-py Client をフェイクに差し替える）
+os.environ["STORAGE_BACKEND"] = "supabase"
+
+import httpx
+
+from app.main import app
+from app.services.mock_supabase_service import MockSupabaseService
+from app.services.local_storage_service import LocalStorageService
+from app.services.image_derivatives import shutdown_pool
+from .fakes import FakeAsyncOpenAI, FakeSupabaseClient
+
+
+def install_fakes(args, services) -> None:
+    """lifespan で生成したサービスの OpenAI / Supabase をフェイクに差し替える"""
+    service = services.openai
+    service.client = FakeAsyncOpenAI(
+        text_latency=args.text_latency,
+        image_latency=args.image_latency,
+        jitter=args.jitter,
+        completion_chars=args.completion_chars,
+        image_bytes=args.image_bytes,
+        unique_images=True,
+    )
+    if args.storage == "client":
+        services.storage.client = FakeSupabaseClient(latency=args.db_latency, upload_latency=args.upload_latency)
+        return
+    if args.storage == "mock":
+        storage = MockSupabaseService(latency=args.db_latency, upload_latency=args.upload_latency)
+    else:
+        # ワーカーごとに別の一時ディレクトリ（--db-latency / --upload-latency は使わない）
+        directory = tempfile.mkdtemp(prefix="ehon-load-test-")
+        storage = LocalStorageService(
+            db_path=os.path.join(directory, "ehon.sqlite3"),
+            files_dir=os.path.join(directory, "storage"),
+            public_url_base="http://bench/storage",
+        )
+    services.storage = storage
+    service.storage = storage
+    service.derivatives.storage = storage
+
+
+def _rss_mib() -> float:
+    """現在の RSS（MiB）。/proc が無い環境ではピーク値で代用"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _peak_rss_mib()
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss は Linux では KiB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_session(client: httpx.AsyncClient, pages: int, samples: list) -> None:
+    """1セッション: /page/first の後に /page/next を pages 回呼び、(endpoint, 秒, status) を samples に追加"""
+
+    async def post(endpoint: str, payload: dict) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"/api/v1/generate/{endpoint}", json=payload)
+        except Exception:
+            samples.append((endpoint, time.perf_counter() - started, 0))
+            raise
+        samples.append((endpoint, time.perf_counter() - started, response.status_code))
+        return response
+
+    first = await post("page/first", {
+        "story_title": "くまさんの大冒険",
+        "total_pages": pages + 1,
+        "art_style": "watercolor",
+        "main_character_name": "くまのポン太",
+        "user_id": "bench-user",
+    })
+    if first.status_code != 200:
+        return
+    story_id = first.json()["story_id"]
+    for page_number in range(2, pages + 2):
+        await post("page/next", {
+            "story_id": story_id,
+            "page_number": page_number,
+            "user_direction": "もりで ともだちに あう",
+            "user_id": "bench-user",
+        })
+
+
+async def drive(args, sessions: int) -> dict:
+    """このプロセスで sessions 件のセッションを concurrency 件ずつ同時に実行する"""
+    logging.getLogger().setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport は lifespan を実行しないため、サービスの生成・終了はここで行う
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        install_fakes(args, app.state.services)
+        # 初回だけのコスト（派生画像のプロセスプール起動など）を計測から除く
+        for _ in range(args.warmup):
+            await run_session(client, 1, [])
+        rss_start = _rss_mib()
+
+        samples: list = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited() -> None:
+            async with semaphore:
+                try:
+                    await run_session(client, args.pages, samples)
+                except Exception as e:
+                    logging.getLogger(__name__).warning(f"Session failed: {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited() for _ in range(sessions)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "pid": os.getpid(),
+        "sessions": sessions,
+        "elapsed": elapsed,
+        "samples": samples,
+        "rss_start_mib": rss_start,
+        "rss_end_mib": _rss_mib(),
+        "peak_rss_mib": _peak_rss_mib(),
+    }
+
+
+def _worker(args, sessions: int) -> dict:
+    try:
+        return asyncio.run(drive(args, sessions))
+    finally:
+        shutdown_pool()
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """最近傍順位法のパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(results: list, wall: float) -> dict:
+    samples = [s for result in results for s in result["samples"]]
+    endpoints = {}
+    for name in sorted({s[0] for s in samples}):
+        latencies = sorted(s[1] for s in samples if s[0] == name)
+        errors = sum(1 for s in samples if s[0] == name and s[2] != 200)
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1),
+        }
+    return {
+        "wall_seconds": round(wall, 3),
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s[2] != 200),
+        "requests_per_second": round(len(samples) / wall, 2) if wall else 0.0,
+        "sessions_per_second": round(sum(r["sessions"] for r in results) / wall, 3) if wall else 0.0,
+        "endpoints": endpoints,
+        "workers": [
+            {
+                "pid": r["pid"],
+                "sessions": r["sessions"],
+                "rss_start_mib": round(r["rss_start_mib"], 1),
+                "rss_end_mib": round(r["rss_end_mib"], 1),
+                "peak_rss_mib": round(r["peak_rss_mib"], 1),
+            }
+            for r in results
+        ],
+    }
+
+
+def print_report(args, summary: dict) -> None:
+    print(f"🚀 ストーリーセッション負荷試験 - storage={args.storage} workers={args.workers} "
+          f"sessions={args.sessions} concurrency={args.concurrency}/worker pages={args.pages}")
+    print(f"   text={args.text_latency}s image={args.image_latency}s jitter=±{args.jitter:.0%} "
+          f"image_bytes={args.image_bytes} completion_chars={args.completion_chars} db={args.db_latency}s upload={args.upload_latency}s")
+    print(f"   {summary['requests']} requests in {summary['wall_seconds']}s: "
+          f"{summary['requests_per_second']} req/s, {summary['sessions_per_second']} sessions/s, errors={summary['errors']}")
+    print(f"{'endpoint':<12} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in summary["endpoints"].items():
+        print(f"{name:<12} {stats['requests']:>6} {stats['errors']:>6} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['max_ms']:>9}")
+    print(f"{'worker pid':<12} {'sessions':>8} {'rss start':>10} {'rss end':>10} {'peak rss':>10}  (MiB)")
+    for worker in summary["workers"]:
+        print(f"{worker['pid']:<12} {worker['sessions']:>8} {worker['rss_start_mib']:>10} "
+              f"{worker['rss_end_mib']:>10} {worker['peak_rss_mib']:>10}")
+
+
+def main(args) -> None:
+    # セッションをワーカーに均等に割り振る
+    shares = [args.sessions // args.workers + (1 if i < args.sessions % args.workers else 0) for i in range(args.workers)]
+    if args.workers == 1:
+        results = [_worker(args, shares[0])]
+    else:
+        # fork だとイベントループやスレッドの状態を引き継ぐため spawn で起動
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(_worker, [args] * args.workers, shares))
+    # 各ワーカーの計測区間（ウォームアップ後）のうち最長のものを全体の所要時間とする
+    summary = summarize(results, max(result["elapsed"] for result in results))
+    print_report(args, summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), **summary}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=32, help="全ワーカー合計のセッション数")
+    parser.add_argument("--concurrency", type=int, default=8, help="ワーカーごとの同時セッション数")
+    parser.add_argument("--pages", type=int, default=3, help="セッションあたりの /page/next 回数")
+    parser.add_argument("--workers", type=int, default=1, help="負荷をかけるプロセス数（それぞれがアプリを持つ）")
+    parser.add_argument("--warmup", type=int, default=1, help="計測前にワーカーごとに実行するセッション数")
+    parser.add_argument("--storage", choices=["client", "mock", "local"], default="client",
+                        help="client: SupabaseService + フェイクの supabase-py Client / mock: MockSupabaseService / "
+                             "local: LocalStorageService（一時ディレクトリ）")
+    parser.add_argument("--text-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2, help="OpenAI レイテンシのばらつき（0.2 で ±20%%）")
+    parser.add_argument("--completion-chars", type=int, default=0, help="ページ応答の image_prompt の文字数")
+    parser.add_argument("--image-bytes", type=int, default=0, help="生成画像のサイズ（0 なら小さな PNG）")
+    parser.add_argument("--db-latency", type=float, default=0.05)
+    parser.add_argument("--upload-latency", type=float, default=0.2)
+    parser.add_argument("--json", help="結果を JSON で保存するパス（変更前後の比較用）")
+    main(parser.parse_args())
@@ -8,6 +8,8 @@ CREATE TABLE stories (
   art_style TEXT NOT NULL DEFAULT 'watercolor',
   main_character_name TEXT NOT NULL,
   user_id UUID NOT NULL,
+  context_summary TEXT,
+  context_summary_through INTEGER NOT NULL DEFAULT 0,
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -21,6 +23,8 @@ CREATE TABLE pages (
   image_prompt TEXT NOT NULL,
   image_url TEXT,
   image_storage_path TEXT,
+  image_derivatives JSONB,
+  image_tier TEXT,
   created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   UNIQUE(story_id, page_number)
 );
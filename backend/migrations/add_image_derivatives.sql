@@ -0,0 +1,8 @@
+-- Add image derivatives (resized WebP/AVIF and thumbnail paths/URLs) to pages table
+DO $$ 
+BEGIN
+    -- Add image_derivatives column if it doesn't exist
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'pages' AND column_name = 'image_derivatives') THEN
+        ALTER TABLE pages ADD COLUMN image_derivatives JSONB;
+    END IF;
+END $$;
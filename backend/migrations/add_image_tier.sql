@@ -0,0 +1,8 @@
+-- Add image tier (which render is currently stored: preview / final) to pages table
+DO $$ 
+BEGIN
+    -- Add image_tier column if it doesn't exist
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'pages' AND column_name = 'image_tier') THEN
+        ALTER TABLE pages ADD COLUMN image_tier TEXT;
+    END IF;
+END $$;
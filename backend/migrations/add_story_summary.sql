@@ -0,0 +1,13 @@
+-- Add rolling summary of earlier pages (used to bound the next-page prompt) to stories table
+DO $$ 
+BEGIN
+    -- Add context_summary column if it doesn't exist
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'stories' AND column_name = 'context_summary') THEN
+        ALTER TABLE stories ADD COLUMN context_summary TEXT;
+    END IF;
+    
+    -- Add context_summary_through column (last page number included in the summary) if it doesn't exist
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'stories' AND column_name = 'context_summary_through') THEN
+        ALTER TABLE stories ADD COLUMN context_summary_through INTEGER NOT NULL DEFAULT 0;
+    END IF;
+END $$;